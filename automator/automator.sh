@@ -1,3 +1,4 @@
 #!/bin/bash
 
-python3 src/main.py
+# exec: python replaces the shell, so it's the service's main process (signals, sd_notify)
+exec python3 src/main.py
@@ -0,0 +1,197 @@
+"""
+Stub of the python-vlc module, covering what the tasks use. Nothing is decoded or played:
+the stub only records when playback would become audible.
+  FAKE_VLC_INIT_DELAY     seconds taken by vlc.Instance() (libvlc plugin scan)
+  FAKE_VLC_BUFFER_DELAY   seconds between play() and the first audible sample
+  FAKE_VLC_NO_CALLBACKS   if set, the instance has no media_new_callbacks (older python-vlc)
+Media read through callbacks are really read: play() opens them and pulls a first block.
+"""
+import os
+import time
+import ctypes
+
+# Monotonic time at which the first player became audible, and the media it opened,
+# reset by the benchmark between runs
+audible_at = None
+audible_media = None
+instances_created = 0
+
+
+def _delay(name):
+    return float(os.environ.get(name, "0"))
+
+
+def reset():
+    global audible_at, audible_media
+    audible_at = None
+    audible_media = None
+
+
+class PlaybackMode:
+    default = 0
+    loop = 1
+    repeat = 2
+
+
+# Block size of the reads of a callback media
+READ_SIZE = 32768
+
+
+class CallbackDecorators:
+    MediaOpenCb = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.POINTER(ctypes.c_void_p),
+                                   ctypes.POINTER(ctypes.c_uint64))
+    MediaReadCb = ctypes.CFUNCTYPE(ctypes.c_ssize_t, ctypes.c_void_p, ctypes.POINTER(ctypes.c_char), ctypes.c_size_t)
+    MediaSeekCb = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.c_uint64)
+    MediaCloseCb = ctypes.CFUNCTYPE(None, ctypes.c_void_p)
+
+
+class Media:
+    def __init__(self, mrl, *options):
+        self.mrl = mrl
+        self.options = list(options)
+
+    def add_option(self, option):
+        self.options.append(option)
+
+    def open(self):
+        pass
+
+    def close(self):
+        pass
+
+    def release(self):
+        pass
+
+
+class CallbackMedia(Media):
+    def __init__(self, open_cb, read_cb, seek_cb, close_cb, opaque):
+        super().__init__('imem://')
+        self.callbacks = (open_cb, read_cb, seek_cb, close_cb)
+        self.opaque = opaque
+        self.opened = False
+
+    def open(self):
+        open_cb, read_cb, _, _ = self.callbacks
+        data, size = ctypes.c_void_p(self.opaque), ctypes.c_uint64()
+        if open_cb(self.opaque, ctypes.byref(data), ctypes.byref(size)) != 0:
+            raise RuntimeError("open callback failed")
+        self.opened = True
+        buffer = ctypes.create_string_buffer(READ_SIZE)
+        if read_cb(data, ctypes.cast(buffer, ctypes.POINTER(ctypes.c_char)), READ_SIZE) <= 0:
+            raise RuntimeError("read callback returned no data")
+
+    def close(self):
+        if self.opened:
+            self.opened = False
+            self.callbacks[3](self.opaque)
+
+
+class MediaList:
+    def __init__(self, mrls=()):
+        self.items = [Media(mrl) for mrl in mrls]
+
+    def add_media(self, media):
+        self.items.append(media)
+        return 0
+
+    def release(self):
+        pass
+
+
+class MediaPlayer:
+    def __init__(self):
+        self.media = None
+        self.volume = 100
+        self.playing = False
+
+    def set_media(self, media):
+        self.media = media
+
+    def audio_set_volume(self, volume):
+        self.volume = volume
+        return 0
+
+    def audio_get_volume(self):
+        return self.volume
+
+    def play(self):
+        global audible_at, audible_media
+        if not self.playing and self.media is not None:
+            self.media.open()
+        if not self.playing and audible_at is None:
+            audible_at = time.monotonic() + _delay("FAKE_VLC_BUFFER_DELAY")
+            audible_media = self.media
+        self.playing = True
+        return 0
+
+    def set_pause(self, do_pause):
+        self.playing = not do_pause
+
+    def is_playing(self):
+        return int(self.playing)
+
+    def stop(self):
+        self.playing = False
+        if self.media is not None:
+            self.media.close()
+
+    def release(self):
+        self.stop()
+
+
+class MediaListPlayer:
+    def __init__(self):
+        self.media_list = None
+        self.player = MediaPlayer()
+        self.mode = PlaybackMode.default
+
+    def set_media_list(self, media_list):
+        self.media_list = media_list
+
+    def set_playback_mode(self, mode):
+        self.mode = mode
+
+    def get_media_player(self):
+        return self.player
+
+    def play(self):
+        self.player.set_media(self.media_list.items[0] if self.media_list and self.media_list.items else None)
+        return self.player.play()
+
+    def set_pause(self, do_pause):
+        self.player.set_pause(do_pause)
+
+    def stop(self):
+        self.player.stop()
+
+    def release(self):
+        self.player.release()
+
+
+class Instance:
+    def __init__(self, *args):
+        global instances_created
+        time.sleep(_delay("FAKE_VLC_INIT_DELAY"))
+        instances_created += 1
+        self.args = args
+
+    def media_player_new(self):
+        return MediaPlayer()
+
+    def media_new(self, mrl, *options):
+        return Media(mrl, *options)
+
+    @property
+    def media_new_callbacks(self):
+        if os.environ.get("FAKE_VLC_NO_CALLBACKS"):
+            raise AttributeError("media_new_callbacks")
+        return CallbackMedia
+
+    def media_list_new(self, mrls=()):
+        return MediaList(mrls)
+
+    def media_list_player_new(self):
+        return MediaListPlayer()
+
+    def release(self):
+        pass
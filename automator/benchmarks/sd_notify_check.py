@@ -0,0 +1,146 @@
+"""
+Checks the sd_notify client and the service watchdog against a local stand-in for systemd:
+an AF_UNIX datagram socket passed in NOTIFY_SOCKET, with a short WatchdogSec. No systemd needed.
+  - READY=1 and STATUS= reach the socket
+  - the scheduler loop ticking sends WATCHDOG=1
+  - while the loop is blocked inside a task within its max_run_time, the helper thread keeps pinging
+  - past max_run_time (or blocked outside of any task) the pings stop, with a "Blocked" status
+
+Usage (from the automator folder):
+    python3 benchmarks/sd_notify_check.py
+Exits with status 1 if any check fails.
+"""
+import os
+import sys
+import time
+import socket
+import shutil
+import tempfile
+import types
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), 'src'))
+
+from orchestrator.sd_notify import SystemdNotifier, ServiceWatchdog  # noqa: E402
+
+WATCHDOG_SEC = 0.4
+MAX_RUN_TIME = 1.5
+
+
+class FakeScheduler:
+    """What ServiceWatchdog reads of AgingPriorityScheduler."""
+
+    def __init__(self):
+        self.current_task = None
+        self.current_since = None
+
+    def enter(self, task_name):
+        self.current_task = types.SimpleNamespace(name=task_name)
+        self.current_since = time.monotonic()
+
+    def leave(self):
+        self.current_task = self.current_since = None
+
+
+def received(server, seconds):
+    """The datagrams that reach the stand-in socket within seconds."""
+    messages = []
+    deadline = time.monotonic() + seconds
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return messages
+        server.settimeout(remaining)
+        try:
+            messages.append(server.recv(4096).decode())
+        except socket.timeout:
+            return messages
+
+
+def pings(messages):
+    return sum(1 for message in messages if 'WATCHDOG=1' in message.split('\n'))
+
+
+def statuses(messages):
+    return [line[len('STATUS='):] for message in messages for line in message.split('\n')
+            if line.startswith('STATUS=')]
+
+
+def main():
+    work_dir = tempfile.mkdtemp(prefix='sdnotify-')
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    failures = []
+
+    def check(name, ok, details=''):
+        print(f"{'ok  ' if ok else 'FAIL'} {name}{f' ({details})' if details and not ok else ''}")
+        if not ok:
+            failures.append(name)
+
+    try:
+        socket_path = os.path.join(work_dir, 'notify')
+        server.bind(socket_path)
+        environ = {'NOTIFY_SOCKET': socket_path, 'WATCHDOG_USEC': str(int(WATCHDOG_SEC * 1e6)),
+                   'WATCHDOG_PID': str(os.getpid())}
+        notifier = SystemdNotifier(environ=environ)
+        check("watchdog interval from WATCHDOG_USEC", notifier.watchdog_interval == WATCHDOG_SEC,
+              notifier.watchdog_interval)
+
+        notifier.ready("2 task(s)")
+        messages = received(server, 0.2)
+        check("READY=1 with its status", messages == ["READY=1\nSTATUS=2 task(s)"], messages)
+
+        scheduler = FakeScheduler()
+        watchdog = ServiceWatchdog(notifier, scheduler, {'long_task': MAX_RUN_TIME},
+                                   status_provider=lambda: "2 task(s), all fine")
+        watchdog.start()
+        # The scheduler loop turning: a tick per iteration
+        start = time.monotonic()
+        while time.monotonic() - start < 1.0:
+            watchdog.tick()
+            time.sleep(0.05)
+        messages = received(server, 0.1)
+        check("ticks ping the watchdog", pings(messages) >= 3, pings(messages))
+        check("ticks send the status", "2 task(s), all fine" in statuses(messages), statuses(messages))
+
+        # The loop blocked inside a task, within its max_run_time: the helper thread covers it
+        scheduler.enter('long_task')
+        messages = received(server, MAX_RUN_TIME - 0.2)
+        check("pings inside max_run_time", pings(messages) >= 2, pings(messages))
+        check("running status", any(text.startswith("Running long_task") for text in statuses(messages)),
+              statuses(messages))
+
+        # Past max_run_time: the pings stop, so that systemd restarts the service
+        crossing = received(server, 0.5)
+        messages = received(server, WATCHDOG_SEC * 3)
+        check("no pings past max_run_time", pings(messages) == 0, pings(messages))
+        check("blocked status", any(text.startswith("Blocked in task long_task")
+                                    for text in statuses(crossing + messages)), statuses(crossing + messages))
+
+        # A task without max_run_time (0 = no limit) is covered for as long as it runs
+        scheduler.enter('unlimited_task')
+        received(server, WATCHDOG_SEC)
+        messages = received(server, WATCHDOG_SEC * 3)
+        check("pings for a task without limit", pings(messages) >= 2, pings(messages))
+
+        # Blocked outside of any task: no pings
+        scheduler.leave()
+        received(server, WATCHDOG_SEC)
+        messages = received(server, WATCHDOG_SEC * 3)
+        check("no pings when blocked outside of tasks", pings(messages) == 0, pings(messages))
+
+        notifier.stopping()
+        check("STOPPING=1", received(server, 0.2) == ["STOPPING=1"])
+
+        # Outside of a Type=notify unit every call is a no-op
+        check("no socket, no notifications", SystemdNotifier(environ={}).ready() is False)
+    finally:
+        server.close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if failures:
+        print(f"Failed: {', '.join(failures)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
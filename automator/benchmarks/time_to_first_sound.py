@@ -0,0 +1,232 @@
+"""
+End-to-end time-to-first-sound benchmark: seconds from the scheduled time of a task
+to the first audible sample, for radio_alarm and sleep_sounds.
+
+The tasks run for real (Task.fire -> thread_loop -> BluetoothHandler -> VLC), but against
+the fakes in benchmarks/fakes: a scripted bluetoothctl with configurable delays, yt-dlp and
+ffmpeg stand-ins and a stub vlc module. No Bluetooth, audio or network is needed.
+
+Usage (from the automator folder):
+    python3 benchmarks/time_to_first_sound.py                    # compare with baseline.json
+    python3 benchmarks/time_to_first_sound.py --update-baseline  # store the new numbers
+Exits with status 1 if a scenario got slower than the baseline by more than --tolerance.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+AUTOMATOR_DIR = os.path.dirname(BENCH_DIR)
+FAKES_DIR = os.path.join(BENCH_DIR, 'fakes')
+BASELINE_FILE = os.path.join(BENCH_DIR, 'baseline.json')
+
+# The fakes shadow the real vlc module and the bluetoothctl/yt-dlp executables
+sys.path[:0] = [FAKES_DIR, os.path.join(AUTOMATOR_DIR, 'src')]
+os.environ['PATH'] = os.path.join(FAKES_DIR, 'bin') + os.pathsep + os.environ.get('PATH', '')
+
+import vlc  # noqa: E402  (the stub)
+from task import Task, get_state_store  # noqa: E402
+from task import bluetooth_handler  # noqa: E402
+from orchestrator import audio_focus  # noqa: E402
+
+SPEAKER_MAC = 'EC:81:93:F8:23:2B'
+PHASES = ('dispatch', 'bluetooth', 'download', 'engine', 'buffering', 'other', 'total')
+
+# name -> (task, speaker already connected, libvlc already initialized, track already downloaded,
+#          libvlc can read media through callbacks)
+SCENARIOS = {
+    'radio_alarm/warm': ('radio_alarm', True, True, True, True),
+    'radio_alarm/cold': ('radio_alarm', False, False, True, True),
+    'sleep_sounds/warm': ('sleep_sounds', True, True, True, True),
+    'sleep_sounds/cold': ('sleep_sounds', False, False, False, True),
+    # The loop buffer played as a file in a MediaList, as with an older python-vlc
+    'sleep_sounds/medialist': ('sleep_sounds', True, True, True, False),
+}
+
+
+class Timeline:
+    """Accumulates the time spent in the instrumented phases of one run."""
+
+    def __init__(self):
+        self.phases = {}
+        self.marks = {}
+
+    def reset(self):
+        self.phases.clear()
+        self.marks.clear()
+
+    def wrap(self, phase, fn):
+        def timed(*args, **kwargs):
+            start = time.monotonic()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.phases[phase] = self.phases.get(phase, 0.0) + time.monotonic() - start
+        return timed
+
+    def mark(self, name, fn):
+        def marked(*args, **kwargs):
+            self.marks.setdefault(name, time.monotonic())
+            return fn(*args, **kwargs)
+        return marked
+
+
+def instrument_bluetooth(timeline):
+    handler_class = bluetooth_handler.BluetoothHandler
+    handler_class.__init__ = timeline.wrap('bluetooth', handler_class.__init__)
+    handler_class.connect = timeline.wrap('bluetooth', handler_class.connect)
+
+
+def prepare_task(task_name, timeline, cache_dir):
+    # A fresh import per scenario: the instrumentation below must not wrap a shared module twice
+    task = Task(os.path.join(AUTOMATOR_DIR, 'tasks', task_name, f"{task_name}.py"), fresh_module=True)
+    module = task.task_module
+    # The fade out comes after the first sound: don't spend its real time in every run
+    module.FADE_OUT = 0
+    module.get_vlc_instance = timeline.wrap('engine', module.get_vlc_instance)
+    module.thread_loop = timeline.mark('thread_loop', module.thread_loop)
+    if task_name == 'sleep_sounds':
+        module.CACHE_DIR = cache_dir
+        player_class = module.SleepSoundsPlayer
+        player_class.download_audio_if_needed = timeline.wrap('download', player_class.download_audio_if_needed)
+        player_class.prepare_loop_buffer = timeline.wrap('download', player_class.prepare_loop_buffer)
+        player_class.get_stop_datetime = lambda self: datetime.now()
+    return task
+
+
+def run_once(task, connected, warm_engine, cached, callbacks, timeline, cache_dir):
+    os.environ['FAKE_BT_PAIRED'] = SPEAKER_MAC
+    os.environ['FAKE_BT_CONNECTED'] = SPEAKER_MAC if connected else ''
+    os.environ['FAKE_VLC_NO_CALLBACKS'] = '' if callbacks else '1'
+    if not warm_engine:
+        audio_focus._vlc_instance = None
+    if not cached:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        os.makedirs(cache_dir)
+    vlc.reset()
+    timeline.reset()
+
+    scheduled = time.monotonic()
+    # The players yield their waits (an hour of radio) to the scheduler: skip them
+    for _ in task.fire(datetime.now()):
+        pass
+    if vlc.audible_at is None:
+        raise RuntimeError(f"{task.task_id} never started playing")
+    check_media(task.task_id, vlc.audible_media, callbacks)
+
+    result = dict(timeline.phases)
+    result['dispatch'] = timeline.marks['thread_loop'] - scheduled
+    result['buffering'] = float(os.environ.get('FAKE_VLC_BUFFER_DELAY', '0'))
+    result['total'] = vlc.audible_at - scheduled
+    measured = sum(result.get(phase, 0.0) for phase in PHASES if phase not in ('other', 'total'))
+    result['other'] = result['total'] - measured
+    return result
+
+
+def check_media(task_id, media, callbacks):
+    """sleep_sounds must play its decoded loop buffer: streamed, or as a raw file in a MediaList."""
+    if task_id != 'sleep_sounds':
+        return
+    if callbacks and not isinstance(media, vlc.CallbackMedia):
+        raise RuntimeError(f"sleep_sounds played {media.mrl} instead of streaming its loop buffer")
+    if not callbacks and not (media.mrl.endswith('.loop.pcm') and ':demux=rawaud' in media.options):
+        raise RuntimeError(f"sleep_sounds played {media.mrl} instead of its loop buffer file")
+
+
+def run_scenario(name, runs, timeline, cache_dir):
+    task_name, connected, warm_engine, cached, callbacks = SCENARIOS[name]
+    task = prepare_task(task_name, timeline, cache_dir)
+    if warm_engine or cached:
+        # Untimed run to warm up the engine and fill the track cache
+        run_once(task, True, True, True, callbacks, timeline, cache_dir)
+    results = [run_once(task, connected, warm_engine, cached, callbacks, timeline, cache_dir)
+               for _ in range(runs)]
+    return {phase: statistics.median(r.get(phase, 0.0) for r in results) for phase in PHASES}
+
+
+def compare(medians, baseline, tolerance):
+    regressions = []
+    header = f"{'scenario':<24}" + "".join(f"{phase:>11}" for phase in PHASES) + f"{'vs base':>10}"
+    print(header)
+    print('-' * len(header))
+    for name, phases in medians.items():
+        line = f"{name:<24}" + "".join(f"{phases[phase]:>10.3f}s" for phase in PHASES)
+        base = baseline.get('scenarios', {}).get(name)
+        if base:
+            change = (phases['total'] - base['total']) / base['total'] if base['total'] else 0.0
+            line += f"{change:>+9.0%}"
+            # Absolute slack so that tiny totals don't flag scheduler noise
+            if phases['total'] > base['total'] * (1 + tolerance) + 0.05:
+                regressions.append(name)
+                line += "  REGRESSION"
+        print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help="timed runs per scenario (the median is reported)")
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS), help="run only these scenarios")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="allowed slowdown vs the baseline (0.2 = 20%%)")
+    parser.add_argument('--update-baseline', action='store_true', help="store the results as the new baseline")
+    parser.add_argument('--pair-delay', type=float, default=1.0)
+    parser.add_argument('--connect-delay', type=float, default=1.5)
+    parser.add_argument('--command-delay', type=float, default=0.02, help="delay of every other bluetoothctl command")
+    parser.add_argument('--vlc-init-delay', type=float, default=0.4, help="cost of creating a libvlc instance")
+    parser.add_argument('--vlc-buffer-delay', type=float, default=0.3, help="from play() to the first sample")
+    parser.add_argument('--ytdlp-delay', type=float, default=0.5)
+    args = parser.parse_args()
+
+    settings = {
+        'FAKE_BT_PAIR_DELAY': args.pair_delay,
+        'FAKE_BT_CONNECT_DELAY': args.connect_delay,
+        'FAKE_BT_COMMAND_DELAY': args.command_delay,
+        'FAKE_VLC_INIT_DELAY': args.vlc_init_delay,
+        'FAKE_VLC_BUFFER_DELAY': args.vlc_buffer_delay,
+        'FAKE_YTDLP_DELAY': args.ytdlp_delay,
+    }
+    for key, value in settings.items():
+        os.environ[key] = str(value)
+
+    baseline = {}
+    if os.path.isfile(BASELINE_FILE):
+        with open(BASELINE_FILE, 'r') as f:
+            baseline = json.load(f)
+        if baseline.get('settings') != settings and not args.update_baseline:
+            print("Warning: the fake delays differ from the ones the baseline was recorded with")
+
+    work_dir = tempfile.mkdtemp(prefix='ttfs-')
+    try:
+        # Run history and locks go to a throwaway store
+        get_state_store(os.path.join(work_dir, 'state'))
+        timeline = Timeline()
+        instrument_bluetooth(timeline)
+        cache_dir = os.path.join(work_dir, 'cache')
+        os.makedirs(cache_dir)
+        medians = {name: run_scenario(name, args.runs, timeline, cache_dir)
+                   for name in (args.scenario or SCENARIOS)}
+    finally:
+        get_state_store().close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    regressions = compare(medians, baseline, args.tolerance)
+
+    if args.update_baseline:
+        scenarios = dict(baseline.get('scenarios', {}))
+        scenarios.update(medians)
+        with open(BASELINE_FILE, 'w') as f:
+            json.dump({'settings': settings, 'scenarios': scenarios}, f, indent=4)
+        print(f"Baseline written to {BASELINE_FILE}")
+    elif regressions:
+        print(f"Regressions: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
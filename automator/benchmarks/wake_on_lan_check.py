@@ -0,0 +1,115 @@
+"""
+Checks wake_until_ready against a local stand-in for the TV: a TCP listener on 127.0.0.1 that
+starts accepting connections some time after the first magic packet. Packets are only counted.
+  - a TV already awake gets no packet
+  - the call returns as soon as the port opens, with the packet resent in the meantime
+  - a TV that never wakes raises TVUnavailable at the deadline
+  - without an address it raises TVUnavailable at once (nothing probed, nothing sent)
+
+Usage (from the automator folder):
+    python3 benchmarks/wake_on_lan_check.py
+Exits with status 1 if any check fails.
+"""
+import os
+import sys
+import time
+import socket
+import threading
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), 'src'))
+
+from task.wake_on_lan import wake_until_ready  # noqa: E402
+from task.webos_tv import TVUnavailable  # noqa: E402
+
+MAC = 'AA:BB:CC:DD:EE:FF'
+HOST = '127.0.0.1'
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind((HOST, 0))
+        return probe.getsockname()[1]
+
+
+class FakeTV:
+    """Listens on port once woken_after seconds have passed since start()."""
+
+    def __init__(self, port, woken_after):
+        self.port = port
+        self.woken_after = woken_after
+        self.server = None
+        self.packets = []
+
+    def send(self, mac):
+        self.packets.append((time.monotonic(), mac))
+
+    def start(self):
+        if self.woken_after == 0:
+            self.listen()
+        elif self.woken_after is not None:
+            timer = threading.Timer(self.woken_after, self.listen)
+            timer.daemon = True
+            timer.start()
+        return self
+
+    def listen(self):
+        self.server = socket.create_server((HOST, self.port))
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+
+
+def main():
+    failures = []
+
+    def check(name, ok, details=''):
+        print(f"{'ok  ' if ok else 'FAIL'} {name}{f' ({details})' if details and not ok else ''}")
+        if not ok:
+            failures.append(name)
+
+    tv = FakeTV(free_port(), woken_after=0).start()
+    try:
+        elapsed = wake_until_ready(MAC, HOST, tv.port, deadline=5, sender=tv.send)
+        check("already awake: no packet", elapsed == 0.0 and not tv.packets, (elapsed, len(tv.packets)))
+    finally:
+        tv.close()
+
+    tv = FakeTV(free_port(), woken_after=1.5).start()
+    try:
+        elapsed = wake_until_ready(MAC, HOST, tv.port, deadline=5, sender=tv.send)
+        check("returns when the port opens", 1.4 <= elapsed < 2.2, f"{elapsed:.2f}s")
+        # Sent at 0 s and resent after 1 s (the next one would be at 3 s)
+        check("packet resent while waiting", len(tv.packets) == 2, len(tv.packets))
+        check("packets go to the MAC", all(mac == MAC for _, mac in tv.packets))
+    finally:
+        tv.close()
+
+    tv = FakeTV(free_port(), woken_after=None).start()
+    start = time.monotonic()
+    try:
+        wake_until_ready(MAC, HOST, tv.port, deadline=2, sender=tv.send)
+        check("never awake: TVUnavailable", False, "returned")
+    except TVUnavailable:
+        elapsed = time.monotonic() - start
+        check("never awake: TVUnavailable at the deadline", 2 <= elapsed < 2.5, f"{elapsed:.2f}s")
+
+    # Something listening locally must not pass for the TV
+    local = FakeTV(free_port(), woken_after=0).start()
+    tv = FakeTV(local.port, woken_after=None)
+    try:
+        wake_until_ready(MAC, None, local.port, deadline=2, sender=tv.send)
+        check("no address: TVUnavailable", False, "returned")
+    except TVUnavailable:
+        check("no address: TVUnavailable, nothing sent", not tv.packets, len(tv.packets))
+    finally:
+        local.close()
+
+    if failures:
+        print(f"Failed: {', '.join(failures)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,9 +2,9 @@
 
 # Check if a task name was provided
 if [ $# -eq 0 ]; then
-    echo "Usage: ./debug.sh <task_name>"
+    echo "Usage: ./debug.sh <task_name> [--runs N] [--cprofile] [--memory] [--imports] [--output FILE]"
     exit 1
 fi
 
-# Run the debug script with the provided task name
-python3 src/debug.py "$1" 
\ No newline at end of file
+# Run the debug script with the provided task name (and profiling options, if any)
+python3 src/debug.py "$@"
@@ -5,9 +5,15 @@ import getpass
 
 """
 This script creates a systemd user service to run the selected shell script at startup.
-The service will automatically restart if it crashes.
+The service will automatically restart if it crashes, or if its scheduler stops
+answering the watchdog (the orchestrator speaks the sd_notify protocol).
 """
 
+# Seconds without a watchdog ping from the scheduler loop before systemd restarts the service
+WATCHDOG_SEC = 30
+# Loading all the tasks (imports, config validation) must not take longer than this
+START_TIMEOUT_SEC = 120
+
 def find_sh_files():
     return [f for f in os.listdir() if f.endswith('.sh')]
 
@@ -45,7 +51,11 @@ Description=Automator Service
 After=network.target
 
 [Service]
-Type=simple
+Type=notify
+# The script may start python as a child of the shell instead of exec'ing it
+NotifyAccess=all
+WatchdogSec={WATCHDOG_SEC}
+TimeoutStartSec={START_TIMEOUT_SEC}
 Environment="PATH={current_path}"
 ExecStart=/bin/bash {shell_script_path}
 WorkingDirectory={working_dir}
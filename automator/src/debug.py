@@ -1,23 +1,53 @@
 import os
 import sys
+import argparse
 from orchestrator.orchestrator import Orchestrator
+from orchestrator.profiler import TaskProfiler, import_time_breakdown, DEFAULT_TOP
+from task import ConfigError
 
 ROOT_DIR = os.getcwd()
 TASKS_ROOT_FOLDER = os.path.join(ROOT_DIR, "tasks")
 
-def main():
-    if len(sys.argv) != 2:
-        print("Usage: python debug.py <task_name>")
-        sys.exit(1)
+def parse_args():
+    parser = argparse.ArgumentParser(
+        usage="python debug.py <task_name>[@<instance>] [profiling options]",
+        description="Run a task in debug mode: its thread_loop every second, forever. "
+                    "With a profiling option it runs --runs times instead and reports where the time and memory go.")
+    parser.add_argument("task_name")
+    profiling = parser.add_argument_group("profiling")
+    profiling.add_argument("--runs", type=int, help="run thread_loop this many times, timing each run (wall and CPU)")
+    profiling.add_argument("--cprofile", action="store_true", help="cProfile statistics of the runs")
+    profiling.add_argument("--memory", action="store_true", help="tracemalloc allocation diffs between runs")
+    profiling.add_argument("--imports", action="store_true", help="import time breakdown of the task module")
+    profiling.add_argument("--interval", type=float, default=0, help="seconds between two runs")
+    profiling.add_argument("--top", type=int, default=DEFAULT_TOP, help="lines of each report")
+    profiling.add_argument("--output", help="write the cProfile stats to this file (for pstats, snakeviz...)")
+    return parser.parse_args()
+
+def profile(orchestrator, args):
+    if args.imports:
+        import_time_breakdown(orchestrator.find_instance(args.task_name).task_file, top=args.top)
+        print()
+    if args.runs or args.cprofile or args.memory:
+        profiler = TaskProfiler(orchestrator.new_debug_task(args.task_name), runs=args.runs or 5,
+                                interval=args.interval, top=args.top, cprofile=args.cprofile or bool(args.output),
+                                memory=args.memory)
+        profiler.run()
+        if args.output:
+            profiler.save_cprofile(args.output)
 
-    task_name = sys.argv[1]
+def main():
+    args = parse_args()
     orchestrator = Orchestrator(TASKS_ROOT_FOLDER)
-    
+
     try:
-        orchestrator.run_task_debug(task_name)
-    except ValueError as e:
+        if args.runs or args.cprofile or args.memory or args.imports or args.output:
+            profile(orchestrator, args)
+        else:
+            orchestrator.run_task_debug(args.task_name)
+    except (ValueError, ConfigError) as e:
         print(f"Error: {e}")
         sys.exit(1)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
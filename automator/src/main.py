@@ -1,5 +1,7 @@
 from orchestrator.orchestrator import Orchestrator
+from task import ConfigError
 import os
+import sys
 
 # The current working directory is the one from where the python command is executed (and thus the one where the bat file resides)
 # It doesn't matter where the python file source code resides!
@@ -10,7 +12,12 @@ TASKS_ROOT_FOLDER = os.path.join(ROOT_DIR, "tasks")
 
 def main():
     orchestrator = Orchestrator(TASKS_ROOT_FOLDER)
-    orchestrator.run()
+    try:
+        orchestrator.run()
+    except ConfigError as e:
+        # Fail loudly at start instead of at the scheduled time
+        print(f"Error: {e}")
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -1,3 +1,8 @@
 from .orchestrator import Orchestrator
+from .scheduler import AgingPriorityScheduler
+from .message_bus import MessageBus, BusMessage, get_message_bus
+from .sd_notify import SystemdNotifier, ServiceWatchdog, get_notifier
+from .resource_monitor import ResourceMonitor
 
-__all__ = ['Orchestrator'] 
\ No newline at end of file
+__all__ = ['Orchestrator', 'AgingPriorityScheduler', 'MessageBus', 'BusMessage', 'get_message_bus',
+           'SystemdNotifier', 'ServiceWatchdog', 'get_notifier', 'ResourceMonitor'] 
\ No newline at end of file
@@ -0,0 +1,127 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Focus states handed to the owners' callbacks
+GAINED = 'gained'      # play at full volume
+DUCKED = 'ducked'      # keep playing at a lowered volume
+PAUSED = 'paused'      # pause, focus will come back when the preempting owner releases it
+LOST = 'lost'          # stop, focus is not coming back
+
+# Request modes
+EXCLUSIVE = 'exclusive'        # the current owner is paused
+MAY_DUCK = 'may_duck'          # the current owner is ducked, if it accepts ducking
+
+VLC_ARGS = ('--network-caching=3000', '--file-caching=3000', '--live-caching=3000', '--aout=pulse')
+
+
+class FocusRequest:
+    __slots__ = ('owner', 'priority', 'callback', 'mode', 'duckable', 'state')
+
+    def __init__(self, owner, priority, callback, mode, duckable):
+        self.owner = owner
+        self.priority = priority
+        self.callback = callback
+        self.mode = mode
+        self.duckable = duckable
+        self.state = None
+
+
+class AudioFocusManager:
+    """
+    Arbitrates the speaker between tasks: only one owner plays at full volume.
+    A request with a better (lower) pyRTOS priority than the current owner preempts it,
+    pausing or ducking it; when the preempting owner releases, the best remaining
+    owner is restored. A request that can't preempt waits, paused, until it gets its turn.
+    Callbacks run in the thread of whoever triggers the change, so they must be quick
+    (pause, set a volume), never blocking.
+    """
+
+    def __init__(self, message_bus=None):
+        self.requests = []   # kept sorted, best priority first, FIFO among equals
+        self.message_bus = message_bus
+        self._lock = threading.RLock()
+
+    def request(self, owner, priority, callback, mode=EXCLUSIVE, duckable=True):
+        """Ask for the speaker; returns the state initially granted (GAINED or PAUSED)."""
+        with self._lock:
+            self._remove(owner)
+            request = FocusRequest(owner, priority, callback, mode, duckable)
+            position = len(self.requests)
+            for i, other in enumerate(self.requests):
+                if priority < other.priority:
+                    position = i
+                    break
+            self.requests.insert(position, request)
+            self._rebalance()
+            return request.state
+
+    def release(self, owner):
+        with self._lock:
+            if self._remove(owner):
+                self._rebalance()
+
+    def owner(self):
+        with self._lock:
+            return self.requests[0].owner if self.requests else None
+
+    def _remove(self, owner):
+        for request in self.requests:
+            if request.owner == owner:
+                self.requests.remove(request)
+                return True
+        return False
+
+    def _rebalance(self):
+        if not self.requests:
+            return
+        top = self.requests[0]
+        self._set_state(top, GAINED)
+        for request in self.requests[1:]:
+            if top.mode == MAY_DUCK and request.duckable and request.state in (GAINED, DUCKED):
+                self._set_state(request, DUCKED)
+            else:
+                self._set_state(request, PAUSED)
+
+    def _set_state(self, request, state):
+        if request.state == state:
+            return
+        previous, request.state = request.state, state
+        logger.info(f"Audio focus: {request.owner} {previous or 'requested'} -> {state}")
+        try:
+            request.callback(state)
+        except Exception as e:
+            logger.error(f"Audio focus callback of {request.owner} failed: {e}")
+        if self.message_bus is not None:
+            self.message_bus.publish('audio.focus', (request.owner, state), source='audio_focus')
+
+
+_focus_manager = None
+_vlc_instance = None
+_singleton_lock = threading.Lock()
+
+
+def get_audio_focus():
+    """The process-wide focus manager; focus changes are also published on the 'audio.focus' bus topic."""
+    global _focus_manager
+    with _singleton_lock:
+        if _focus_manager is None:
+            from .message_bus import get_message_bus
+            bus = get_message_bus()
+            bus.register_topic('audio.focus', tuple)
+            _focus_manager = AudioFocusManager(bus)
+    return _focus_manager
+
+
+def get_vlc_instance():
+    """
+    A single libvlc instance shared by all the players and never released, so the
+    engine and its PulseAudio sink stay warm between runs and between tasks.
+    """
+    global _vlc_instance
+    with _singleton_lock:
+        if _vlc_instance is None:
+            import vlc
+            _vlc_instance = vlc.Instance(*VLC_ARGS)
+    return _vlc_instance
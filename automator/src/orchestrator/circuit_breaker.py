@@ -0,0 +1,94 @@
+import time
+import random
+import logging
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Restart delay after the n-th consecutive crash: BASE_DELAY * 2^(n-1), capped at MAX_DELAY,
+# with jitter so that tasks crashing together don't restart together
+BASE_DELAY = 5
+MAX_DELAY = 600
+# CRASH_BUDGET crashes within BUDGET_WINDOW seconds open the circuit
+CRASH_BUDGET = 5
+BUDGET_WINDOW = 3600
+# How long an open circuit keeps the task down before a half-open probe (doubled at each failed probe)
+OPEN_DURATION = 1800
+MAX_OPEN_DURATION = 6 * 3600
+# A task that runs this many seconds without crashing is considered recovered
+STABLE_AFTER = 300
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CrashCircuitBreaker:
+    """
+    Decides how long to wait before restarting a crashed task.
+    - closed:    the task restarts with exponential backoff and jitter
+    - open:      the crash budget is exhausted, the task stays down for open_duration
+    - half_open: a single probe run; if it survives STABLE_AFTER seconds the circuit
+                 closes again, if it crashes the circuit reopens for longer
+    """
+
+    def __init__(self, task_name, base_delay=BASE_DELAY, max_delay=MAX_DELAY, crash_budget=CRASH_BUDGET,
+                 budget_window=BUDGET_WINDOW, open_duration=OPEN_DURATION, stable_after=STABLE_AFTER):
+        self.task_name = task_name
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.crash_budget = crash_budget
+        self.budget_window = budget_window
+        self.initial_open_duration = open_duration
+        self.open_duration = open_duration
+        self.stable_after = stable_after
+
+        self.state = CLOSED
+        self.consecutive_crashes = 0
+        self.crash_times = deque()
+        self.started_at = None
+        self.last_error = None
+
+    def record_start(self):
+        """Called before every (re)start of the task."""
+        if self.state == OPEN:
+            self.state = HALF_OPEN
+            logger.warning(f"Task {self.task_name}: circuit half-open, probing with a single run")
+        self.started_at = time.monotonic()
+
+    def check_stable(self):
+        """Called while the task runs; closes the circuit once the task has been up long enough."""
+        if self.consecutive_crashes == 0 and self.state == CLOSED:
+            return
+        if self.started_at is not None and time.monotonic() - self.started_at >= self.stable_after:
+            if self.state == HALF_OPEN:
+                logger.warning(f"Task {self.task_name}: probe succeeded, circuit closed")
+            self.state = CLOSED
+            self.consecutive_crashes = 0
+            self.open_duration = self.initial_open_duration
+
+    def record_crash(self, error):
+        """Register a crash and return the number of seconds to wait before the next start."""
+        now = time.monotonic()
+        self.last_error = error
+        self.consecutive_crashes += 1
+        self.crash_times.append(now)
+        while self.crash_times and now - self.crash_times[0] > self.budget_window:
+            self.crash_times.popleft()
+
+        if self.state == HALF_OPEN:
+            self.open_duration = min(self.open_duration * 2, MAX_OPEN_DURATION)
+            return self._open(f"probe run crashed: {error}")
+        if len(self.crash_times) >= self.crash_budget:
+            return self._open(f"{len(self.crash_times)} crashes in {self.budget_window}s, last: {error}")
+
+        delay = min(self.max_delay, self.base_delay * 2 ** (self.consecutive_crashes - 1))
+        # "Equal jitter": at least half of the backoff, at most all of it
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _open(self, reason):
+        self.state = OPEN
+        self.crash_times.clear()
+        logger.critical(f"Task {self.task_name}: circuit opened ({reason}); "
+                        f"next probe in {self.open_duration}s")
+        return self.open_duration
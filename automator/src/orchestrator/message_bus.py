@@ -0,0 +1,173 @@
+import time
+import logging
+import threading
+import pyRTOS
+
+logger = logging.getLogger(__name__)
+
+# pyRTOS reserves message types below 128; this is the type of every bus message
+BUS_MESSAGE = 128
+# Default bound of each subscriber mailbox; when full, the oldest bus message is dropped
+DEFAULT_QUEUE_SIZE = 32
+# The delivery metrics of the topics with traffic are logged this often (seconds)
+METRICS_INTERVAL = 900
+
+
+class BusMessage(pyRTOS.Message):
+    """A pyRTOS message carrying a topic and a typed payload (passed by reference, never copied)."""
+
+    def __init__(self, topic, source, target, payload):
+        super().__init__(BUS_MESSAGE, source, target, payload)
+        self.topic = topic
+        self.published_ns = time.monotonic_ns()
+
+
+class TopicStats:
+    __slots__ = ('published', 'delivered', 'dropped', 'received', 'latency_total_ns', 'latency_max_ns')
+
+    def __init__(self):
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.received = 0
+        self.latency_total_ns = 0
+        self.latency_max_ns = 0
+
+    def as_dict(self):
+        avg_ns = self.latency_total_ns / self.received if self.received else 0
+        return {
+            'published': self.published,
+            'delivered': self.delivered,
+            'dropped': self.dropped,
+            'received': self.received,
+            'latency_avg_ms': avg_ns / 1e6,
+            'latency_max_ms': self.latency_max_ns / 1e6,
+        }
+
+
+class MessageBus:
+    """
+    Publish/subscribe between tasks, on top of the pyRTOS task mailboxes.
+    Topics are declared with the type their payload must have; subscribers are
+    pyRTOS tasks created with mailbox=True and attached by the orchestrator.
+    A task blocked on pyRTOS.wait_for_message wakes up as soon as it gets a message.
+    """
+
+    def __init__(self):
+        self.topics = {}          # topic -> payload type
+        self.subscribers = {}     # topic -> list of task names
+        self.queue_sizes = {}     # task name -> mailbox bound
+        self.tasks = {}           # task name -> pyRTOS.Task
+        self.stats = {}           # topic -> TopicStats
+        # Topics only known from a subscription (trigger.json), until their publisher declares them
+        self.undeclared = set()
+        self._last_metrics_log = time.monotonic()
+        self._published_at_last_log = 0
+        self._lock = threading.Lock()
+
+    def register_topic(self, topic, payload_type=object):
+        # A subscriber may come first: its topic then takes the type of the publisher's declaration
+        existing = self.topics.get(topic)
+        if existing is not None and existing is not payload_type and topic not in self.undeclared:
+            raise ValueError(f"Topic {topic} already registered with payload type {existing.__name__}")
+        self.topics[topic] = payload_type
+        self.undeclared.discard(topic)
+        self.stats.setdefault(topic, TopicStats())
+
+    def attach(self, pyrtos_task, queue_size=DEFAULT_QUEUE_SIZE):
+        self.tasks[pyrtos_task.name] = pyrtos_task
+        self.queue_sizes[pyrtos_task.name] = queue_size
+
+    def subscribe(self, task_name, topic):
+        if topic not in self.topics:
+            self.register_topic(topic)
+            self.undeclared.add(topic)
+        subscribers = self.subscribers.setdefault(topic, [])
+        if task_name not in subscribers:
+            subscribers.append(task_name)
+
+    def unsubscribe(self, task_name, topic):
+        if task_name in self.subscribers.get(topic, []):
+            self.subscribers[topic].remove(task_name)
+
+    def publish(self, topic, payload, source=None):
+        """Deliver payload to every subscriber of topic; returns the number of mailboxes reached."""
+        payload_type = self.topics.get(topic)
+        if payload_type is None:
+            raise ValueError(f"Unknown topic {topic}")
+        if not isinstance(payload, payload_type):
+            raise TypeError(f"Topic {topic} expects {payload_type.__name__}, got {type(payload).__name__}")
+
+        stats = self.stats[topic]
+        delivered = 0
+        with self._lock:
+            stats.published += 1
+            for task_name in self.subscribers.get(topic, []):
+                task = self.tasks.get(task_name)
+                if task is None:
+                    continue
+                mailbox = task._in_messages
+                if self._bus_message_count(mailbox) >= self.queue_sizes[task_name]:
+                    self._drop_oldest(mailbox)
+                task.deliver(BusMessage(topic, source, task, payload))
+                stats.delivered += 1
+                delivered += 1
+        return delivered
+
+    def receive(self, pyrtos_task):
+        """Drain the mailbox of a task, accounting the latency of the bus messages."""
+        with self._lock:
+            messages = pyrtos_task.recv()
+        now_ns = time.monotonic_ns()
+        for msg in messages:
+            if isinstance(msg, BusMessage):
+                stats = self.stats[msg.topic]
+                latency_ns = now_ns - msg.published_ns
+                stats.received += 1
+                stats.latency_total_ns += latency_ns
+                stats.latency_max_ns = max(stats.latency_max_ns, latency_ns)
+        return messages
+
+    def metrics(self):
+        return {topic: stats.as_dict() for topic, stats in self.stats.items()}
+
+    def maybe_log_metrics(self):
+        """Cheap enough to be called at every scheduler loop; logs only if something was published."""
+        if time.monotonic() - self._last_metrics_log >= METRICS_INTERVAL:
+            self.log_metrics()
+
+    def log_metrics(self):
+        self._last_metrics_log = time.monotonic()
+        published = sum(stats.published for stats in self.stats.values())
+        if published == self._published_at_last_log:
+            return
+        self._published_at_last_log = published
+        for topic, m in self.metrics().items():
+            if m['published']:
+                logger.info(f"Bus topic {topic}: {m['published']} published, {m['delivered']} delivered, "
+                            f"{m['received']} received, {m['dropped']} dropped, latency avg "
+                            f"{m['latency_avg_ms']:.1f} ms / max {m['latency_max_ms']:.1f} ms")
+
+    def _bus_message_count(self, mailbox):
+        return sum(1 for msg in mailbox if isinstance(msg, BusMessage))
+
+    def _drop_oldest(self, mailbox):
+        for i, msg in enumerate(mailbox):
+            if isinstance(msg, BusMessage):
+                del mailbox[i]
+                self.stats[msg.topic].dropped += 1
+                logger.warning(f"Mailbox of {msg.target.name} full, dropped oldest message on {msg.topic}")
+                return
+
+
+_bus = None
+_bus_lock = threading.Lock()
+
+
+def get_message_bus():
+    """The process-wide bus, shared by the orchestrator and the task modules."""
+    global _bus
+    with _bus_lock:
+        if _bus is None:
+            _bus = MessageBus()
+    return _bus
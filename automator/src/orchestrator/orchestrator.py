@@ -3,7 +3,14 @@ import os
 import pyRTOS
 import time
 import logging
-from task import Task
+from datetime import datetime
+from task import Task, ConfigError, load_trigger_config, priority_from_config, get_state_store
+from task.instance import discover_instances
+from .scheduler import AgingPriorityScheduler
+from .circuit_breaker import CrashCircuitBreaker
+from .message_bus import get_message_bus
+from .sd_notify import ServiceWatchdog, get_notifier
+from .resource_monitor import ResourceMonitor
 
 logger = logging.getLogger(__name__)
 
@@ -11,16 +18,30 @@ class Orchestrator:
     # Future idea: insert in the orchestrator object the list of all the tasks (as objects) present in the folder
     def __init__(self, tasks_root_folder):
         self.tasks_root_folder = tasks_root_folder
+        # One entry per task instance (a task folder may declare several, see task/instance.py)
         self.task_files = self.discover_task_files()
+        # Task name -> CrashCircuitBreaker, deciding when a crashed task may restart
+        self.circuit_breakers = {}
+        # Publish/subscribe between tasks, delivered into their pyRTOS mailboxes
+        self.message_bus = get_message_bus()
+        # Run history, per-task state and locks (automator/state/automator.db)
+        self.state_store = get_state_store()
+        # Task name -> the Task object running now (None while it restarts), for the service status
+        self.tasks = {}
+        # Task name -> max_run_time of its trigger.json, for the systemd watchdog
+        self.max_run_times = {}
+        # Samples RSS, fds, children (and allocations per task) to spot slow leaks; None when off
+        self.resource_monitor = ResourceMonitor.from_environment(tasks_root_folder)
 
-    # Get a list of all task scripts in the current directory and subdirectories
+    # Get a list of all task scripts in the current directory and subdirectories,
+    # as TaskInstances: the same script is listed once per instance of the task
     def discover_task_files(self):
         task_files = []
         for root, dirs, files in os.walk(self.tasks_root_folder):
             for dir_name in dirs:
                 task_file = os.path.join(root, dir_name, f"{dir_name}.py")
                 if os.path.isfile(task_file):
-                    task_files.append(task_file)
+                    task_files.extend(discover_instances(task_file))
         return task_files
     
     def run(self):
@@ -28,74 +49,156 @@ class Orchestrator:
         terminate_list = glob.glob("*.terminate")
         for terminate_item in terminate_list:
             os.remove(terminate_item)
-        # Create a robust wrapper for each task, then add to pyRTOS
-        for task_file in self.task_files:
-            pyRTOS.add_task(self._create_robust_pyRTOS_task(task_file))
+        # Create a robust wrapper for each task, then add to pyRTOS.
+        # All the configs are validated first: a broken one stops the orchestrator right here
+        pyrtos_tasks = []
+        config_errors = []
+        for instance in self.task_files:
+            try:
+                pyrtos_tasks.append(self._create_robust_pyRTOS_task(instance))
+            except ConfigError as e:
+                config_errors.append(str(e))
+        if config_errors:
+            raise ConfigError("Invalid task configuration:\n  " + "\n  ".join(config_errors))
+        for pyrtos_task in pyrtos_tasks:
+            pyRTOS.add_task(pyrtos_task)
         # Add a service routine to slow down the execution
         pyRTOS.add_service_routine(lambda: time.sleep(0.1))
-        # Start pyRTOS
-        pyRTOS.start()
+        # Write the batched run records every now and then
+        pyRTOS.add_service_routine(self.state_store.maybe_flush)
+        # Delivery metrics of the bus, in the log every now and then
+        pyRTOS.add_service_routine(self.message_bus.maybe_log_metrics)
+        scheduler = AgingPriorityScheduler()
+        # Under systemd (Type=notify): ready once the tasks are loaded, then the watchdog
+        # is fed from the loop itself, so a wedged scheduler gets the service restarted
+        notifier = get_notifier()
+        watchdog = ServiceWatchdog(notifier, scheduler, self.max_run_times, status_provider=self.service_status)
+        pyRTOS.add_service_routine(watchdog.tick)
+        notifier.ready(self.service_status())
+        watchdog.start()
+        if self.resource_monitor is not None:
+            self.resource_monitor.start()
+        # Start pyRTOS; higher priority tasks are dispatched first, waiting ones age to avoid starvation
+        pyRTOS.start(scheduler=scheduler)
+        notifier.stopping()
+        self.message_bus.log_metrics()
+        if self.resource_monitor is not None:
+            self.resource_monitor.stop()
 
-    def run_task_debug(self, task_name):
-        """Run a specific task in debug mode"""
-        # Find the task file
-        task_file = None
-        for root, dirs, files in os.walk(self.tasks_root_folder):
-            for dir_name in dirs:
-                if dir_name == task_name:
-                    task_file = os.path.join(root, dir_name, f"{dir_name}.py")
-                    break
-            if task_file:
-                break
+    def service_status(self):
+        """One line for systemctl status: how many tasks, which one is due next, which are down."""
+        upcoming = [(task.next_run, name) for name, task in self.tasks.items()
+                    if task is not None and getattr(task, 'next_run', None) and task.next_run != datetime.max]
+        down = [name for name, task in self.tasks.items() if task is None]
+        status = f"{len(self.tasks)} task(s)"
+        if upcoming:
+            next_run, name = min(upcoming)
+            status += f", next: {name} at {next_run:%a %H:%M}"
+        if down:
+            status += f", restarting: {', '.join(sorted(down))}"
+        growing = self.resource_monitor.flagged() if self.resource_monitor is not None else []
+        if growing:
+            status += f", growing: {', '.join(growing)}"
+        return status
 
-        if not task_file:
+    def find_instance(self, task_name):
+        """The TaskInstance with this task id ("task" or "task@instance")."""
+        instance = next((instance for instance in self.task_files if instance.task_id == task_name), None)
+        if instance is None:
             raise ValueError(f"Task {task_name} not found")
+        return instance
+
+    def new_debug_task(self, task_name):
+        """A Task of task_name in debug mode, outside of pyRTOS (e.g. to profile its runs)."""
+        return self._new_task(self.find_instance(task_name), debug=True)
+
+    def run_task_debug(self, task_name):
+        """Run a specific task in debug mode (task_name may be "task@instance")"""
+        instance = self.find_instance(task_name)
 
         # Create that task in debug mode and add it
-        def debug_wrapper(self_task):
-            while True:
-                # Re-instantiate a Task object each time we “restart”
-                task_instance = Task(task_file, debug=True)
-                try:
-                    yield from task_instance.run(self_task)
-                except Exception as e:
-                    logger.error(f"Task {task_name} crashed in debug mode: {e}")
-                    # Wait 5s, then restart
-                    yield [pyRTOS.timeout(5)]
-                    continue
-                else:
-                    # If it exits normally, break from the loop
-                    break
-        
-        pyRTOS.add_task(pyRTOS.Task(debug_wrapper, name=task_name))
+        first_instance = self._new_task(instance, debug=True)
+        debug_wrapper = self._robust_generator(task_name, instance, debug=True, first_instance=first_instance)
+        pyrtos_task = pyRTOS.Task(debug_wrapper, name=task_name, mailbox=True)
+        self._attach_to_bus(pyrtos_task, load_trigger_config(instance.instance_dir))
+
+        pyRTOS.add_task(pyrtos_task)
         pyRTOS.add_service_routine(lambda: time.sleep(0.1))
+        pyRTOS.add_service_routine(self.state_store.maybe_flush)
+        # Delivery metrics of the bus, in the log every now and then
+        pyRTOS.add_service_routine(self.message_bus.maybe_log_metrics)
         pyRTOS.start()
 
     
-    def _create_robust_pyRTOS_task(self, task_file):
+    def _create_robust_pyRTOS_task(self, instance):
         """
-        Returns a pyRTOS.Task whose generator re-creates and re-runs `Task(task_file)`
+        Returns a pyRTOS.Task whose generator re-creates and re-runs the Task of `instance`
         if it crashes with an unhandled exception.
         """
-        task_name = os.path.basename(os.path.dirname(task_file)) or "unknown_task"
+        task_name = instance.task_id or "unknown_task"
+        trigger_config = load_trigger_config(instance.instance_dir)
+        priority = priority_from_config(trigger_config)
+        self.max_run_times[task_name] = trigger_config.max_run_time
+
+        # The first instance is created now, so its configs are validated at start
+        try:
+            first_instance = self._new_task(instance)
+        except ConfigError:
+            raise
+        except Exception as e:
+            logger.error(f"Task {task_name} failed to load: {e}")
+            first_instance = None
+        self.tasks[task_name] = first_instance
+        robust_task_generator = self._robust_generator(task_name, instance, first_instance=first_instance)
+
+        pyrtos_task = pyRTOS.Task(robust_task_generator, priority=priority, name=task_name, mailbox=True)
+        self._attach_to_bus(pyrtos_task, trigger_config)
+        return pyrtos_task
+
+    def _attach_to_bus(self, pyrtos_task, trigger_config):
+        # "subscriptions" in trigger.json lists the bus topics delivered to the task's on_message
+        self.message_bus.attach(pyrtos_task)
+        for topic in trigger_config.subscriptions:
+            self.message_bus.subscribe(pyrtos_task.name, topic)
+
+    def _new_task(self, instance, debug=False, fresh_module=False):
+        return Task(instance.task_file, debug=debug, message_bus=self.message_bus, state_store=self.state_store,
+                    instance=instance, fresh_module=fresh_module)
+
+    def _robust_generator(self, task_name, instance, debug=False, first_instance=None):
+        """
+        Returns a generator function that wraps the real Task.run in a try/except loop.
+        Crashes are restarted with exponential backoff; a task that keeps crashing
+        opens its circuit breaker and stays down until a half-open probe succeeds.
+        """
+        breaker = CrashCircuitBreaker(task_name)
+        self.circuit_breakers[task_name] = breaker
+        mode = " in debug mode" if debug else ""
 
         def robust_task_generator(self_task):
-            """A generator that wraps the real Task.run in a try/except loop."""
+            task_instance = first_instance
             while True:
-                # Each loop iteration, we create a fresh Task object
-                task_instance = Task(task_file)
+                breaker.record_start()
                 try:
+                    # Each restart, we create a fresh Task object, on a fresh import of the module
+                    # (the other instances of the task keep the import they're running on)
+                    if task_instance is None:
+                        task_instance = self._new_task(instance, debug=debug, fresh_module=True)
+                    self.tasks[task_name] = task_instance
                     # The user’s actual code
-                    yield from task_instance.run(self_task)
+                    for block_conditions in task_instance.run(self_task):
+                        breaker.check_stable()
+                        yield block_conditions
                 except Exception as e:
-                    logger.error(f"Task {task_name} crashed: {e}")
-                    logger.info(f"Restarting {task_name} in 5 seconds...")
-                    # Wait 5s before attempting to restart
-                    yield [pyRTOS.timeout(5)]
+                    task_instance = None
+                    self.tasks[task_name] = None
+                    logger.error(f"Task {task_name} crashed{mode}: {e}")
+                    delay = breaker.record_crash(e)
+                    logger.info(f"Restarting {task_name} in {delay:.0f} seconds...")
+                    yield [pyRTOS.timeout(delay)]
                     continue
                 else:
                     # If the task's generator exits cleanly (or finds a .terminate), we stop
                     break
-        
-        return pyRTOS.Task(robust_task_generator, name=task_name)
-    
\ No newline at end of file
+
+        return robust_task_generator
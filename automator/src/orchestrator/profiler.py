@@ -0,0 +1,200 @@
+import io
+import os
+import re
+import sys
+import fnmatch
+import time
+import pstats
+import cProfile
+import tracemalloc
+import subprocess
+
+# Lines of each table of the reports
+DEFAULT_TOP = 15
+# tracemalloc keeps this many frames per allocation (1 is enough to group by line)
+TRACEMALLOC_FRAMES = 1
+# "import time:       812 |       1534 |   pyRTOS" (stderr of python -X importtime)
+IMPORTTIME_RE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S.*)$')
+# Allocations of the profiler itself (and of tracemalloc's filtering) aren't the task's
+IGNORED_FILES = (__file__, tracemalloc.__file__, fnmatch.__file__, os.path.join(os.path.dirname(re.__file__), '*'),
+                 '<frozen importlib._bootstrap>', '<frozen importlib._bootstrap_external>', '<unknown>')
+# Written to stderr right before the task module is imported: the imports of the
+# interpreter start and of the import machinery come before it
+IMPORT_MARKER = '-- task module --'
+
+
+class TaskProfiler:
+    """
+    Runs the thread_loop of a task N times in a row (as the debug mode does, without the
+    scheduler) and reports where the time and the memory go:
+      - timing:  wall and CPU time of each iteration
+      - cprofile: cProfile statistics of all the iterations
+      - memory:  tracemalloc allocation diffs between consecutive iterations
+    The import breakdown of the module is measured apart, in a fresh interpreter.
+    """
+
+    def __init__(self, task, runs=5, interval=0, top=DEFAULT_TOP, cprofile=False, memory=False, out=sys.stdout):
+        self.task = task
+        self.runs = runs
+        self.interval = interval
+        self.top = top
+        self.cprofile = cprofile
+        self.memory = memory
+        self.out = out
+        self.timings = []   # (wall, cpu) seconds per iteration
+        self.profile = None
+        self.memory_diffs = []  # (iteration, [StatisticDiff]) per iteration after the first
+
+    def print(self, text=''):
+        print(text, file=self.out)
+
+    def run(self):
+        self.profile = cProfile.Profile() if self.cprofile else None
+        if self.memory:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        previous = first = None
+        try:
+            for iteration in range(1, self.runs + 1):
+                wall, cpu = self.run_once()
+                self.timings.append((wall, cpu))
+                self.print(f"Iteration {iteration}/{self.runs}: {wall * 1000:.1f} ms wall, {cpu * 1000:.1f} ms CPU")
+                if self.memory:
+                    snapshot = self.snapshot()
+                    if previous is not None:
+                        self.memory_diffs.append((iteration, snapshot.compare_to(previous, 'lineno')))
+                    if first is None:
+                        first = snapshot
+                    previous = snapshot
+                if self.interval and iteration < self.runs:
+                    time.sleep(self.interval)
+        finally:
+            if self.memory:
+                tracemalloc.stop()
+        self.report(first, previous)
+
+    def run_once(self):
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        if self.profile is not None:
+            self.profile.enable()
+        try:
+            self.task.run_module()
+        finally:
+            if self.profile is not None:
+                self.profile.disable()
+        return time.perf_counter() - wall_start, time.process_time() - cpu_start
+
+    @staticmethod
+    def snapshot():
+        return tracemalloc.take_snapshot().filter_traces(
+            [tracemalloc.Filter(False, filename) for filename in IGNORED_FILES])
+
+    # ---- reports ----
+
+    def report(self, first, last):
+        self.report_timings()
+        if self.profile is not None:
+            self.report_cprofile()
+        if self.memory_diffs:
+            self.report_memory(first, last)
+
+    def report_timings(self):
+        walls = sorted(wall for wall, _ in self.timings)
+        cpus = [cpu for _, cpu in self.timings]
+        self.print()
+        self.print(f"== Timing ({len(walls)} iterations) ==")
+        self.print(f"wall: min {walls[0] * 1000:.1f} ms, median {walls[len(walls) // 2] * 1000:.1f} ms, "
+                   f"max {walls[-1] * 1000:.1f} ms")
+        self.print(f"CPU:  total {sum(cpus) * 1000:.1f} ms, mean {sum(cpus) / len(cpus) * 1000:.1f} ms "
+                   f"({sum(cpus) / max(sum(walls), 1e-9):.0%} of the wall time)")
+        if len(walls) > 1:
+            # The first run pays the lazy imports and warm-ups
+            first_wall = self.timings[0][0]
+            rest = [wall for wall, _ in self.timings[1:]]
+            self.print(f"first iteration {first_wall * 1000:.1f} ms, then mean {sum(rest) / len(rest) * 1000:.1f} ms")
+
+    def report_cprofile(self):
+        stream = io.StringIO()
+        stats = pstats.Stats(self.profile, stream=stream).strip_dirs().sort_stats('cumulative')
+        stats.print_stats(self.top)
+        self.print()
+        self.print("== cProfile (cumulative) ==")
+        self.print(stream.getvalue().strip())
+
+    def save_cprofile(self, path):
+        if self.profile is not None:
+            self.profile.dump_stats(path)
+            self.print(f"cProfile stats written to {path} (python -m pstats {path})")
+
+    def report_memory(self, first, last):
+        self.print()
+        self.print("== Memory (tracemalloc) ==")
+        for iteration, diffs in self.memory_diffs:
+            growth = sum(diff.size_diff for diff in diffs)
+            self.print(f"iteration {iteration}: {growth / 1024:+.1f} KiB")
+            for diff in [diff for diff in diffs if diff.size_diff][:min(self.top, 5)]:
+                self.print(f"    {format_diff(diff)}")
+        # A leak grows at every iteration: what the whole session added, by line
+        self.print(f"from iteration 1 to {self.runs}, top growth:")
+        for diff in [diff for diff in last.compare_to(first, 'lineno') if diff.size_diff > 0][:self.top]:
+            self.print(f"    {format_diff(diff)}")
+
+
+def format_diff(diff):
+    frame = diff.traceback[0]
+    return (f"{diff.size_diff / 1024:+8.1f} KiB {diff.count_diff:+6d} blocks  "
+            f"{shorten_path(frame.filename)}:{frame.lineno}")
+
+
+def shorten_path(path):
+    for prefix in sorted(sys.path, key=len, reverse=True):
+        if prefix and path.startswith(prefix + os.sep):
+            return path[len(prefix) + 1:]
+    return path
+
+
+def import_time_breakdown(task_file, top=DEFAULT_TOP, out=sys.stdout):
+    """
+    Import the task module in a fresh interpreter with -X importtime and print the
+    slowest imports: what a (re)start of the task pays before its first run.
+    """
+    source_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = ("import importlib.util, sys; "
+            f"spec = importlib.util.spec_from_file_location('task_module', {task_file!r}); "
+            "module = importlib.util.module_from_spec(spec); "
+            f"sys.stderr.write({IMPORT_MARKER!r} + chr(10)); sys.stderr.flush(); "
+            "spec.loader.exec_module(module)")
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [source_dir, env.get('PYTHONPATH')]))
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], env=env, cwd=os.getcwd(),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    elapsed = time.perf_counter() - start
+
+    imports = []   # (self us, cumulative us, depth, name)
+    errors = []
+    lines = result.stderr.splitlines()
+    if IMPORT_MARKER in lines:
+        lines = lines[lines.index(IMPORT_MARKER) + 1:]
+    for line in lines:
+        match = IMPORTTIME_RE.match(line)
+        if match:
+            imports.append((int(match.group(1)), int(match.group(2)), (len(match.group(3)) - 1) // 2, match.group(4)))
+        elif not line.startswith('import time:'):
+            errors.append(line)
+    if result.returncode != 0:
+        print(f"Importing {task_file} failed:", file=out)
+        print("\n".join(errors[-10:]), file=out)
+        return imports
+
+    top_level = [entry for entry in imports if entry[2] == 0]
+    total = sum(cumulative for _, cumulative, _, _ in top_level)
+    print(f"== Import time of {os.path.basename(task_file)} ==", file=out)
+    print(f"{len(imports)} modules imported by the task in {total / 1000:.1f} ms "
+          f"(with the interpreter start: {elapsed * 1000:.0f} ms)", file=out)
+    print("slowest top-level imports (cumulative):", file=out)
+    for _, cumulative, _, name in sorted(top_level, key=lambda entry: -entry[1])[:top]:
+        print(f"    {cumulative / 1000:8.1f} ms  {name}", file=out)
+    print("slowest modules (self):", file=out)
+    for self_us, _, _, name in sorted(imports, key=lambda entry: -entry[0])[:top]:
+        print(f"    {self_us / 1000:8.1f} ms  {name}", file=out)
+    return imports
@@ -0,0 +1,300 @@
+import os
+import time
+import signal
+import logging
+import threading
+import tracemalloc
+from collections import deque
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Off unless AUTOMATOR_MONITOR_INTERVAL (seconds between samples) is set, e.g. in the service unit;
+# AUTOMATOR_MONITOR_TRACEMALLOC=1 adds the Python allocations per task (costs memory and CPU)
+INTERVAL_ENV = 'AUTOMATOR_MONITOR_INTERVAL'
+TRACEMALLOC_ENV = 'AUTOMATOR_MONITOR_TRACEMALLOC'
+# Samples kept per metric: with a 5 minute interval, the last 24 hours
+CAPACITY = 288
+# Growth is judged on the last WINDOW samples: flagged when at least MONOTONIC_FRACTION of
+# the steps don't go down and the metric grew by its threshold over the window
+WINDOW = 12
+MONOTONIC_FRACTION = 0.9
+THRESHOLDS = {
+    'rss_kib': 2048,
+    'fds': 4,
+    'children': 2,
+    'threads': 2,
+}
+TASK_ALLOCATION_THRESHOLD = 1024   # KiB
+# Allocation lines listed per task in a report
+TOP_ALLOCATIONS = 10
+# Create this file in the automator folder (like the .terminate files) to get a report;
+# SIGUSR1 does the same
+REPORT_REQUEST_FILE = 'memory.report'
+REPORT_REQUEST_POLL = 5
+
+
+def read_rss_kib():
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def count_fds():
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except OSError:
+        return None
+
+
+def count_children():
+    """Child processes of this process (bluetoothctl, yt-dlp...), left running or not."""
+    pid = os.getpid()
+    try:
+        children = set()
+        for thread_id in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{thread_id}/children', 'r') as f:
+                children.update(f.read().split())
+        return len(children)
+    except OSError:
+        pass
+    # Kernels without the children files: scan the parent pid of every process
+    count = 0
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat', 'r') as f:
+                    if int(f.read().rsplit(')', 1)[1].split()[1]) == pid:
+                        count += 1
+            except (OSError, IndexError, ValueError):
+                continue
+    return count
+
+
+class Series:
+    """A fixed-size ring buffer of (timestamp, value) samples of one metric."""
+    __slots__ = ('name', 'threshold', 'samples', 'flagged', 'flagged_at')
+
+    def __init__(self, name, threshold, capacity=CAPACITY):
+        self.name = name
+        self.threshold = threshold
+        self.samples = deque(maxlen=capacity)
+        self.flagged = False
+        self.flagged_at = None
+
+    def add(self, timestamp, value):
+        if value is not None:
+            self.samples.append((timestamp, value))
+
+    def growing(self, window=WINDOW):
+        """True if the last window samples show a steady growth above the threshold."""
+        values = [value for _, value in list(self.samples)[-window:]]
+        if len(values) < window:
+            return False
+        steps = list(zip(values, values[1:]))
+        not_down = sum(1 for a, b in steps if b >= a)
+        return not_down >= MONOTONIC_FRACTION * len(steps) and values[-1] - values[0] >= self.threshold
+
+    def rate_per_hour(self):
+        """Least squares slope over the whole buffer, in units per hour."""
+        if len(self.samples) < 2:
+            return 0.0
+        t0 = self.samples[0][0]
+        xs = [(t - t0) / 3600 for t, _ in self.samples]
+        ys = [value for _, value in self.samples]
+        mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+        variance = sum((x - mean_x) ** 2 for x in xs)
+        if not variance:
+            return 0.0
+        return sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / variance
+
+    def update_flag(self):
+        """
+        Flag a steady growth (True when it's new). The flag stays until the metric goes back
+        below where it was when flagged: a leak that only pauses isn't reported twice.
+        """
+        if not self.samples:
+            return False
+        last = self.samples[-1][1]
+        if self.flagged:
+            if last < self.flagged_at:
+                self.flagged = False
+            return False
+        if self.growing():
+            self.flagged, self.flagged_at = True, self.samples[-WINDOW][1]
+            return True
+        return False
+
+
+class ResourceMonitor:
+    """
+    Samples, at a low frequency, what a long running orchestrator tends to leak: resident
+    memory, open file descriptors, child processes, threads and (optionally) the Python
+    allocations of each task, attributed by the file that allocated them. Every series is
+    a ring buffer; a steady growth is logged as a warning, and a report of everything can
+    be written at any time without restarting the service.
+    """
+
+    def __init__(self, tasks_root_folder, interval, trace_allocations=False, report_dir=None,
+                 capacity=CAPACITY):
+        self.tasks_root_folder = os.path.realpath(tasks_root_folder)
+        self.interval = interval
+        self.trace_allocations = trace_allocations
+        self.report_dir = report_dir or os.path.join(os.getcwd(), 'logs')
+        self.capacity = capacity
+        self.series = {name: Series(name, threshold, capacity) for name, threshold in THRESHOLDS.items()}
+        self.task_series = {}   # task folder -> Series of its traced allocations (bytes)
+        self.top_allocations = {}   # task folder -> latest [(size, count, "file:line")]
+        self.started_at = time.time()
+        self._report_requested = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_environment(cls, tasks_root_folder):
+        """The monitor configured by the environment, or None if it's off."""
+        interval = os.environ.get(INTERVAL_ENV)
+        if not interval:
+            return None
+        try:
+            interval = float(interval)
+        except ValueError:
+            logger.warning(f"{INTERVAL_ENV}={interval!r} is not a number of seconds: monitor off")
+            return None
+        return cls(tasks_root_folder, interval, trace_allocations=os.environ.get(TRACEMALLOC_ENV) == '1')
+
+    def start(self):
+        if self._thread is not None:
+            return
+        if self.trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start(1)
+        # Signal handlers can only be set from the main thread (where the orchestrator starts)
+        if threading.current_thread() is threading.main_thread() and hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, lambda signum, frame: self._report_requested.set())
+        self._thread = threading.Thread(target=self._loop, name='resource-monitor', daemon=True)
+        self._thread.start()
+        logger.info(f"Resource monitor sampling every {self.interval:.0f}s"
+                    f"{' with tracemalloc' if self.trace_allocations else ''}")
+
+    def stop(self):
+        self._stop.set()
+
+    def request_report(self):
+        self._report_requested.set()
+
+    def _loop(self):
+        next_sample = time.monotonic()
+        while not self._stop.is_set():
+            if time.monotonic() >= next_sample:
+                try:
+                    self.sample()
+                except Exception as e:
+                    logger.warning(f"Resource sample failed: {e}")
+                next_sample = time.monotonic() + self.interval
+            if self._report_requested.is_set() or os.path.exists(REPORT_REQUEST_FILE):
+                self._report_requested.clear()
+                # A failed report (full disk, logs/ not writable) must not end the monitoring
+                try:
+                    path = self.write_report()
+                    logger.info(f"Resource report written to {path}")
+                except Exception as e:
+                    logger.error(f"Resource report failed: {e}")
+                try:
+                    if os.path.exists(REPORT_REQUEST_FILE):
+                        os.remove(REPORT_REQUEST_FILE)
+                except OSError as e:
+                    logger.error(f"Could not remove {REPORT_REQUEST_FILE}: {e}")
+            self._stop.wait(min(REPORT_REQUEST_POLL, max(0.0, next_sample - time.monotonic())))
+
+    # ---- sampling ----
+
+    def sample(self):
+        now = time.time()
+        with self._lock:
+            self.series['rss_kib'].add(now, read_rss_kib())
+            self.series['fds'].add(now, count_fds())
+            self.series['children'].add(now, count_children())
+            self.series['threads'].add(now, threading.active_count())
+            if tracemalloc.is_tracing():
+                self.sample_allocations(now)
+            all_series = list(self.series.values()) + list(self.task_series.values())
+        for series in all_series:
+            if series.update_flag():
+                logger.warning(f"Resource monitor: {series.name} keeps growing ({series.flagged_at} -> "
+                               f"{series.samples[-1][1]} over the last {WINDOW} samples)")
+
+    def sample_allocations(self, now):
+        per_task = {}
+        lines = {}
+        for stat in tracemalloc.take_snapshot().statistics('lineno'):
+            frame = stat.traceback[0]
+            task = self.task_of(frame.filename)
+            if task is None:
+                continue
+            per_task[task] = per_task.get(task, 0) + stat.size
+            lines.setdefault(task, []).append((stat.size, stat.count, f"{frame.filename}:{frame.lineno}"))
+        for task, size in per_task.items():
+            series = self.task_series.get(task)
+            if series is None:
+                series = self.task_series[task] = Series(f"{task} alloc_kib", TASK_ALLOCATION_THRESHOLD,
+                                                         self.capacity)
+            series.add(now, size // 1024)
+        self.top_allocations = {task: sorted(task_lines, reverse=True)[:TOP_ALLOCATIONS]
+                                for task, task_lines in lines.items()}
+
+    def task_of(self, filename):
+        """Task folder a source file belongs to, None for the orchestrator and the libraries."""
+        if not filename.startswith(self.tasks_root_folder + os.sep):
+            return None
+        return filename[len(self.tasks_root_folder) + 1:].split(os.sep, 1)[0]
+
+    # ---- report ----
+
+    def flagged(self):
+        with self._lock:
+            return [series.name for series in list(self.series.values()) + list(self.task_series.values())
+                    if series.flagged]
+
+    def report(self):
+        with self._lock:
+            lines = [f"Resource report of pid {os.getpid()}, {datetime.now():%Y-%m-%d %H:%M:%S}",
+                     f"Monitoring since {datetime.fromtimestamp(self.started_at):%Y-%m-%d %H:%M:%S}, "
+                     f"one sample every {self.interval:.0f}s, {self.capacity} kept per metric",
+                     ""]
+            all_series = list(self.series.values()) + sorted(self.task_series.values(), key=lambda s: s.name)
+            lines.append(f"{'metric':<32}{'first':>12}{'min':>12}{'max':>12}{'last':>12}{'per hour':>14}  growth")
+            for series in all_series:
+                if not series.samples:
+                    continue
+                values = [value for _, value in series.samples]
+                lines.append(f"{series.name:<32}{values[0]:>12}{min(values):>12}{max(values):>12}{values[-1]:>12}"
+                             f"{series.rate_per_hour():>14.1f}  {'GROWING' if series.flagged else '-'}")
+
+            for task, allocations in sorted(self.top_allocations.items()):
+                lines.append("")
+                lines.append(f"Largest allocations of {task} (tracemalloc, latest sample):")
+                for size, count, where in allocations:
+                    lines.append(f"    {size / 1024:10.1f} KiB {count:8d} blocks  {where}")
+
+            lines.append("")
+            lines.append("Samples (oldest first):")
+            lines.append("time                 " + "".join(f"{name:>12}" for name in self.series))
+            timestamps = sorted({t for series in self.series.values() for t, _ in series.samples})
+            values = {name: dict(series.samples) for name, series in self.series.items()}
+            for t in timestamps:
+                lines.append(f"{datetime.fromtimestamp(t):%Y-%m-%d %H:%M:%S}  " +
+                             "".join(f"{values[name].get(t, ''):>12}" for name in self.series))
+        return "\n".join(lines) + "\n"
+
+    def write_report(self):
+        os.makedirs(self.report_dir, exist_ok=True)
+        path = os.path.join(self.report_dir, f"resource-report-{datetime.now():%Y%m%d-%H%M%S}.txt")
+        with open(path, 'w') as f:
+            f.write(self.report())
+        return path
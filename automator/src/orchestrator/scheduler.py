@@ -0,0 +1,75 @@
+import time
+import pyRTOS
+
+# A task that keeps waiting in the READY state gains AGING_STEP priority levels
+# every AGING_INTERVAL seconds, so low priority tasks can't be starved forever.
+# Aging never lifts a task above AGING_CEILING (the "high" class): "critical"
+# tasks, like the wake-up alarm, always win against aged background tasks.
+AGING_INTERVAL = 5
+AGING_STEP = 32
+AGING_CEILING = 64
+
+
+class AgingPriorityScheduler:
+    """
+    Drop-in replacement for pyRTOS.default_scheduler (pass it to pyRTOS.start).
+    Among the tasks that are ready, the one with the best effective priority runs;
+    ties favor the currently running task, then the best base priority.
+    """
+
+    def __init__(self, aging_interval=AGING_INTERVAL, aging_step=AGING_STEP, aging_ceiling=AGING_CEILING):
+        self.aging_interval = aging_interval
+        self.aging_step = aging_step
+        self.aging_ceiling = aging_ceiling
+        # Task -> monotonic time since which it is ready but not running
+        self.waiting_since = {}
+        # The task whose generator is being advanced right now, and since when (for the watchdog)
+        self.current_task = None
+        self.current_since = None
+
+    def effective_priority(self, task, now):
+        since = self.waiting_since.get(task)
+        if since is None:
+            return task.priority
+        boost = int((now - since) / self.aging_interval) * self.aging_step
+        return max(task.priority - boost, min(task.priority, self.aging_ceiling))
+
+    def __call__(self, tasks):
+        messages = []
+        now = time.monotonic()
+        running_task = None
+        candidates = []
+
+        for task in tasks:
+            if task.state == pyRTOS.BLOCKED:
+                if True in map(lambda x: next(x), task.ready_conditions):
+                    task.state = pyRTOS.READY
+                    task.ready_conditions = []
+            if task.state == pyRTOS.READY:
+                self.waiting_since.setdefault(task, now)
+                candidates.append(task)
+            elif task.state == pyRTOS.RUNNING:
+                running_task = task
+                candidates.append(task)
+
+        if not candidates:
+            return messages
+
+        chosen = min(candidates, key=lambda t: (self.effective_priority(t, now), t is not running_task, t.priority))
+        if running_task is not None and chosen is not running_task:
+            # Preempted: it starts waiting (and aging) from now
+            running_task.state = pyRTOS.READY
+            self.waiting_since[running_task] = now
+
+        chosen.state = pyRTOS.RUNNING
+        self.waiting_since.pop(chosen, None)
+        self.current_since = now
+        self.current_task = chosen
+        try:
+            messages = chosen.run_next()
+        except StopIteration:
+            tasks.remove(chosen)
+        finally:
+            self.current_task = None
+
+        return messages
@@ -0,0 +1,169 @@
+import os
+import time
+import socket
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# STATUS= is refreshed at most this often (and only when it changes)
+STATUS_INTERVAL = 10
+# Fraction of WatchdogSec between two pings, as systemd recommends
+PING_FRACTION = 0.5
+
+
+class SystemdNotifier:
+    """
+    Client of the sd_notify protocol: datagrams like "READY=1" sent to the socket systemd
+    passes in NOTIFY_SOCKET. Outside of a Type=notify unit there's no socket and every
+    call does nothing.
+    """
+
+    def __init__(self, socket_path=None, environ=None):
+        environ = os.environ if environ is None else environ
+        socket_path = socket_path or environ.get('NOTIFY_SOCKET')
+        # "@name" is a socket in the abstract namespace
+        if socket_path and socket_path.startswith('@'):
+            socket_path = '\0' + socket_path[1:]
+        self.socket_path = socket_path
+        self.socket = None
+        if socket_path:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.socket.setblocking(False)
+        self.watchdog_interval = self._watchdog_interval(environ)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _watchdog_interval(environ):
+        """WatchdogSec of the unit in seconds, None if the watchdog isn't armed for this process."""
+        usec = environ.get('WATCHDOG_USEC')
+        pid = environ.get('WATCHDOG_PID')
+        # The pings are meant for the main process: us, or the shell script that started us
+        # without exec (the unit then has NotifyAccess=all)
+        if not usec or (pid and pid not in (str(os.getpid()), str(os.getppid()))):
+            return None
+        try:
+            return int(usec) / 1e6
+        except ValueError:
+            return None
+
+    @property
+    def enabled(self):
+        return self.socket is not None
+
+    def notify(self, *assignments):
+        """Send "KEY=value" assignments in one datagram; False if they couldn't be delivered."""
+        if self.socket is None:
+            return False
+        try:
+            with self._lock:
+                self.socket.sendto('\n'.join(assignments).encode(), self.socket_path)
+            return True
+        except OSError as e:
+            logger.debug(f"sd_notify failed: {e}")
+            return False
+
+    def ready(self, status=None):
+        return self.notify('READY=1', *([f'STATUS={status}'] if status else []))
+
+    def status(self, text):
+        return self.notify(f'STATUS={text}')
+
+    def watchdog(self):
+        return self.notify('WATCHDOG=1')
+
+    def stopping(self):
+        return self.notify('STOPPING=1')
+
+
+class ServiceWatchdog:
+    """
+    Keeps systemd's watchdog fed while the scheduler loop turns: tick() is a pyRTOS
+    service routine, so a wedged loop stops the pings and systemd restarts the service.
+    A task's thread_loop runs inside the loop, though, and may legitimately block it
+    (a radio playing for an hour): while the loop is inside a task for less than that
+    task's max_run_time, a helper thread pings on its behalf. Past it, the task counts
+    as stuck and the pings stop.
+    """
+
+    def __init__(self, notifier, scheduler, max_run_times, status_provider=None):
+        self.notifier = notifier
+        self.scheduler = scheduler
+        # pyRTOS task name -> seconds its runs may block the loop (0: no limit)
+        self.max_run_times = max_run_times
+        self.status_provider = status_provider
+        self.interval = notifier.watchdog_interval * PING_FRACTION if notifier.watchdog_interval else None
+        self.last_ping = 0
+        self.last_tick = time.monotonic()
+        self.last_status = None
+        self.last_status_at = 0
+        self.stuck_task = None
+        self._thread = None
+
+    def start(self):
+        if self.interval is not None and self._thread is None:
+            self._thread = threading.Thread(target=self._cover, name='sd-watchdog', daemon=True)
+            self._thread.start()
+
+    def tick(self):
+        now = time.monotonic()
+        self.last_tick = now
+        if self.interval is not None and now - self.last_ping >= self.interval:
+            self.notifier.watchdog()
+            self.last_ping = now
+        if now - self.last_status_at >= STATUS_INTERVAL:
+            self.last_status_at = now
+            self.update_status()
+
+    def update_status(self, text=None):
+        if text is None and self.status_provider is not None:
+            try:
+                text = self.status_provider()
+            except Exception as e:
+                logger.debug(f"No service status: {e}")
+                return
+        if text and text != self.last_status:
+            self.last_status = text
+            self.notifier.status(text)
+
+    def _cover(self):
+        while True:
+            time.sleep(self.interval)
+            now = time.monotonic()
+            if now - self.last_tick < self.interval:
+                self.stuck_task = None
+                continue
+            # The loop is blocked: fine only inside a task, within its max_run_time
+            task, since = self.scheduler.current_task, self.scheduler.current_since
+            if task is None:
+                self._stuck(None, now - self.last_tick)
+                continue
+            running_for = now - since
+            limit = self.max_run_times.get(task.name, 0)
+            if limit and running_for > limit:
+                self._stuck(task.name, running_for)
+                continue
+            self.stuck_task = None
+            self.notifier.watchdog()
+            self.last_ping = now
+            self.update_status(f"Running {task.name} for {running_for:.0f}s")
+
+    def _stuck(self, task_name, seconds):
+        if self.stuck_task != (task_name or ''):
+            self.stuck_task = task_name or ''
+            where = f"in task {task_name}" if task_name else "outside of any task"
+            logger.error(f"Scheduler loop blocked {where} for {seconds:.0f}s: letting the systemd watchdog fire")
+            self.notifier.status(f"Blocked {where} for {seconds:.0f}s")
+
+
+_notifier = None
+_notifier_lock = threading.Lock()
+
+
+def get_notifier():
+    """The process-wide notifier (on the NOTIFY_SOCKET of the environment)."""
+    global _notifier
+    with _notifier_lock:
+        if _notifier is None:
+            _notifier = SystemdNotifier()
+    return _notifier
@@ -0,0 +1,205 @@
+import math
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two volume updates of a ramp: fine enough for VLC to sound continuous
+DEFAULT_STEP_INTERVAL = 0.02
+# Every set_volume of a WebOS TV is a websocket request: don't flood it
+WEBOS_STEP_INTERVAL = 0.25
+# Steepness of the exponential curve (loudness is perceived logarithmically,
+# so an exponential ramp sounds even where a linear one seems to jump at the start)
+EXPONENTIAL_STEEPNESS = 4
+
+
+def linear(progress):
+    return progress
+
+
+def exponential(progress):
+    return math.expm1(EXPONENTIAL_STEEPNESS * progress) / math.expm1(EXPONENTIAL_STEEPNESS)
+
+
+# A curve maps the progress of the ramp (0 to 1) to the fraction of the way from
+# the start to the end volume (0 to 1); any such callable can be passed instead of a name
+CURVES = {
+    'linear': linear,
+    'exponential': exponential,
+}
+
+
+class Ramp:
+    """One scheduled volume curve; wait() blocks until it ends (completed or cancelled)."""
+    __slots__ = ('key', 'setter', 'start', 'end', 'duration', 'curve', 'step_interval',
+                 'on_done', 'started', 'next_step', 'value', 'cancelled', '_done')
+
+    def __init__(self, key, setter, start, end, duration, curve, step_interval, on_done):
+        self.key = key
+        self.setter = setter
+        self.start = start
+        self.end = end
+        self.duration = duration
+        self.curve = curve
+        self.step_interval = step_interval
+        self.on_done = on_done
+        self.started = time.monotonic()
+        self.next_step = self.started
+        # Last volume applied; the first step always applies the start volume
+        self.value = None
+        self.cancelled = False
+        self._done = threading.Event()
+
+    def value_at(self, now):
+        progress = 1.0 if self.duration <= 0 else min(1.0, (now - self.started) / self.duration)
+        return round(self.start + (self.end - self.start) * self.curve(progress)), progress >= 1.0
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+
+class VolumeRamper:
+    """
+    Runs any number of volume ramps (VLC players, WebOS MediaControl, anything with
+    a volume setter) from a single timer thread: no thread or sleep loop per ramp.
+    Ramps are keyed by their target; a new ramp on a target replaces the running one
+    and, unless told otherwise, starts from the volume the previous one had reached.
+    Setters are called from the timer thread, so they must not block.
+    """
+
+    def __init__(self):
+        self.ramps = {}      # key -> running Ramp
+        self.levels = {}     # key -> last volume set through the ramper
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def ramp(self, key, setter, end, duration, start=None, curve='linear',
+             step_interval=DEFAULT_STEP_INTERVAL, on_done=None):
+        """
+        Move the volume of key from start (default: its current level, or end if unknown)
+        to end over duration seconds along curve. on_done(completed) is called from the
+        timer thread when the ramp ends: completed is False if it was cancelled or replaced.
+        """
+        curve = CURVES[curve] if isinstance(curve, str) else curve
+        with self._cond:
+            if start is None:
+                start = self.levels.get(key, end)
+            previous = self.ramps.pop(key, None)
+            ramp = Ramp(key, setter, start, end, duration, curve, step_interval, on_done)
+            self.ramps[key] = ramp
+            self._ensure_thread()
+            self._cond.notify()
+        if previous is not None:
+            self._finish(previous, completed=False)
+        return ramp
+
+    def set(self, key, setter, volume):
+        """Set a volume right away, cancelling the running ramp of key if any."""
+        self.cancel(key)
+        setter(volume)
+        with self._cond:
+            self.levels[key] = volume
+
+    def cancel(self, key):
+        with self._cond:
+            ramp = self.ramps.pop(key, None)
+        if ramp is not None:
+            self._finish(ramp, completed=False)
+
+    def forget(self, key):
+        """Drop everything known about key (e.g. its player was released)."""
+        self.cancel(key)
+        with self._cond:
+            self.levels.pop(key, None)
+
+    def level(self, key, default=None):
+        with self._cond:
+            return self.levels.get(key, default)
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='volume-ramper', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self.ramps:
+                    self._cond.wait()
+                now = time.monotonic()
+                next_step = min(ramp.next_step for ramp in self.ramps.values())
+                if next_step > now:
+                    self._cond.wait(next_step - now)
+                    continue
+                due = [ramp for ramp in self.ramps.values() if ramp.next_step <= now]
+                for ramp in due:
+                    ramp.next_step = now + ramp.step_interval
+
+            # Setters are called without holding the lock, so a callback may start new ramps
+            for ramp in due:
+                value, finished = ramp.value_at(now)
+                if value != ramp.value or finished:
+                    self._apply(ramp, value)
+                if finished:
+                    with self._cond:
+                        if self.ramps.get(ramp.key) is ramp:
+                            del self.ramps[ramp.key]
+                    self._finish(ramp, completed=not ramp.cancelled)
+
+    def _apply(self, ramp, value):
+        with self._cond:
+            # Replaced or cancelled in the meantime: its target belongs to someone else
+            if ramp.cancelled or self.ramps.get(ramp.key) is not ramp:
+                return
+            self.levels[ramp.key] = value
+        ramp.value = value
+        try:
+            ramp.setter(value)
+        except Exception as e:
+            logger.error(f"Volume ramp of {ramp.key} failed to set volume {value}: {e}")
+
+    def _finish(self, ramp, completed):
+        if ramp.done:
+            return
+        ramp.cancelled = not completed
+        ramp._done.set()
+        if ramp.on_done is not None:
+            try:
+                ramp.on_done(completed)
+            except Exception as e:
+                logger.error(f"Volume ramp callback of {ramp.key} failed: {e}")
+
+
+def vlc_setter(player):
+    """Volume setter of a VLC MediaPlayer."""
+    return player.audio_set_volume
+
+
+def webos_setter(media_control):
+    """Non-blocking volume setter of a pywebostv MediaControl (the TV's answer is not awaited)."""
+    def set_volume(volume):
+        media_control.set_volume(volume, callback=_ignore_webos_response)
+    return set_volume
+
+
+def _ignore_webos_response(status, payload):
+    if not status:
+        logger.warning(f"WebOS set_volume failed: {payload}")
+
+
+_ramper = None
+_ramper_lock = threading.Lock()
+
+
+def get_volume_ramper():
+    """The process-wide ramper: all the ramps of all the tasks share its single timer thread."""
+    global _ramper
+    with _ramper_lock:
+        if _ramper is None:
+            _ramper = VolumeRamper()
+    return _ramper
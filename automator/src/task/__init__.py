@@ -1,4 +1,15 @@
-from .task import Task
+from .task import Task, load_trigger_config, priority_from_config
 from .bluetooth_handler import BluetoothHandler
+from .state_store import StateStore, LockHeld, get_state_store
+from .instance import TaskInstance, current_instance, instance_file, instance_id
+from .webos_tv import TVSession, TVUnavailable, get_tv_session
+from .tv_discovery import TVDirectory, get_tv_directory, resolve_tv_host
+from .wake_on_lan import wake_until_ready, port_open
+from .clock import WallClockTimer, clock_synchronized
+from .config import ConfigError, ConfigObject, Field, ListOf, DictOf, BluetoothDevice, TriggerConfig, load_config
 
-__all__ = ['Task', 'BluetoothHandler'] 
\ No newline at end of file
+__all__ = ['Task', 'BluetoothHandler', 'load_trigger_config', 'priority_from_config', 'StateStore', 'LockHeld', 'get_state_store',
+           'TaskInstance', 'current_instance', 'instance_file', 'instance_id',
+           'TVSession', 'TVUnavailable', 'get_tv_session', 'TVDirectory', 'get_tv_directory', 'resolve_tv_host',
+           'wake_until_ready', 'port_open', 'WallClockTimer', 'clock_synchronized',
+           'ConfigError', 'ConfigObject', 'Field', 'ListOf', 'DictOf', 'BluetoothDevice', 'TriggerConfig', 'load_config'] 
\ No newline at end of file
@@ -1,7 +1,21 @@
+import re
 import logging
 import pexpect
 import time
 
+# "[bluetooth]#", or "[<device alias>]#" once a device is connected. pexpect matches with
+# DOTALL: keep the prompt on one line, or a greedy match would swallow several queued prompts
+PROMPT_PATTERN = r"\[[^\]\r\n]*\][^\r\n#]*#"
+# "Device EC:81:93:F8:23:2B Speaker name" lines of the "devices <filter>" listings
+DEVICE_LINE_RE = re.compile(r"^\s*Device (([0-9A-F]{2}:){5}[0-9A-F]{2})\b", re.MULTILINE)
+# "Paired: yes" lines of "info <MAC>"
+INFO_FLAG_RE = re.compile(r"^\s*(Paired|Connected|Trusted): (yes|no)\b", re.MULTILINE)
+STATUS_FILTERS = ("Paired", "Connected", "Trusted")
+# What older bluetoothctl versions answer to "devices <filter>"
+UNSUPPORTED_FILTER_REPLIES = ("Invalid command", "Too many arguments")
+# How long the bulk device status stays valid before bluetoothctl is asked again
+STATUS_TTL = 5
+
 class BluetoothHandler:
     """Linux implementation using a single bluetoothctl session"""
 
@@ -11,19 +25,28 @@ class BluetoothHandler:
         self.max_retries = 3
         self.retry_delay = 2
         self.logger = logging.getLogger(__name__)
+        # mac -> {'paired': bool, 'connected': bool, 'trusted': bool}, see device_status()
+        self.status = None
+        self.status_time = 0
+        # Older bluetoothctl versions don't know "devices <filter>" (and a batch that times
+        # out isn't retried): the status then comes from one "info <MAC>" per device
+        self.bulk_status_supported = True
 
         # Spawn a single bluetoothctl process
         self.btctl = pexpect.spawn("bluetoothctl", timeout=self.timeout)
-        # Turn agent on and set as default agent to handle pairing/passkey
-        self.btctl.sendline("agent on")
-        self.btctl.sendline("default-agent")
-
-        # Optional: Power on the Bluetooth adapter
-        self.btctl.sendline("power on")
-        # We expect a prompt or final line after each command; 
-        # so let's do a quick read to clear any immediate response.
+        # bluetoothctl prints a prompt when it starts and after each command:
+        # consume every one of them, otherwise a leftover prompt would be taken
+        # as the answer of the next command.
+        self.wait_for_prompt(timeout=2)
+        # Turn agent on and set as default agent to handle pairing/passkey,
+        # then power on the Bluetooth adapter
+        for command in ("agent on", "default-agent", "power on"):
+            self.btctl.sendline(command)
+            self.wait_for_prompt(timeout=2)
+
+    def wait_for_prompt(self, timeout):
         try:
-            self.btctl.expect(r"\[bluetooth\]?.*#", timeout=2)
+            self.btctl.expect(PROMPT_PATTERN, timeout=timeout)
         except pexpect.TIMEOUT:
             pass
 
@@ -43,7 +66,7 @@ class BluetoothHandler:
 
         # Build a combined pattern list that also includes the prompt
         # so we can know when bluetoothctl is "done" with its output.
-        combined_patterns = expect_patterns + [r"\[bluetooth\]?.*#"]
+        combined_patterns = expect_patterns + [PROMPT_PATTERN]
         index = -1
         output = ""
 
@@ -54,8 +77,10 @@ class BluetoothHandler:
                 # If i corresponds to one of our custom patterns (not the last prompt),
                 # return immediately.
                 if i < len(expect_patterns):
-                    # We matched one of our relevant patterns
+                    # We matched one of our relevant patterns; the prompt that
+                    # closes this command's output must not leak into the next one
                     output = self.btctl.before.decode(errors="replace")
+                    self.wait_for_prompt(timeout=1)
                     return i, output
                 else:
                     # We matched the prompt; 
@@ -66,11 +91,90 @@ class BluetoothHandler:
             self.logger.error(f"Command timed out: {command}")
             return -1, ""
 
+    def device_status(self, refresh=False):
+        """
+        Paired/connected/trusted state of all the configured devices, fetched with one
+        batch of "devices Paired/Connected/Trusted" commands (sent together, parsed in
+        a single pass) and cached for STATUS_TTL seconds.
+        Without device filters, from one "info <MAC>" per device. None if that fails too.
+        """
+        if not refresh and self.status is not None and time.monotonic() - self.status_time < STATUS_TTL:
+            return self.status
+        if not self.bulk_status_supported:
+            return self.info_status()
+
+        # A single write: pexpect pauses before every send, and bluetoothctl queues the lines
+        self.logger.debug("Querying the device status")
+        self.btctl.send("".join(f"devices {status_filter}\n" for status_filter in STATUS_FILTERS))
+        listed = {}
+        try:
+            # One prompt closes the output of each command, in order
+            for i, status_filter in enumerate(STATUS_FILTERS):
+                self.btctl.expect(PROMPT_PATTERN, timeout=self.timeout)
+                output = self.btctl.before.decode(errors="replace").replace("\r", "")
+                if any(reply in output for reply in UNSUPPORTED_FILTER_REPLIES):
+                    self.logger.info("bluetoothctl doesn't support device filters; using 'info' queries")
+                    self.bulk_status_supported = False
+                    # The other commands of the batch still answer with a prompt each
+                    for _ in range(len(STATUS_FILTERS) - i - 1):
+                        self.wait_for_prompt(timeout=1)
+                    return self.info_status()
+                listed[status_filter] = {match.group(1) for match in DEVICE_LINE_RE.finditer(output)}
+        except pexpect.TIMEOUT:
+            # Don't pay the timeout again at every check: from now on, "info" queries
+            self.logger.error("Device status query timed out; using 'info' queries")
+            self.bulk_status_supported = False
+            # Whatever prompts are still due must not answer the next commands
+            for _ in range(len(STATUS_FILTERS) - len(listed)):
+                self.wait_for_prompt(timeout=1)
+            return self.info_status()
+
+        self.status = {
+            mac: {key.lower(): mac in listed[key] for key in STATUS_FILTERS}
+            for mac in (self.device_mac(device) for device in self.devices)
+        }
+        self.status_time = time.monotonic()
+        return self.status
+
+    def info_status(self):
+        """The same status as device_status, from one "info <MAC>" per configured device."""
+        status = {}
+        for mac in (self.device_mac(device) for device in self.devices):
+            self.logger.debug(f"Running command: info {mac}")
+            self.btctl.sendline(f"info {mac}")
+            try:
+                self.btctl.expect(PROMPT_PATTERN, timeout=self.timeout)
+            except pexpect.TIMEOUT:
+                self.logger.error(f"Command timed out: info {mac}")
+                # A late answer must not be taken for the next command's
+                self.wait_for_prompt(timeout=1)
+                self.status = None
+                return None
+            output = self.btctl.before.decode(errors="replace").replace("\r", "")
+            flags = {key.lower(): value == "yes" for key, value in INFO_FLAG_RE.findall(output)}
+            # "Device ... not available": none of the flags
+            status[mac] = {key.lower(): flags.get(key.lower(), False) for key in STATUS_FILTERS}
+        self.status = status
+        self.status_time = time.monotonic()
+        return self.status
+
+    def update_status(self, mac_address, **flags):
+        """Record the outcome of a pair/trust/connect/disconnect in the cached status."""
+        if self.status is not None and mac_address in self.status:
+            self.status[mac_address].update(flags)
+
+    def invalidate_status(self):
+        self.status = None
+
     def is_paired(self, mac_address):
         """
-        Check if device is paired by parsing 'info <MAC>'.
-        We'll look for 'Paired: yes' in the output.
+        Check if device is paired, from the bulk status if possible, otherwise by
+        parsing 'info <MAC>' and looking for 'Paired: yes' in the output.
         """
+        status = self.device_status()
+        if status is not None and mac_address in status:
+            return status[mac_address]['paired']
+
         cmd = f"info {mac_address}"
         index, output = self.run_command(cmd, ["Paired: yes", "Paired: no", "not available"])
         # index = 0 -> matched "Paired: yes"
@@ -84,7 +188,11 @@ class BluetoothHandler:
         return False
 
     def is_connected(self, mac_address):
-        """Check if device is connected by parsing 'info'."""
+        """Check if device is connected, from the bulk status or by parsing 'info'."""
+        status = self.device_status()
+        if status is not None and mac_address in status:
+            return status[mac_address]['connected']
+
         index, output = self.run_command(
             f"info {mac_address}",
             ["Connected: yes", "Connected: no", "not available"]
@@ -95,24 +203,37 @@ class BluetoothHandler:
         # Could also parse the 'output' string if the matching lines differ
         return False
 
+    def is_trusted(self, mac_address):
+        status = self.device_status()
+        if status is not None and mac_address in status:
+            return status[mac_address]['trusted']
+        # Without any status, trust again: it's harmless
+        return False
+
+    @staticmethod
+    def device_mac(device):
+        # Handle both dictionary and string inputs
+        if isinstance(device, dict):
+            return device["mac_address"].upper()
+        return device.upper()
+
     def connect(self):
         """Try to connect to any of the configured devices."""
+        # A configured device that is already connected wins, whatever its position
+        # in the list; the status of all the devices costs a single query
         for device in self.devices:
-            # Handle both dictionary and string inputs
-            if isinstance(device, dict):
-                mac = device["mac_address"].upper()
-                name = device.get("name", "Unknown Device")
-            else:
-                mac = device.upper()
-                name = "Unknown Device"
-
-            self.logger.info(f"Attempting to connect to {name} ({mac})")
-
-            # Check if already connected
+            mac = self.device_mac(device)
             if self.is_connected(mac):
+                name = device.get("name", "Unknown Device") if isinstance(device, dict) else "Unknown Device"
                 self.logger.info(f"Device {name} ({mac}) is already connected")
                 return True
 
+        for device in self.devices:
+            mac = self.device_mac(device)
+            name = device.get("name", "Unknown Device") if isinstance(device, dict) else "Unknown Device"
+
+            self.logger.info(f"Attempting to connect to {name} ({mac})")
+
             # Try to connect with retries
             for attempt in range(self.max_retries):
                 try:
@@ -126,16 +247,22 @@ class BluetoothHandler:
                         )
                         if index not in [0, 2]:  # Not successful or not "Already paired"
                             self.logger.warning(f"Pair failed: {output.strip()}")
+                            self.invalidate_status()
                             continue
+                        self.update_status(mac, paired=True)
 
+                    if not self.is_trusted(mac):
                         # Trust the device
                         index, output = self.run_command(
                             f"trust {mac}",
                             ["trust succeeded", "trust failed"]
                         )
                         if index != 0:
+                            # A paired device may still connect: try anyway
                             self.logger.warning(f"Trust failed: {output.strip()}")
-                            continue
+                            self.invalidate_status()
+                        else:
+                            self.update_status(mac, trusted=True)
 
                     # Now attempt to connect
                     self.logger.info(f"Attempting connection to {mac} (attempt {attempt+1})...")
@@ -153,9 +280,11 @@ class BluetoothHandler:
                     # index = 2 means "Device is already connected"
                     if index in [0, 2]:
                         self.logger.info(f"Successfully connected to {name} ({mac})")
+                        self.update_status(mac, connected=True)
                         return True
                     else:
                         self.logger.warning(f"Connect attempt failed: {output.strip()}")
+                        self.invalidate_status()
 
                 except Exception as e:
                     self.logger.error(f"Attempt {attempt + 1} error: {str(e)}")
@@ -173,10 +302,7 @@ class BluetoothHandler:
         """Disconnect from any connected device."""
         disconnected_any = False
         for device in self.devices:
-            if isinstance(device, dict):
-                mac = device["mac_address"].upper()
-            else:
-                mac = device.upper()
+            mac = self.device_mac(device)
 
             if self.is_connected(mac):
                 index, output = self.run_command(
@@ -185,6 +311,7 @@ class BluetoothHandler:
                 )
                 if index == 0:
                     self.logger.info(f"Successfully disconnected from {mac}")
+                    self.update_status(mac, connected=False)
                     disconnected_any = True
                 else:
                     self.logger.error(f"Failed to disconnect from {mac} - {output.strip()}")
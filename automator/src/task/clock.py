@@ -0,0 +1,141 @@
+import os
+import time
+import errno
+import ctypes
+import ctypes.util
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# A Raspberry Pi has no RTC: until NTP syncs, the clock is whatever fake-hwclock saved at
+# the last shutdown (or 1970). Schedules wait for the sync, at most this many seconds
+TIME_SYNC_TIMEOUT = 120
+TIME_SYNC_POLL = 1
+# adjtimex() returns TIME_ERROR while the kernel clock is not synchronized
+TIME_ERROR = 5
+
+# timerfd (linux/timerfd.h)
+CLOCK_REALTIME = 0
+TFD_NONBLOCK = 0o4000
+TFD_CLOEXEC = 0o2000000
+TFD_TIMER_ABSTIME = 1
+TFD_TIMER_CANCEL_ON_SET = 2
+# Fallback without timerfd: a change of the wall clock against the monotonic one
+# bigger than this counts as the clock being set
+CLOCK_STEP_THRESHOLD = 2
+
+
+class _Timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+class _Itimerspec(ctypes.Structure):
+    _fields_ = [('it_interval', _Timespec), ('it_value', _Timespec)]
+
+
+class _Timex(ctypes.Structure):
+    # Only the mode is set; the kernel fills the rest (the padding covers the whole struct)
+    _fields_ = [('modes', ctypes.c_uint), ('_padding', ctypes.c_byte * 256)]
+
+
+_libc = None
+_libc_lock = threading.Lock()
+
+
+def _get_libc():
+    """libc with the timerfd and adjtimex calls, or False where there's none (not Linux)."""
+    global _libc
+    with _libc_lock:
+        if _libc is None:
+            _libc = False
+            path = ctypes.util.find_library('c')
+            if path and os.name == 'posix':
+                try:
+                    libc = ctypes.CDLL(path, use_errno=True)
+                    libc.timerfd_create, libc.timerfd_settime, libc.adjtimex
+                    _libc = libc
+                except (OSError, AttributeError):
+                    pass
+    return _libc
+
+
+def clock_synchronized():
+    """True once the system clock has been synchronized (always True where it can't be told)."""
+    libc = _get_libc()
+    if not libc:
+        return True
+    timex = _Timex()
+    return libc.adjtimex(ctypes.byref(timex)) != TIME_ERROR
+
+
+class WallClockTimer:
+    """
+    Expires at an absolute wall clock time (a datetime), whatever happens to the clock in
+    between, and also as soon as the clock is set (NTP step after boot, date changed by
+    hand): clock_set then tells the sleeper to compute its schedule again.
+    On Linux it's a timerfd with TFD_TIMER_CANCEL_ON_SET, elsewhere a comparison of
+    the wall clock with the monotonic one.
+    """
+
+    def __init__(self, deadline):
+        self.deadline = deadline.timestamp()
+        self.expired = False
+        self.clock_set = False
+        self.fd = None
+        self._offset = time.time() - time.monotonic()
+        libc = _get_libc()
+        if libc:
+            fd = libc.timerfd_create(CLOCK_REALTIME, TFD_NONBLOCK | TFD_CLOEXEC)
+            if fd >= 0:
+                spec = _Itimerspec()
+                # An absolute time in the past expires at once, as it should
+                spec.it_value.tv_sec = max(1, int(self.deadline))
+                spec.it_value.tv_nsec = int((self.deadline % 1) * 1e9)
+                if libc.timerfd_settime(fd, TFD_TIMER_ABSTIME | TFD_TIMER_CANCEL_ON_SET,
+                                        ctypes.byref(spec), None) == 0:
+                    self.fd = fd
+                else:
+                    logger.debug(f"timerfd_settime failed: {os.strerror(ctypes.get_errno())}")
+                    os.close(fd)
+
+    def poll(self):
+        """True once the timer expired or the clock was set (non-blocking)."""
+        if self.expired or self.clock_set:
+            return True
+        if self.fd is not None:
+            try:
+                os.read(self.fd, 8)
+                self.expired = True
+            except BlockingIOError:
+                pass
+            except OSError as e:
+                if e.errno != errno.ECANCELED:
+                    raise
+                self.clock_set = True
+        else:
+            offset = time.time() - time.monotonic()
+            if abs(offset - self._offset) > CLOCK_STEP_THRESHOLD:
+                self.clock_set = True
+            elif time.time() >= self.deadline:
+                self.expired = True
+        return self.expired or self.clock_set
+
+    def condition(self):
+        """pyRTOS block condition: ready when poll() is. The timer is closed once it fires."""
+        try:
+            while True:
+                fired = self.poll()
+                if fired:
+                    self.close()
+                yield fired
+        finally:
+            self.close()
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __del__(self):
+        self.close()
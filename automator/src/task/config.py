@@ -0,0 +1,298 @@
+import os
+import re
+import json
+import types
+import threading
+
+# Keys of trigger.json that only document the file
+DOCUMENTATION_KEYS = ('description', 'behavior_explanation', 'execution_scenarios')
+
+DAYS_OF_WEEK = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+TIME_OF_DAY_RE = re.compile(r'^([01]\d|2[0-3]):[0-5]\d$')
+MAC_ADDRESS_RE = re.compile(r'^([0-9A-Fa-f]{2}:){5}[0-9A-Fa-f]{2}$')
+
+# How a scheduled occurrence that was missed (orchestrator down, loop blocked by
+# another task across the scheduled minute) is handled:
+#   - run_late: run every missed occurrence that is still within the grace window
+#   - skip:     never run missed occurrences, wait for the next one
+#   - coalesce: run once for all the missed occurrences, if the latest is within grace
+MISFIRE_POLICIES = ('run_late', 'skip', 'coalesce')
+DEFAULT_MISFIRE_POLICY = 'coalesce'
+DEFAULT_MISFIRE_GRACE_TIME = 300
+
+# Priority classes of the "priority" field in trigger.json, mapped onto pyRTOS priorities
+# (the lower the number, the higher the priority). An integer 0-255 is accepted as well.
+PRIORITY_CLASSES = {
+    'critical': 0,
+    'high': 64,
+    'normal': 128,
+    'low': 192,
+    'background': 255,
+}
+DEFAULT_PRIORITY = 'normal'
+
+# Seconds a run of the task (its thread_loop) may keep the scheduler loop busy before the
+# orchestrator counts it as stuck and lets the systemd watchdog restart the service; 0: no limit
+DEFAULT_MAX_RUN_TIME = 300
+
+# Where the scheduled occurrences of a task come from:
+#   - trigger: time_of_day and days_of_week of trigger.json
+#   - module:  the task module's next_run_after(after), for timetables that
+#              don't fit a single daily time (thread_loop gets the scheduled time)
+SCHEDULE_SOURCES = ('trigger', 'module')
+
+
+class ConfigError(Exception):
+    """A configuration file is missing, malformed or doesn't match its schema."""
+
+
+class Field:
+    """Declares one key of a config object: its type, whether it's required, and extra checks."""
+    __slots__ = ('type', 'required', 'default', 'choices', 'check')
+
+    def __init__(self, type, required=True, default=None, choices=None, check=None):
+        self.type = type
+        self.required = required
+        self.default = default
+        self.choices = choices
+        # check(value) returns an error message, or None if the value is fine
+        self.check = check
+
+
+class ListOf:
+    """Schema of a JSON list whose items all match item_type; materialized as a tuple."""
+
+    def __init__(self, item_type, min_items=0):
+        self.item_type = item_type
+        self.min_items = min_items
+
+    @property
+    def __name__(self):
+        return f"list of {_type_name(self.item_type)}"
+
+
+class DictOf:
+    """Schema of a JSON object with free-form keys and values matching value_type; materialized read-only."""
+
+    def __init__(self, value_type):
+        self.value_type = value_type
+
+    @property
+    def __name__(self):
+        return f"object of {_type_name(self.value_type)}"
+
+
+class ConfigObject:
+    """
+    Base of the frozen config objects. Subclasses declare FIELDS (name -> Field)
+    and the matching __slots__; instances are built once, validated, and never change.
+    """
+    __slots__ = ()
+    FIELDS = {}
+
+    def __init__(self, **values):
+        for name in self.FIELDS:
+            object.__setattr__(self, name, values[name])
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is frozen")
+
+    def __repr__(self):
+        values = ', '.join(f"{name}={getattr(self, name)!r}" for name in self.FIELDS)
+        return f"{type(self).__name__}({values})"
+
+    def validate(self):
+        """Cross-field checks; return an error message or None."""
+        return None
+
+
+def _type_name(schema):
+    if isinstance(schema, tuple):
+        return ' or '.join(_type_name(t) for t in schema)
+    return schema.__name__
+
+
+def materialize(schema, data, where):
+    """Validate JSON data against schema and build the frozen objects (raises ConfigError)."""
+    if isinstance(schema, ListOf):
+        if not isinstance(data, list):
+            raise ConfigError(f"{where}: expected a list, got {type(data).__name__}")
+        if len(data) < schema.min_items:
+            raise ConfigError(f"{where}: expected at least {schema.min_items} item(s)")
+        return tuple(materialize(schema.item_type, item, f"{where}[{i}]") for i, item in enumerate(data))
+
+    if isinstance(schema, DictOf):
+        if not isinstance(data, dict):
+            raise ConfigError(f"{where}: expected an object, got {type(data).__name__}")
+        return types.MappingProxyType({key: materialize(schema.value_type, value, f"{where}.{key}")
+                                       for key, value in data.items()})
+
+    if isinstance(schema, type) and issubclass(schema, ConfigObject):
+        if not isinstance(data, dict):
+            raise ConfigError(f"{where}: expected an object, got {type(data).__name__}")
+        values = {}
+        for name, field in schema.FIELDS.items():
+            if name not in data:
+                if field.required:
+                    raise ConfigError(f"{where}: missing required key '{name}'")
+                values[name] = field.default
+                continue
+            value = materialize(field.type, data[name], f"{where}.{name}")
+            if field.choices is not None and value not in field.choices:
+                raise ConfigError(f"{where}.{name}: {value!r} is not one of {', '.join(map(str, field.choices))}")
+            if field.check is not None:
+                error = field.check(value)
+                if error:
+                    raise ConfigError(f"{where}.{name}: {error}")
+            values[name] = value
+        unknown = set(data) - set(schema.FIELDS) - set(DOCUMENTATION_KEYS)
+        if unknown:
+            raise ConfigError(f"{where}: unknown key(s) {', '.join(sorted(unknown))}")
+        obj = schema(**values)
+        error = obj.validate()
+        if error:
+            raise ConfigError(f"{where}: {error}")
+        return obj
+
+    # Plain JSON type (or tuple of types); bool is not accepted where a number is expected
+    if isinstance(data, bool) and not _accepts_bool(schema):
+        raise ConfigError(f"{where}: expected {_type_name(schema)}, got bool")
+    if not isinstance(data, schema):
+        raise ConfigError(f"{where}: expected {_type_name(schema)}, got {type(data).__name__}")
+    return data
+
+
+def _accepts_bool(schema):
+    return bool in schema if isinstance(schema, tuple) else schema is bool
+
+
+# ---- common checks ----
+
+def check_time_of_day(value):
+    if not TIME_OF_DAY_RE.match(value):
+        return f"{value!r} is not a HH:MM time"
+    return None
+
+
+def check_days_of_week(values):
+    unknown = [day for day in values if day not in DAYS_OF_WEEK]
+    if unknown:
+        return f"unknown day(s) {', '.join(unknown)}"
+    return None
+
+
+def check_mac_address(value):
+    if not MAC_ADDRESS_RE.match(value):
+        return f"{value!r} is not a MAC address"
+    return None
+
+
+def check_priority(value):
+    if isinstance(value, int):
+        if not 0 <= value <= 255:
+            return f"{value} is not a pyRTOS priority (0-255)"
+    elif value not in PRIORITY_CLASSES:
+        return f"{value!r} is not one of {', '.join(PRIORITY_CLASSES)}"
+    return None
+
+
+def check_non_negative(value):
+    if value < 0:
+        return f"must not be negative, got {value}"
+    return None
+
+
+# ---- common schemas ----
+
+class BluetoothDevice(ConfigObject):
+    FIELDS = {
+        'name': Field(str, required=False, default="Unknown Device"),
+        'mac_address': Field(str, check=check_mac_address),
+    }
+    __slots__ = tuple(FIELDS)
+
+
+class TriggerConfig(ConfigObject):
+    """Schema of trigger.json (see the behavior_explanation in the task folders)."""
+    FIELDS = {
+        'schedule_on': Field(bool),
+        'timeout_on': Field(bool),
+        'days_of_week': Field(ListOf(str), required=False, default=(), check=check_days_of_week),
+        'time_of_day': Field(str, required=False, check=check_time_of_day),
+        'timeout_interval': Field((int, float), required=False, default=0, check=check_non_negative),
+        'priority': Field((str, int), required=False, default=DEFAULT_PRIORITY, check=check_priority),
+        'misfire_policy': Field(str, required=False, default=DEFAULT_MISFIRE_POLICY, choices=MISFIRE_POLICIES),
+        'misfire_grace_time': Field((int, float), required=False, default=DEFAULT_MISFIRE_GRACE_TIME,
+                                    check=check_non_negative),
+        'subscriptions': Field(ListOf(str), required=False, default=()),
+        'schedule_source': Field(str, required=False, default='trigger', choices=SCHEDULE_SOURCES),
+        'max_run_time': Field((int, float), required=False, default=DEFAULT_MAX_RUN_TIME, check=check_non_negative),
+    }
+    __slots__ = tuple(FIELDS)
+
+    def validate(self):
+        if self.schedule_on and self.schedule_source == 'trigger' and \
+                (self.time_of_day is None or not self.days_of_week):
+            return "schedule_on requires time_of_day and days_of_week"
+        if self.timeout_on and not self.timeout_interval:
+            return "timeout_on requires a timeout_interval"
+        return None
+
+
+# ---- cache ----
+
+class ConfigCache:
+    """
+    Validated config objects by file path. A lookup costs one stat(): the file is
+    parsed and validated again only when its mtime or size changed.
+    """
+
+    def __init__(self):
+        self.entries = {}   # path -> (mtime_ns, size, schema, config object)
+        self._lock = threading.Lock()
+
+    def load(self, path, schema):
+        path = os.path.abspath(path)
+        try:
+            st = os.stat(path)
+        except OSError as e:
+            raise ConfigError(f"{path}: {e.strerror}")
+        with self._lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry[0] == st.st_mtime_ns and entry[1] == st.st_size and entry[2] is schema:
+                return entry[3]
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ConfigError(f"{path}: invalid JSON ({e})")
+        # Errors read like "radio_alarm/config.json.bluetooth_devices[0].mac_address: ..."
+        where = os.path.join(os.path.basename(os.path.dirname(path)), os.path.basename(path))
+        config = materialize(schema, data, where)
+        with self._lock:
+            self.entries[path] = (st.st_mtime_ns, st.st_size, schema, config)
+        return config
+
+    def invalidate(self, path=None):
+        with self._lock:
+            if path is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(os.path.abspath(path), None)
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_config_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ConfigCache()
+    return _cache
+
+
+def load_config(path, schema):
+    """Shortcut for the task modules: the validated, cached config object of a file."""
+    return get_config_cache().load(path, schema)
@@ -0,0 +1,87 @@
+import os
+import contextvars
+from contextlib import contextmanager
+
+# A task folder may declare more instances of its module, each in
+# <task folder>/instances/<name>/ with its own trigger.json and, optionally, its own copy
+# of any config file of the task (the task folder's copy is used for the others).
+# All the instances share a single import of the module, and with it its warm resources.
+INSTANCES_FOLDER = 'instances'
+# Task id of an instance: "radio_alarm@weekend" (the folder's own instance is just "radio_alarm")
+INSTANCE_SEPARATOR = '@'
+
+
+class TaskInstance:
+    """One schedulable instance of a task module."""
+    __slots__ = ('task_file', 'task_dir', 'name', 'instance_dir')
+
+    def __init__(self, task_file, name=None):
+        self.task_file = os.path.realpath(task_file)
+        self.task_dir = os.path.dirname(self.task_file)
+        self.name = name
+        self.instance_dir = os.path.join(self.task_dir, INSTANCES_FOLDER, name) if name else self.task_dir
+
+    @property
+    def task_id(self):
+        folder = os.path.basename(self.task_dir)
+        return f"{folder}{INSTANCE_SEPARATOR}{self.name}" if self.name else folder
+
+    def config_file(self, filename):
+        """The instance's own copy of filename if it has one, the task folder's otherwise."""
+        path = os.path.join(self.instance_dir, filename)
+        if self.name and not os.path.isfile(path):
+            return os.path.join(self.task_dir, filename)
+        return path
+
+    def __repr__(self):
+        return f"TaskInstance({self.task_id})"
+
+
+def discover_instances(task_file):
+    """The instances of a task folder: its own (if it has a trigger.json or no instances) plus instances/*."""
+    task_dir = os.path.dirname(task_file)
+    instances_dir = os.path.join(task_dir, INSTANCES_FOLDER)
+    names = []
+    if os.path.isdir(instances_dir):
+        names = sorted(name for name in os.listdir(instances_dir)
+                       if os.path.isfile(os.path.join(instances_dir, name, 'trigger.json')))
+    instances = []
+    if not names or os.path.isfile(os.path.join(task_dir, 'trigger.json')):
+        instances.append(TaskInstance(task_file))
+    instances.extend(TaskInstance(task_file, name) for name in names)
+    return instances
+
+
+# The instance whose code is running: set by Task around the module's thread_loop
+_current = contextvars.ContextVar('task_instance', default=None)
+
+
+def current_instance():
+    return _current.get()
+
+
+@contextmanager
+def running_instance(instance):
+    token = _current.set(instance)
+    try:
+        yield instance
+    finally:
+        _current.reset(token)
+
+
+def instance_file(filename, task_dir):
+    """
+    For task modules: path of one of their config files for the instance running now,
+    e.g. load_config(instance_file('config.json', CURRENT_TASK_DIR), MyConfig).
+    Outside of a run (or for another task's files) it's simply task_dir/filename.
+    """
+    instance = current_instance()
+    if instance is not None and instance.task_dir == os.path.realpath(task_dir):
+        return instance.config_file(filename)
+    return os.path.join(task_dir, filename)
+
+
+def instance_id(default):
+    """Task id of the instance running now (for state store keys and locks), default outside of a run."""
+    instance = current_instance()
+    return instance.task_id if instance is not None else default
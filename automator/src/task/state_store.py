@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import fcntl
+import sqlite3
+import atexit
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# automator/state/automator.db, whatever the working directory
+DEFAULT_STATE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'state')
+DB_FILENAME = 'automator.db'
+
+# Run records are buffered and written in one transaction every FLUSH_INTERVAL
+# seconds or BATCH_SIZE records, whatever comes first
+BATCH_SIZE = 50
+FLUSH_INTERVAL = 30
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    task TEXT NOT NULL,
+    scheduled_at TEXT,
+    started_at REAL NOT NULL,
+    duration REAL,
+    outcome TEXT NOT NULL,
+    detail TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_by_task ON runs (task, started_at DESC);
+CREATE TABLE IF NOT EXISTS task_state (
+    task TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (task, key)
+) WITHOUT ROWID;
+"""
+
+
+class LockHeld(Exception):
+    """Raised when a task lock is already held by another run (in this or another process)."""
+
+
+class StateStore:
+    """
+    Single SQLite database (WAL mode) holding the run history of every task and a
+    small key/value state per task. Run records are batched; state writes can be
+    made durable immediately when the caller depends on them (e.g. the last fire time).
+    """
+
+    def __init__(self, state_dir=DEFAULT_STATE_DIR):
+        self.state_dir = state_dir
+        os.makedirs(os.path.join(state_dir, 'locks'), exist_ok=True)
+        self.path = os.path.join(state_dir, DB_FILENAME)
+        self.conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        # With WAL, NORMAL is still crash safe (only the last transactions may be lost on power loss)
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._pending_runs = []
+        self._pending_state = {}
+        self._last_flush = time.monotonic()
+        self._lock = threading.RLock()
+        atexit.register(self.close)
+
+    # ---- run history ----
+
+    def record_run(self, task, started_at, duration, outcome, scheduled_at=None, detail=None):
+        with self._lock:
+            scheduled = scheduled_at.isoformat() if scheduled_at is not None else None
+            self._pending_runs.append((task, scheduled, started_at, duration, outcome, detail))
+            if len(self._pending_runs) >= BATCH_SIZE:
+                self.flush()
+
+    def last_runs(self, task, n=10):
+        """Last n runs of a task, newest first, as dicts."""
+        self.flush()
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT scheduled_at, started_at, duration, outcome, detail FROM runs "
+                "WHERE task = ? ORDER BY started_at DESC LIMIT ?", (task, n)).fetchall()
+        keys = ('scheduled_at', 'started_at', 'duration', 'outcome', 'detail')
+        return [dict(zip(keys, row)) for row in rows]
+
+    def run_stats(self, task):
+        self.flush()
+        with self._lock:
+            count, failures, avg_duration, max_duration = self.conn.execute(
+                "SELECT COUNT(*), SUM(outcome != 'ok'), AVG(duration), MAX(duration) FROM runs WHERE task = ?",
+                (task,)).fetchone()
+        return {'runs': count, 'failures': failures or 0,
+                'avg_duration': avg_duration, 'max_duration': max_duration}
+
+    # ---- key/value state ----
+
+    def get_state(self, task, key, default=None):
+        with self._lock:
+            if (task, key) in self._pending_state:
+                return self._pending_state[(task, key)][0]
+            row = self.conn.execute("SELECT value FROM task_state WHERE task = ? AND key = ?", (task, key)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_state(self, task, key, value, durable=False):
+        """Store a JSON-serializable value; durable=True commits before returning."""
+        with self._lock:
+            self._pending_state[(task, key)] = (value, time.time())
+            if durable:
+                self.flush()
+
+    # ---- batching ----
+
+    def maybe_flush(self):
+        """Cheap enough to be called at every scheduler loop."""
+        if (self._pending_runs or self._pending_state) and time.monotonic() - self._last_flush >= FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            self._last_flush = time.monotonic()
+            if not self._pending_runs and not self._pending_state:
+                return
+            runs, self._pending_runs = self._pending_runs, []
+            state, self._pending_state = self._pending_state, {}
+            try:
+                self.conn.execute("BEGIN")
+                self.conn.executemany(
+                    "INSERT INTO runs (task, scheduled_at, started_at, duration, outcome, detail) "
+                    "VALUES (?, ?, ?, ?, ?, ?)", runs)
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO task_state (task, key, value, updated_at) VALUES (?, ?, ?, ?)",
+                    [(task, key, json.dumps(value), updated_at) for (task, key), (value, updated_at) in state.items()])
+                self.conn.execute("COMMIT")
+            except sqlite3.Error as e:
+                self.conn.execute("ROLLBACK")
+                logger.error(f"Could not write to the state store: {e}")
+
+    def close(self):
+        with self._lock:
+            if self.conn is None:
+                return
+            self.flush()
+            self.conn.close()
+            self.conn = None
+
+    # ---- locks ----
+
+    @contextmanager
+    def lock(self, name):
+        """
+        Exclusive lock on a task (replaces the old PID files). It's an flock, so the
+        kernel releases it when the holder dies: no stale locks to clean up.
+        """
+        path = os.path.join(self.state_dir, 'locks', f"{name}.lock")
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise LockHeld(f"{name} is already running")
+            self.set_state(name, 'lock_holder', {'pid': os.getpid(), 'since': time.time()})
+            try:
+                yield
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_state_store(state_dir=None):
+    """The process-wide store; the first caller (normally the orchestrator) may choose where it lives."""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = StateStore(state_dir or DEFAULT_STATE_DIR)
+    return _store
@@ -1,114 +1,352 @@
 import os
+import inspect
 import importlib.util
 import pyRTOS
 from datetime import datetime, timedelta
-import json
+import time
 from .bluetooth_handler import BluetoothHandler  # Import it in Task class
+from .state_store import get_state_store
+from .config import get_config_cache, ConfigError, TriggerConfig, PRIORITY_CLASSES
+from .instance import TaskInstance, running_instance
+from .clock import WallClockTimer, clock_synchronized, TIME_SYNC_TIMEOUT, TIME_SYNC_POLL
 import logging
 
+logger = logging.getLogger(__name__)
+
+# An occurrence fired within this many seconds is considered on time, not a misfire
+ON_TIME_TOLERANCE = 60
+# A module-provided schedule (schedule_source "module") is asked again at least this often,
+# so edits to its timetable are picked up even while sleeping towards a distant run
+MODULE_SCHEDULE_RECHECK = 900
+
+# Task modules by file: all the instances of a task share one import
+_modules = {}
+
+
+def load_trigger_config(task_dir):
+    """The validated TriggerConfig of a task folder, parsed only when trigger.json changes."""
+    return get_config_cache().load(os.path.join(task_dir, 'trigger.json'), TriggerConfig)
+
+
+def priority_from_config(config):
+    if isinstance(config.priority, int):
+        return config.priority
+    return PRIORITY_CLASSES[config.priority]
+
+
 class Task:
-    def __init__(self, task_file, debug=False):
+    def __init__(self, task_file, debug=False, message_bus=None, state_store=None, instance=None,
+                 fresh_module=False):
+        # Which instance of the task module this is (the task folder's own one by default)
+        self.instance = instance or TaskInstance(task_file)
         # Initialize the task by setting the task name and importing the task module
-        self.task_name = os.path.dirname(task_file)
-        self.task_module = self.import_task_module(task_file)
+        self.task_name = self.instance.instance_dir
+        # Name of the task folder (plus "@instance"), the key of the task in the state store
+        self.task_id = self.instance.task_id
+        self.task_module = self.import_task_module(task_file, fresh=fresh_module)
         self.root_dir = os.path.dirname(os.path.dirname(task_file))
         self.config = self.load_trigger_config()
+        self.load_module_configs()
+        # With schedule_source "module" the occurrences come from the module's own timetable
+        self.module_schedule = None
+        if self.config.schedule_source == 'module':
+            self.module_schedule = getattr(self.task_module, 'next_run_after', None)
+            if self.module_schedule is None:
+                raise ConfigError(f"{self.task_id}/trigger.json: schedule_source 'module' requires "
+                                  f"the task module to define next_run_after(after)")
         self.debug = debug  # Store debug mode
+        # Bus messages are handed to the module's on_message(msg), if it defines one
+        self.message_bus = message_bus
+        self.message_handler = getattr(self.task_module, 'on_message', None)
+
+        # Last fire time survives restarts; the cursor marks up to when the schedule was evaluated
+        self.state_store = state_store or get_state_store()
+        last_fire = self.state_store.get_state(self.task_id, 'last_fire')
+        self.last_fire = datetime.fromisoformat(last_fire) if last_fire else None
+        self.misfire_policy = self.config.misfire_policy
+        self.misfire_grace_time = self.config.misfire_grace_time
+        self.reset_schedule_cursor()
         
         # Initialize BluetoothHandler as a class property
         self.bluetooth = None
 
+    def reset_schedule_cursor(self):
+        if self.last_fire is not None:
+            self.schedule_cursor = self.last_fire
+        else:
+            # Never fired: look back only as far as the grace window
+            self.schedule_cursor = datetime.now() - timedelta(seconds=self.misfire_grace_time)
+
     def setup_bluetooth(self, mac_address):
         """Initialize bluetooth handler with given MAC address"""
         self.bluetooth = BluetoothHandler(mac_address)
         return self.bluetooth
 
-    def import_task_module(self, module_path):
-        # Dynamically import the task module from the given path
+    def import_task_module(self, module_path, fresh=False):
+        # Dynamically import the task module from the given path, once for all the instances
+        # of the task; fresh=True imports it again (e.g. after a crash, to start from a clean state)
+        module_path = os.path.realpath(module_path)
+        if not fresh and module_path in _modules:
+            return _modules[module_path]
         module_name = os.path.basename(module_path).replace(".py", "")
         spec = importlib.util.spec_from_file_location(module_name, module_path)
         module = importlib.util.module_from_spec(spec)
         spec.loader.exec_module(module)
+        _modules[module_path] = module
         return module
 
     def load_trigger_config(self):
-        config_path = os.path.join(os.path.dirname(self.task_module.__file__), 'trigger.json')
-        with open(config_path, 'r') as f:
-            return json.load(f)
-        
+        return load_trigger_config(self.instance.instance_dir)
+
+    def load_module_configs(self):
+        # A module can declare the schemas of its own files, e.g. CONFIG_SCHEMAS = {'config.json': MyConfig}:
+        # they're validated (and cached) now, so a broken config fails here and not at run time.
+        # An instance may have its own copy of any of them
+        for filename, schema in getattr(self.task_module, 'CONFIG_SCHEMAS', {}).items():
+            get_config_cache().load(self.instance.config_file(filename), schema)
+
     def setup(self):
         # Execute the setup function of the task module to initialize the task
         # The timeout of each specific task and the schedule are returned by the setup function
         self.task_timeout, self.schedule = self.task_module.setup()
         self.next_run = self.next_run_time(self.schedule)
 
-    def calculate_next_run(self):
-        if not self.config['schedule_on']:
+    def calculate_next_run(self, after=None):
+        if not self.config.schedule_on:
             return datetime.now()  # Next run is "now" if scheduling is off
-        now = datetime.now()
-        time_of_day = datetime.strptime(self.config['time_of_day'], "%H:%M").time()
+        now = after or datetime.now()
+        if self.module_schedule is not None:
+            # None means nothing left to run: never
+            with running_instance(self.instance):
+                return self.module_schedule(now) or datetime.max
+        time_of_day = datetime.strptime(self.config.time_of_day, "%H:%M").time()
         next_run = datetime.combine(now.date(), time_of_day)
-        while next_run <= now or next_run.strftime("%A") not in self.config['days_of_week']:
+        while next_run <= now or next_run.strftime("%A") not in self.config.days_of_week:
             next_run += timedelta(days=1)
         return next_run
 
+    def scheduled_times_between(self, start, end):
+        """Scheduled occurrences t with start < t <= end, oldest first."""
+        occurrences = []
+        occurrence = self.calculate_next_run(after=start)
+        while occurrence <= end:
+            occurrences.append(occurrence)
+            occurrence = self.calculate_next_run(after=occurrence)
+        return occurrences
+
+    def due_runs(self, now):
+        """
+        Return the occurrences that must be fired now, according to the misfire policy,
+        and advance the schedule cursor past every occurrence up to now (fired or not).
+        """
+        missed = self.scheduled_times_between(self.schedule_cursor, now)
+        self.schedule_cursor = max(self.schedule_cursor, now)
+        if not missed:
+            return []
+
+        grace = timedelta(seconds=self.misfire_grace_time)
+        on_time = timedelta(seconds=ON_TIME_TOLERANCE)
+        if self.misfire_policy == 'run_late':
+            due = [t for t in missed if now - t <= grace]
+        elif self.misfire_policy == 'coalesce':
+            due = [missed[-1]] if now - missed[-1] <= grace else []
+        else:
+            due = [missed[-1]] if now - missed[-1] <= on_time else []
+
+        for t in missed:
+            if t not in due:
+                logger.warning(f"Task {self.task_name}: skipping missed run of {t:%Y-%m-%d %H:%M} ({self.misfire_policy})")
+        return due
+
+    def fire(self, scheduled_time, persist=True):
+        """Run the module for a scheduled occurrence: a generator of the block conditions of its waits."""
+        # Record the fire before running, so a crash or restart mid-run can't fire it twice
+        self.last_fire = scheduled_time
+        if persist:
+            self.state_store.set_state(self.task_id, 'last_fire', scheduled_time.isoformat(), durable=True)
+        lateness = (datetime.now() - scheduled_time).total_seconds()
+        if lateness > ON_TIME_TOLERANCE:
+            logger.info(f"Task {self.task_name}: running {scheduled_time:%Y-%m-%d %H:%M} late by {lateness:.0f}s")
+        if not persist:
+            yield from self.run_module_steps(scheduled_time)
+            return
+
+        # Scheduled runs end up in the run history (written in batches)
+        started_at = time.time()
+        try:
+            yield from self.run_module_steps(scheduled_time)
+        except Exception as e:
+            self.state_store.record_run(self.task_id, started_at, time.time() - started_at, 'crashed',
+                                        scheduled_at=scheduled_time, detail=str(e))
+            raise
+        self.state_store.record_run(self.task_id, started_at, time.time() - started_at, 'ok',
+                                    scheduled_at=scheduled_time)
+
+    def run_module(self, scheduled_time=None):
+        """Run the module to the end outside of the scheduler (profiling): its waits are plain sleeps."""
+        for seconds in self.module_waits(scheduled_time):
+            time.sleep(seconds)
+
+    def run_module_steps(self, scheduled_time=None):
+        """Run the module inside the scheduler: the other tasks run during its waits."""
+        for seconds in self.module_waits(scheduled_time):
+            yield [pyRTOS.timeout(seconds)]
+
+    def module_waits(self, scheduled_time=None):
+        """
+        Run the module's thread_loop. A thread_loop can be a generator yielding the seconds
+        it has nothing to do (e.g. while its audio plays): those are passed on, instead of
+        keeping the scheduler loop blocked for the whole run.
+        """
+        # The module finds the instance's config files through task.instance while it runs
+        with running_instance(self.instance):
+            # A module keeping its own timetable needs to know which of its occurrences is due
+            if self.module_schedule is not None:
+                run = self.task_module.thread_loop(scheduled_time)
+            else:
+                run = self.task_module.thread_loop()
+        if not inspect.isgenerator(run):
+            return
+        try:
+            while True:
+                # Set again at every step: the other tasks run with their own instance in between
+                with running_instance(self.instance):
+                    try:
+                        seconds = next(run)
+                    except StopIteration:
+                        return
+                yield seconds
+        finally:
+            # Stopped early (the task crashed or was terminated): the module cleans up now
+            with running_instance(self.instance):
+                run.close()
+
+    def dispatch_messages(self, self_task):
+        if self.message_handler is None or self.message_bus is None or self_task.message_count() == 0:
+            return
+        for msg in self.message_bus.receive(self_task):
+            self.message_handler(msg)
+
+    def sleep(self, self_task, seconds):
+        """Block conditions for a sleep that a bus message can interrupt, if the module handles messages."""
+        if self.message_handler is None or self.message_bus is None:
+            return [pyRTOS.timeout(seconds)]
+        return [pyRTOS.timeout(seconds), pyRTOS.wait_for_message(self_task)]
+
+    def sleep_until(self, self_task, timer):
+        """Block conditions for a sleep until a WallClockTimer fires (or a bus message arrives)."""
+        if self.message_handler is None or self.message_bus is None:
+            return [timer.condition()]
+        return [timer.condition(), pyRTOS.wait_for_message(self_task)]
+
+    def wait_for_time_sync(self):
+        """
+        Block (yielding to the other tasks) until the clock is synchronized, so the schedule
+        isn't computed from the time saved at the last shutdown; give up after TIME_SYNC_TIMEOUT.
+        """
+        if clock_synchronized():
+            return
+        logger.info(f"Task {self.task_name}: waiting for the clock to be synchronized")
+        waited = 0
+        while not clock_synchronized():
+            if waited >= TIME_SYNC_TIMEOUT:
+                logger.warning(f"Task {self.task_name}: clock still not synchronized after {waited}s, "
+                               f"scheduling anyway")
+                break
+            yield [pyRTOS.timeout(TIME_SYNC_POLL)]
+            waited += TIME_SYNC_POLL
+        # The cursor was set from the unsynchronized clock
+        self.reset_schedule_cursor()
+
+    def clock_was_set(self):
+        """The wall clock jumped: the cursor must not stay in a future that no longer is."""
+        now = datetime.now()
+        self.schedule_cursor = min(self.schedule_cursor, now)
+        logger.info(f"Task {self.task_name}: clock set to {now:%Y-%m-%d %H:%M:%S}, recomputing the schedule")
+
     def should_run(self):
         # If in debug mode, always run
         if self.debug:
             return True
             
         # Normal schedule checking logic
-        if not self.config.get('schedule_on', False):
+        if not self.config.schedule_on:
             return True
 
-        current_time = datetime.now()
-        current_day = current_time.strftime('%A')
-        current_hour = current_time.strftime('%H:%M')
-
-        scheduled_days = self.config.get('days_of_week', [])
-        scheduled_time = self.config.get('time_of_day', '')
-
-        return current_day in scheduled_days and current_hour == scheduled_time
+        # An occurrence not fired yet (since the last persisted fire) that is still within grace
+        now = datetime.now()
+        since = max(self.last_fire or self.schedule_cursor, now - timedelta(seconds=self.misfire_grace_time))
+        return len(self.scheduled_times_between(since, now)) > 0
 
     def run(self, self_task):
         # If in debug mode, run immediately and continuously
         if self.debug:
             while True:
-                self.task_module.thread_loop()
-                yield [pyRTOS.timeout(1)]  # Small delay to prevent CPU hogging
+                self.dispatch_messages(self_task)
+                yield from self.run_module_steps()
+                yield self.sleep(self_task, 1)  # Small delay to prevent CPU hogging
             
-        # Normal scheduling logic for non-debug mode
-        next_run = self.calculate_next_run()
+        # Normal scheduling logic for non-debug mode.
         yield
+        if self.config.schedule_on:
+            yield from self.wait_for_time_sync()
+        # Occurrences missed while the orchestrator was down are recovered right away on the first pass
+        next_run = self.calculate_next_run(after=self.schedule_cursor)
+        repeating = False
 
         while True:
+            self.dispatch_messages(self_task)
             now = datetime.now()
             # If both scheduling and timeout are false, the task must not be executed.
             # Put it to sleep for 10 seconds
-            if self.config['schedule_on']==False and self.config['timeout_on']==False:
+            if not self.config.schedule_on and not self.config.timeout_on:
                 sleep_time = 10
-                yield [pyRTOS.timeout(sleep_time)]
+                yield self.sleep(self_task, sleep_time)
                 continue
             # If scheduling is enabled, sleep until the next run time
-            if self.config['schedule_on']:
+            if self.config.schedule_on:
+                self.next_run = next_run
                 if now < next_run:
                     sleep_time = (next_run - now).total_seconds()
-                    yield [pyRTOS.timeout(sleep_time)]
+                    if self.module_schedule is not None and sleep_time > MODULE_SCHEDULE_RECHECK:
+                        yield self.sleep(self_task, MODULE_SCHEDULE_RECHECK)
+                        next_run = self.calculate_next_run(after=self.schedule_cursor)
+                        continue
+                    # An absolute wall clock timer, not a relative sleep: it fires at next_run across
+                    # DST changes, and a clock step (NTP after boot) wakes it to recompute
+                    timer = WallClockTimer(next_run)
+                    yield self.sleep_until(self_task, timer)
+                    if timer.clock_set:
+                        self.clock_was_set()
+                        next_run = self.calculate_next_run(after=self.schedule_cursor)
+                    timer.close()
                     continue
-                # Execute the main thread of the task, with the appropriate timeout
-                self.task_module.thread_loop()
-                if self.config['timeout_on']:
+                if repeating:
+                    # Repeating on timeout_interval after a scheduled run; nothing to recover here
+                    yield from self.fire(now, persist=False)
+                else:
+                    due = self.due_runs(now)
+                    if not due:
+                        next_run = self.calculate_next_run(after=self.schedule_cursor)
+                        continue
+                    # Execute the main thread of the task once per due occurrence
+                    for i, scheduled_time in enumerate(due):
+                        if i > 0:
+                            yield
+                        yield from self.fire(scheduled_time)
+                if self.config.timeout_on:
                     # Set next_run to be timeout_interval from now
-                    next_run = now + timedelta(seconds=self.config['timeout_interval'])
+                    next_run = now + timedelta(seconds=self.config.timeout_interval)
+                    repeating = True
                 else:
-                    # If timeout is off, calculate the next scheduled run
-                    next_run = self.calculate_next_run()
+                    # If timeout is off, calculate the next scheduled run (thread_loop may have blocked a while)
+                    next_run = self.calculate_next_run(after=self.schedule_cursor)
             else:
                 # If schedule is off and timeout is on, always execute
-                self.task_module.thread_loop()
+                yield from self.run_module_steps()
             
-            if self.config['timeout_on']:
-                yield [pyRTOS.timeout(self.config['timeout_interval'])]
+            if self.config.timeout_on:
+                yield [pyRTOS.timeout(self.config.timeout_interval)]
             else:
                 yield
             # If the "all.terminate" file exists in the root folder, terminate the task
@@ -0,0 +1,172 @@
+import time
+import socket
+import struct
+import logging
+import threading
+from .state_store import get_state_store
+
+logger = logging.getLogger(__name__)
+
+# Kernel IPv4 neighbor (ARP) table: reading it costs no packet at all
+NEIGHBOR_TABLE = '/proc/net/arp'
+NEIGHBOR_COMPLETE = 0x2
+
+# Where the known TVs (MAC -> last IP) are remembered between runs
+STATE_TASK = 'webos_tv'
+STATE_KEY = 'hosts'
+
+SSDP_GROUP = '239.255.255.250'
+SSDP_PORT = 1900
+# What an LG WebOS TV announces (NOTIFY) or answers (M-SEARCH) over SSDP
+WEBOS_MARKERS = ('webos', 'lge-com', 'lg electronics')
+# Active scan, only when a TV is nowhere to be found
+SCAN_RETRIES = 3
+
+
+def normalize_mac(mac):
+    return mac.strip().upper().replace('-', ':')
+
+
+def read_neighbor_table(path=NEIGHBOR_TABLE):
+    """MAC -> IP of the complete entries of the kernel neighbor table."""
+    neighbors = {}
+    try:
+        with open(path, 'r') as f:
+            next(f, None)   # header
+            for line in f:
+                fields = line.split()
+                if len(fields) < 4:
+                    continue
+                ip, flags, mac = fields[0], int(fields[2], 16), normalize_mac(fields[3])
+                if flags & NEIGHBOR_COMPLETE and mac != '00:00:00:00:00:00':
+                    neighbors[mac] = ip
+    except OSError as e:
+        logger.debug(f"Neighbor table not readable: {e}")
+    return neighbors
+
+
+class TVDirectory:
+    """
+    Resolves the IP of a TV from its MAC address, cheapest source first:
+      1. the kernel neighbor table (current, a file read)
+      2. the last known IP (state store), kept fresh by a passive SSDP listener
+         that records every WebOS announcement it hears
+      3. an active SSDP scan (seconds), only if the TV was never seen
+    """
+
+    def __init__(self):
+        self.hosts = dict(get_state_store().get_state(STATE_TASK, STATE_KEY, {}))   # mac -> {'ip', 'seen_at', 'source'}
+        self._lock = threading.Lock()
+        self._listener = None
+
+    def resolve(self, mac, hint=None, scan=True):
+        """IP of the TV with this MAC, or hint (e.g. a configured IP) / None if it can't be found."""
+        mac = normalize_mac(mac)
+        self.start_listener()
+
+        ip = read_neighbor_table().get(mac)
+        if ip:
+            self.record(mac, ip, 'neighbor')
+            return ip
+
+        with self._lock:
+            known = self.hosts.get(mac)
+        if known:
+            return known['ip']
+        if hint:
+            return hint
+        if not scan:
+            return None
+
+        logger.info(f"TV {mac} not known yet, scanning the network")
+        self.scan()
+        with self._lock:
+            known = self.hosts.get(mac)
+        return known['ip'] if known else None
+
+    def record(self, mac, ip, source):
+        mac = normalize_mac(mac)
+        with self._lock:
+            known = self.hosts.get(mac)
+            changed = known is None or known['ip'] != ip
+            self.hosts[mac] = {'ip': ip, 'seen_at': time.time(), 'source': source}
+            hosts = dict(self.hosts)
+        if changed:
+            logger.info(f"TV {mac} is at {ip} (from {source})")
+        # Batched with the other state writes, a lost update only costs a lookup
+        get_state_store().set_state(STATE_TASK, STATE_KEY, hosts)
+
+    def forget(self, mac):
+        """Drop a known IP that turned out to be wrong (e.g. the connection was refused)."""
+        with self._lock:
+            self.hosts.pop(normalize_mac(mac), None)
+            hosts = dict(self.hosts)
+        get_state_store().set_state(STATE_TASK, STATE_KEY, hosts)
+
+    def scan(self):
+        """Active SSDP search; every TV that answers is recorded. Returns their IPs."""
+        from pywebostv.discovery import discover
+        hosts = discover("urn:schemas-upnp-org:device:MediaRenderer:1", keyword="LG", hosts=True,
+                         retries=SCAN_RETRIES)
+        # The answers just filled the neighbor table with the MACs of the TVs
+        self._record_hosts(hosts, 'scan')
+        return list(hosts)
+
+    def _record_hosts(self, hosts, source):
+        neighbors = {ip: mac for mac, ip in read_neighbor_table().items()}
+        for ip in hosts:
+            mac = neighbors.get(ip)
+            if mac:
+                self.record(mac, ip, source)
+            else:
+                logger.debug(f"No neighbor entry for the TV at {ip}")
+
+    # ---- passive listening ----
+
+    def start_listener(self):
+        """Listen (daemon thread) for SSDP announcements of WebOS TVs; harmless if port 1900 is busy."""
+        with self._lock:
+            if self._listener is not None:
+                return
+            self._listener = threading.Thread(target=self._listen, name='ssdp-listener', daemon=True)
+        self._listener.start()
+
+    def _listen(self):
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if hasattr(socket, 'SO_REUSEPORT'):
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind(('', SSDP_PORT))
+            membership = struct.pack('4sl', socket.inet_aton(SSDP_GROUP), socket.INADDR_ANY)
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        except OSError as e:
+            logger.info(f"Passive SSDP listening unavailable: {e}")
+            return
+
+        while True:
+            try:
+                data, (ip, _) = sock.recvfrom(4096)
+            except OSError as e:
+                logger.warning(f"SSDP listener stopped: {e}")
+                return
+            text = data.decode(errors='replace').lower()
+            if any(marker in text for marker in WEBOS_MARKERS):
+                self._record_hosts([ip], 'ssdp')
+
+
+_directory = None
+_directory_lock = threading.Lock()
+
+
+def get_tv_directory():
+    global _directory
+    with _directory_lock:
+        if _directory is None:
+            _directory = TVDirectory()
+    return _directory
+
+
+def resolve_tv_host(mac, hint=None, scan=True):
+    """Shortcut: the IP of the TV with this MAC (see TVDirectory.resolve)."""
+    return get_tv_directory().resolve(mac, hint=hint, scan=scan)
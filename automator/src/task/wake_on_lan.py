@@ -0,0 +1,73 @@
+import time
+import socket
+import logging
+from .webos_tv import TVUnavailable
+
+logger = logging.getLogger(__name__)
+
+# WebOS websocket ports (plain and secure): accepting connections there means the TV is usable
+WEBOS_PORT = 3000
+WEBOS_SECURE_PORT = 3001
+
+# Seconds until the TV must answer, otherwise the wake-up fails
+WAKE_DEADLINE = 90
+# The magic packet is UDP and may be lost (or sent while the NIC isn't listening yet):
+# it's resent after 1, 2, 4, 8 seconds... never less often than every RESEND_MAX_INTERVAL
+RESEND_FIRST_INTERVAL = 1
+RESEND_MAX_INTERVAL = 15
+# Seconds between two probes of the port, and how long a single probe may take
+PROBE_INTERVAL = 0.5
+PROBE_TIMEOUT = 1
+
+
+def port_open(host, port, timeout=PROBE_TIMEOUT):
+    """True if host accepts TCP connections on port."""
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def _send_magic_packet(mac):
+    from wakeonlan import send_magic_packet
+    send_magic_packet(mac)
+
+
+def wake_until_ready(mac, host, port=WEBOS_PORT, deadline=WAKE_DEADLINE, sender=_send_magic_packet):
+    """
+    Wake the device with this MAC and return as soon as host accepts connections on
+    port (seconds it took), resending the magic packet with backoff in the meantime.
+    Raises TVUnavailable once the deadline passes. Nothing is sent if it's already up.
+    """
+    # Without an address there's nothing to probe (and (None, port) would probe localhost)
+    if not host:
+        raise TVUnavailable(f"No address known for {mac}: can't tell when it's awake")
+    start = time.monotonic()
+    if port_open(host, port):
+        logger.info(f"{host} is already awake")
+        return 0.0
+
+    end = start + deadline
+    next_send = start
+    interval = RESEND_FIRST_INTERVAL
+    packets = 0
+    while True:
+        now = time.monotonic()
+        if now >= next_send:
+            sender(mac)
+            packets += 1
+            logger.debug(f"Sent Wake-on-LAN packet {packets} to {mac}")
+            next_send = now + interval
+            interval = min(interval * 2, RESEND_MAX_INTERVAL)
+
+        if port_open(host, port, timeout=max(0.05, min(PROBE_TIMEOUT, end - now))):
+            elapsed = time.monotonic() - start
+            logger.info(f"{host} ready after {elapsed:.1f}s ({packets} Wake-on-LAN packet(s))")
+            return elapsed
+
+        now = time.monotonic()
+        if now >= end:
+            raise TVUnavailable(f"{host} not ready {deadline}s after Wake-on-LAN ({packets} packet(s) sent)")
+        # A refused connection returns at once: don't spin, but don't wait past the next resend
+        time.sleep(max(0, min(PROBE_INTERVAL, next_send - now, end - now)))
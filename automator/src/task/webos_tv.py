@@ -0,0 +1,252 @@
+import time
+import logging
+import threading
+from .state_store import get_state_store
+
+logger = logging.getLogger(__name__)
+
+# State store entry holding the client key of every TV paired so far (host -> key)
+STATE_TASK = 'webos_tv'
+STATE_KEY = 'client_keys'
+
+# Seconds between two keepalive probes of an idle connection, and how long a probe may take
+KEEPALIVE_INTERVAL = 30
+KEEPALIVE_TIMEOUT = 10
+# Reconnection after a drop: exponential backoff between attempts
+RECONNECT_BASE_DELAY = 2
+RECONNECT_MAX_DELAY = 120
+# Failed attempts before the keepalive gives up (e.g. the TV is off at the plug): the next
+# command reconnects and starts it again
+RECONNECT_MAX_ATTEMPTS = 6
+# The first registration waits for the user to accept the prompt on the TV
+REGISTER_TIMEOUT = 60
+
+
+class TVUnavailable(Exception):
+    """The TV can't be reached or refused the registration."""
+
+
+class ControlProxy:
+    """
+    Stands for a pywebostv control (MediaControl, SystemControl...) of a session:
+    every call goes to the control of the current connection, so a reference kept
+    by a task (e.g. by a volume ramp) survives reconnections.
+    """
+
+    def __init__(self, session, control_name):
+        self._session = session
+        self._control_name = control_name
+
+    def __getattr__(self, name):
+        return getattr(self._session.control(self._control_name), name)
+
+
+class TVSession:
+    """
+    One registered websocket to a WebOS TV, shared by all the tasks. The client key is
+    kept in the state store, so the TV prompts only the very first time; the connection
+    is opened on first use, kept alive with periodic probes and reopened when it drops.
+    Only the first command pays the handshake and the registration.
+    """
+
+    CONTROLS = ('MediaControl', 'SystemControl', 'ApplicationControl', 'InputControl', 'TvControl',
+                'SourceControl')
+
+    def __init__(self, host, secure=False, client_key=None, keepalive_interval=KEEPALIVE_INTERVAL):
+        self.host = host
+        self.secure = secure
+        self.keepalive_interval = keepalive_interval
+        # Key given by the caller (e.g. from an old store file), used if none is stored yet
+        self.initial_client_key = client_key
+        self.client = None
+        self.controls = {}
+        self.connected_at = None
+        self.reconnects = 0
+        self._lock = threading.RLock()
+        self._stop = threading.Event()
+        self._keepalive_thread = None
+
+    # ---- controls, connected on demand ----
+
+    @property
+    def media(self):
+        return ControlProxy(self, 'MediaControl')
+
+    @property
+    def system(self):
+        return ControlProxy(self, 'SystemControl')
+
+    @property
+    def app(self):
+        return ControlProxy(self, 'ApplicationControl')
+
+    @property
+    def input(self):
+        return ControlProxy(self, 'InputControl')
+
+    @property
+    def tv(self):
+        return ControlProxy(self, 'TvControl')
+
+    def control(self, control_name):
+        """The pywebostv control of the current connection, connecting first if needed."""
+        if control_name not in self.CONTROLS:
+            raise ValueError(f"Unknown WebOS control {control_name}")
+        with self._lock:
+            client = self.connect()
+            control = self.controls.get(control_name)
+            if control is None:
+                from pywebostv import controls
+                control = self.controls[control_name] = getattr(controls, control_name)(client)
+            return control
+
+    # ---- connection ----
+
+    def connect(self):
+        """Return the registered client, opening and registering a connection only if there is none."""
+        with self._lock:
+            if self.client is not None and not self._is_closed(self.client):
+                return self.client
+            self._drop()
+            self.client = self._open()
+            self.connected_at = time.monotonic()
+            self._start_keepalive()
+            return self.client
+
+    def close(self):
+        self._stop.set()
+        with self._lock:
+            self._drop()
+
+    @property
+    def connected(self):
+        with self._lock:
+            return self.client is not None and not self._is_closed(self.client)
+
+    def _open(self):
+        from pywebostv.connection import WebOSClient
+
+        keys = get_state_store().get_state(STATE_TASK, STATE_KEY, {})
+        store = {}
+        client_key = keys.get(self.host, self.initial_client_key)
+        if client_key:
+            store['client_key'] = client_key
+
+        client = WebOSClient(self.host, secure=self.secure)
+        try:
+            client.connect()
+            for status in client.register(store, timeout=REGISTER_TIMEOUT):
+                if status == WebOSClient.PROMPTED:
+                    logger.info(f"Please accept the connection on the TV ({self.host})")
+                elif status == WebOSClient.REGISTERED:
+                    logger.info(f"Registered with the TV at {self.host}")
+        except Exception as e:
+            self._close_client(client)
+            raise TVUnavailable(f"Could not connect to the TV at {self.host}: {e}")
+
+        # The TV hands out a key on the first registration: keep it for the next ones
+        if store.get('client_key') and store['client_key'] != keys.get(self.host):
+            keys = dict(keys)
+            keys[self.host] = store['client_key']
+            get_state_store().set_state(STATE_TASK, STATE_KEY, keys, durable=True)
+        return client
+
+    def _drop(self):
+        if self.client is not None:
+            self._close_client(self.client)
+        self.client = None
+        self.controls = {}
+        self.connected_at = None
+
+    @staticmethod
+    def _close_client(client):
+        try:
+            client.close()
+        except Exception:
+            pass
+
+    @staticmethod
+    def _is_closed(client):
+        # ws4py marks a client terminated once its socket is closed, from either side
+        return getattr(client, 'terminated', False)
+
+    # ---- keepalive ----
+
+    def _start_keepalive(self):
+        if self._keepalive_thread is None or not self._keepalive_thread.is_alive():
+            self._stop.clear()
+            self._keepalive_thread = threading.Thread(target=self._keepalive, name=f"webos-{self.host}",
+                                                      daemon=True)
+            self._keepalive_thread.start()
+
+    def _keepalive(self):
+        delay = RECONNECT_BASE_DELAY
+        while not self._stop.wait(self.keepalive_interval):
+            with self._lock:
+                client = self.client
+            if client is not None and not self._is_closed(client) and self._probe():
+                delay = RECONNECT_BASE_DELAY
+                continue
+
+            # Dropped (TV switched off, network blip): reconnect in the background,
+            # so the next command finds the connection ready
+            logger.warning(f"Connection to the TV at {self.host} lost, reconnecting")
+            for _ in range(RECONNECT_MAX_ATTEMPTS):
+                if self._reconnect(client):
+                    break
+                if self._stop.wait(delay):
+                    return
+                delay = min(delay * 2, RECONNECT_MAX_DELAY)
+            else:
+                logger.info(f"TV at {self.host} still unreachable after {RECONNECT_MAX_ATTEMPTS} attempts: "
+                            f"reconnecting on the next command")
+                with self._lock:
+                    if self.client is client:
+                        self._drop()
+                    # connect() starts a new keepalive along with the new connection
+                    self._keepalive_thread = None
+                return
+
+    def _reconnect(self, lost_client):
+        """
+        Open a new connection and swap it in for lost_client. The handshake (up to
+        REGISTER_TIMEOUT) runs outside of the lock, so commands of other tasks don't wait for it.
+        """
+        try:
+            client = self._open()
+        except TVUnavailable as e:
+            logger.debug(str(e))
+            return False
+        with self._lock:
+            if self.client is not lost_client and self.client is not None and not self._is_closed(self.client):
+                # A command reconnected in the meantime: keep its connection
+                self._close_client(client)
+                return True
+            self._drop()
+            self.client = client
+            self.connected_at = time.monotonic()
+        self.reconnects += 1
+        logger.info(f"Reconnected to the TV at {self.host}")
+        return True
+
+    def _probe(self):
+        """A cheap round trip proving the TV still answers on this connection."""
+        try:
+            self.control('MediaControl').get_volume(timeout=KEEPALIVE_TIMEOUT)
+            return True
+        except Exception as e:
+            logger.debug(f"Keepalive to {self.host} failed: {e}")
+            return False
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_tv_session(host, secure=False, client_key=None):
+    """The shared session of a TV: every task talking to the same TV uses the same websocket."""
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = _sessions[host] = TVSession(host, secure=secure, client_key=client_key)
+    return session
@@ -1,88 +1,160 @@
-import sys
-import json
 import random
 import time
-import vlc
 import os
 import threading
-import psutil
 from task.bluetooth_handler import BluetoothHandler
+from task.config import PRIORITY_CLASSES, ConfigObject, Field, ListOf, BluetoothDevice, load_config
+from task.state_store import get_state_store, LockHeld
+from task.instance import instance_file, instance_id
+from orchestrator.audio_focus import get_audio_focus, get_vlc_instance, GAINED, DUCKED, PAUSED
+from orchestrator.volume_ramp import get_volume_ramper, vlc_setter
 import logging
 
 CURRENT_TASK_DIR = os.path.dirname(__file__)
 
-CONFIG_FILE = os.path.join(CURRENT_TASK_DIR, 'config.json')
-RADIO_STREAM_FILE = os.path.join(CURRENT_TASK_DIR, 'radio_stations.json')
+# Instances of the task (instances/<name>/) may have their own copy of these files
+CONFIG_FILE = 'config.json'
+RADIO_STREAM_FILE = 'radio_stations.json'
+TASK_ID = 'radio_alarm'
+
+
+class RadioAlarmConfig(ConfigObject):
+    FIELDS = {
+        'bluetooth_devices': Field(ListOf(BluetoothDevice, min_items=1)),
+    }
+    __slots__ = tuple(FIELDS)
+
+
+class RadioStation(ConfigObject):
+    FIELDS = {
+        'name': Field(str),
+        'url': Field(str),
+        'url_resolved': Field(str, required=False),
+        'homepage': Field(str, required=False),
+    }
+    __slots__ = tuple(FIELDS)
+
+
+# Validated by the orchestrator at start, then served from the config cache
+CONFIG_SCHEMAS = {
+    'config.json': RadioAlarmConfig,
+    'radio_stations.json': ListOf(RadioStation, min_items=1),
+}
+
+# The wake-up alarm wins the speaker against any other task; each instance of the task
+# requests the focus under its own task id
+AUDIO_FOCUS_PRIORITY = PRIORITY_CLASSES['critical']
+VOLUME = 50
+DUCKED_VOLUME = 15
+# Fades, in seconds: a slow exponential fade in to wake up gently, quick fades
+# when another task takes or gives back the speaker
+FADE_IN = 30
+FADE_OUT = 5
+FOCUS_FADE = 0.5
+# Seconds the radio plays
+PLAY_DURATION = 3600
 
 class RadioPlayer:
     # Implementing the singleton pattern for RadioPlayer ot ensure that only one istance of the player is created
+    # (one per instance of the task, see task/instance.py)
     # We also ensure that the automator properly manages threads and does not create multiple threads for the same task
     # Moreover we'll add some logging
-    _instance = None
+    _instances = {}
     _lock = threading.Lock()
 
-    def __new__(cls, *args, **kwargs):
+    def __new__(cls, task_id=TASK_ID):
         with cls._lock:
-            if cls._instance is None:
-                cls._instance = super(RadioPlayer, cls).__new__(cls)
-        return cls._instance
+            if task_id not in cls._instances:
+                cls._instances[task_id] = super(RadioPlayer, cls).__new__(cls)
+        return cls._instances[task_id]
     
-    def __init__(self):
+    def __init__(self, task_id=TASK_ID):
+        self.task_id = task_id
         self.load_config()
         self.bluetooth_handler = None
         self.logger = logging.getLogger(__name__)
         self.is_playing = False  # Add a flag to check if the radio is playing
+        self.faded_in = False
         self.initialized = True
     
     def load_config(self):
-        try:
-            with open(CONFIG_FILE, 'r') as f:
-                self.config = json.load(f)
-            # Get the first bluetooth device's MAC address from config
-            self.bluetooth_mac = self.config['bluetooth_devices'][0]['mac_address']
-            self.radio_streams = self.load_radio_streams()
-        except Exception as e:
-            self.logger.error(f"Error loading configuration: {str(e)}")
-            raise
+        # Served from the config cache: no parsing unless the files changed
+        self.config = load_config(instance_file(CONFIG_FILE, CURRENT_TASK_DIR), RadioAlarmConfig)
+        # Get the first bluetooth device's MAC address from config
+        self.bluetooth_mac = self.config.bluetooth_devices[0].mac_address
+        self.radio_streams = self.load_radio_streams()
 
     def load_radio_streams(self):
-        with open(RADIO_STREAM_FILE, 'r') as f:
-            return json.load(f)
+        return load_config(instance_file(RADIO_STREAM_FILE, CURRENT_TASK_DIR), CONFIG_SCHEMAS['radio_stations.json'])
 
     def play_radio_for_one_hour(self, stream_url, radio_name):
+        """Generator: yields the seconds it waits while the radio plays (see Task.module_waits)."""
         if self.is_playing:
             print("Radio is already playing. Skipping new play request.")
             return
 
         self.is_playing = True  # Set the flag to True when starting to play
+        # The libvlc engine is shared and stays warm, only the player is per run
+        instance = get_vlc_instance()
+        player = instance.media_player_new()
+        audio_focus = get_audio_focus()
+        ramper = get_volume_ramper()
         try:
-            # Increase VLC buffer and set audio output to ALSA
-            instance = vlc.Instance('--network-caching=3000', '--file-caching=3000', '--live-caching=3000', '--aout=pulse')
-            player = instance.media_player_new()
             media = instance.media_new(stream_url)
             player.set_media(media)
-            player.audio_set_volume(50)
-            player.play()
+            # Start silent, the focus callback fades in
+            ramper.set(player, vlc_setter(player), 0)
+            self.faded_in = False
+            # Playback starts (or waits) according to the focus we're granted
+            audio_focus.request(self.task_id, AUDIO_FOCUS_PRIORITY,
+                                lambda state: self.on_audio_focus_change(player, state))
 
             print(f"{time.strftime('%H:%M')} - Playing radio {radio_name}")
-            # Play for 1 hour (3600 seconds)
-            time.sleep(3600)
-            # Stop the player
-            player.stop()
+            get_state_store().set_state(self.task_id, 'last_station', {'name': radio_name, 'url': stream_url,
+                                                                       'played_at': time.time()})
+            # Play for 1 hour, letting the other tasks run meanwhile: one that needs the
+            # speaker requests the focus, and on_audio_focus_change does the rest
+            yield PLAY_DURATION
+            if audio_focus.owner() == self.task_id:
+                fade = ramper.ramp(player, vlc_setter(player), 0, FADE_OUT)
+                yield FADE_OUT
+                fade.wait(1)
             print(f"{time.strftime('%H:%M')} - Stopped playing radio {radio_name}")
         finally:
+            audio_focus.release(self.task_id)
+            ramper.forget(player)
             player.stop()
             player.release()
-            instance.release()
             self.is_playing = False  # Reset the flag when done playing
 
+    def on_audio_focus_change(self, player, state):
+        # Only schedules ramps: focus callbacks must not block
+        ramper = get_volume_ramper()
+        setter = vlc_setter(player)
+        if state == GAINED:
+            # The first time with the slow wake-up fade, then quickly when resuming
+            fade = FOCUS_FADE if self.faded_in else FADE_IN
+            self.faded_in = True
+            player.play()
+            ramper.ramp(player, setter, VOLUME, fade, curve='exponential')
+        elif state == DUCKED:
+            ramper.ramp(player, setter, DUCKED_VOLUME, FOCUS_FADE)
+        elif state == PAUSED:
+            def pause_when_silent(completed):
+                if completed:
+                    player.set_pause(1)
+            ramper.ramp(player, setter, 0, FOCUS_FADE, on_done=pause_when_silent)
+        else:
+            ramper.cancel(player)
+            player.stop()
+
     def start(self):
-        """Initialize and start radio playback"""
+        """Initialize and start radio playback (a generator, like play_radio_for_one_hour)"""
         try:
             # Select random radio stream
             radio_stream = random.choice(self.radio_streams)
-            radio_stream_url = radio_stream['url']
-            radio_name = radio_stream['name']
+            radio_stream_url = radio_stream.url
+            radio_name = radio_stream.name
             
             # Initialize Bluetooth connection with single MAC address
             bluetooth_handler = BluetoothHandler(self.bluetooth_mac)
@@ -90,7 +162,7 @@ class RadioPlayer:
             # Try to connect
             if bluetooth_handler.connect():
                 self.logger.info(f"Connected to Bluetooth device: {self.bluetooth_mac}")
-                self.play_radio_for_one_hour(radio_stream_url, radio_name)
+                yield from self.play_radio_for_one_hour(radio_stream_url, radio_name)
             else:
                 self.logger.error("Failed to connect to Bluetooth speaker. Exiting.")
                 return False
@@ -100,62 +172,22 @@ class RadioPlayer:
             return False
 
 
-def check_if_already_running():
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    pid_file = os.path.join(script_dir, 'radio_alarm.pid')
-    
-    if os.path.isfile(pid_file):
-        try:
-            with open(pid_file, 'r') as f:
-                old_pid = int(f.read().strip())
-            
-            # Check if process with this PID exists
-            if psutil.pid_exists(old_pid):
-                # Double check it's our process by checking the name
-                try:
-                    process = psutil.Process(old_pid)
-                    if "python" in process.name().lower():
-                        print(f"Another instance is already running (PID: {old_pid})")
-                        sys.exit()
-                except (psutil.NoSuchProcess, psutil.AccessDenied):
-                    # Process doesn't exist anymore or we can't access it
-                    pass
-            
-            # If we get here, the PID file is stale
-            os.remove(pid_file)
-            
-        except (ValueError, IOError) as e:
-            # Invalid content in PID file or can't read it
-            logging.warning(f"Invalid or corrupted PID file: {e}")
-            os.remove(pid_file)
-    
-    # Write our PID
-    try:
-        with open(pid_file, 'w') as f:
-            f.write(str(os.getpid()))
-    except IOError as e:
-        logging.error(f"Could not write PID file: {e}")
-        sys.exit(1)
-
-def delete_pid_file():
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    pid_file = os.path.join(script_dir, 'radio_alarm.pid')
-    if os.path.isfile(pid_file):
-        os.remove(pid_file)
-
 # Entry point of the program
 def main():
-    check_if_already_running()
+    # Only one run at a time, even across processes (the lock dies with its holder)
+    task_id = instance_id(TASK_ID)
     try:
-        radio_player = RadioPlayer()
-        radio_player.start()
-    finally:
-        delete_pid_file()
+        with get_state_store().lock(task_id):
+            radio_player = RadioPlayer(task_id)
+            yield from radio_player.start()
+    except LockHeld as e:
+        print(f"Another instance is already running: {e}")
 
 # This is if we want to run the script as a task
 def thread_loop():
-    main()
+    yield from main()
 
 # This is if we want to run the script as a standalone program
 if __name__ == "__main__":
-    main()
+    for seconds in main():
+        time.sleep(seconds)
@@ -1,45 +1,188 @@
 import sys
 import json
+import math
+import mmap
+import ctypes
 import random
+import shutil
 import time
 import vlc
 import os
 import threading
-import psutil
 import logging
 import subprocess
 import re
+from array import array
 from datetime import datetime, timedelta
 
 # Same as your radio example, but referencing the same package structure:
 from task.bluetooth_handler import BluetoothHandler
+from task.config import PRIORITY_CLASSES, ConfigObject, Field, ListOf, BluetoothDevice, load_config, check_time_of_day
+from task.state_store import get_state_store, LockHeld
+from task.instance import instance_file, instance_id
+from orchestrator.audio_focus import get_audio_focus, get_vlc_instance, GAINED, DUCKED, PAUSED
+from orchestrator.volume_ramp import get_volume_ramper, vlc_setter
 
 CURRENT_TASK_DIR = os.path.dirname(__file__)
-CONFIG_FILE = os.path.join(CURRENT_TASK_DIR, 'config.json')
-SOURCES_FILE = os.path.join(CURRENT_TASK_DIR, 'sleep_sounds_sources.json')
-PID_FILE = os.path.join(CURRENT_TASK_DIR, 'sleep_sounds.pid')
+# Instances of the task (instances/<name>/) may have their own copy of these files
+CONFIG_FILE = 'config.json'
+SOURCES_FILE = 'sleep_sounds_sources.json'
 CACHE_DIR = os.path.join(CURRENT_TASK_DIR, 'cache')
+TASK_ID = 'sleep_sounds'
+
+
+class SleepSoundsConfig(ConfigObject):
+    FIELDS = {
+        'stop_time': Field(str, check=check_time_of_day),
+        'bluetooth_devices': Field(ListOf(BluetoothDevice, min_items=1)),
+    }
+    __slots__ = tuple(FIELDS)
+
+
+class SleepSoundsSources(ConfigObject):
+    FIELDS = {
+        'youtube_urls': Field(ListOf(str, min_items=1)),
+    }
+    __slots__ = tuple(FIELDS)
+
+
+# Validated by the orchestrator at start, then served from the config cache
+CONFIG_SCHEMAS = {
+    'config.json': SleepSoundsConfig,
+    'sleep_sounds_sources.json': SleepSoundsSources,
+}
+
+# Sleep sounds yield the speaker to the alarm, and are only ducked by transient announcements;
+# each instance of the task requests the focus under its own task id
+AUDIO_FOCUS_PRIORITY = PRIORITY_CLASSES['high']
+VOLUME = 50
+DUCKED_VOLUME = 15
+# Fades, in seconds: the sounds fade in and, ending at stop_time, slowly fade out;
+# quick fades when another task takes or gives back the speaker
+FADE_IN = 10
+FADE_OUT = 60
+FOCUS_FADE = 0.5
+# Seconds between two checks of the stop time while playing (it's a wall clock time)
+STOP_CHECK_INTERVAL = 2
+
+# Loop buffers: the first LOOP_MAX_SECONDS of a track, decoded once by ffmpeg to raw PCM
+# (no AAC decoding all night long) and crossfaded over LOOP_CROSSFADE seconds, so that its
+# end flows into its start. About 10 MB a minute, hence the cap (sleep tracks can last hours)
+LOOP_SUFFIX = '.loop.pcm'
+LOOP_MAX_SECONDS = 600
+LOOP_CROSSFADE = 3
+LOOP_MIN_SECONDS = 5
+SAMPLE_RATE = 44100
+CHANNELS = 2
+FRAME_BYTES = 2 * CHANNELS  # s16le
+# How VLC reads the raw PCM (the rawaud demuxer)
+RAW_AUDIO_OPTIONS = ('demux=rawaud', f'rawaud-channels={CHANNELS}', f'rawaud-samplerate={SAMPLE_RATE}',
+                     'rawaud-fourcc=s16l')
+# Length of a callback stream that has no end (libvlc's "unknown size")
+UNKNOWN_SIZE = 2 ** 64 - 1
+
+
+def crossfade_loop(path, crossfade=LOOP_CROSSFADE):
+    """
+    Turn raw PCM into a seamless loop, in place: the last `crossfade` seconds are mixed into
+    the first ones (fading in the start while fading out the end) and cut off. Playing the
+    file again from the top then continues exactly where its end left off.
+    Equal power fades: the sounds are mostly noise, uncorrelated between the two ends.
+    """
+    frames = os.path.getsize(path) // FRAME_BYTES
+    # Short tracks get a shorter crossfade
+    fade_frames = min(int(crossfade * SAMPLE_RATE), frames // 4)
+    loop_frames = frames - fade_frames
+    if fade_frames:
+        length = fade_frames * FRAME_BYTES
+        with open(path, 'r+b') as f, mmap.mmap(f.fileno(), 0) as pcm:
+            head = array('h', pcm[:length])
+            tail = array('h', pcm[loop_frames * FRAME_BYTES:loop_frames * FRAME_BYTES + length])
+            if sys.byteorder == 'big':
+                head.byteswap()
+                tail.byteswap()
+            for frame in range(fade_frames):
+                angle = (frame + 0.5) / fade_frames * math.pi / 2
+                fade_in, fade_out = math.sin(angle), math.cos(angle)
+                for sample in range(frame * CHANNELS, (frame + 1) * CHANNELS):
+                    mixed = int(head[sample] * fade_in + tail[sample] * fade_out)
+                    head[sample] = max(-32768, min(32767, mixed))
+            if sys.byteorder == 'big':
+                head.byteswap()
+            pcm[:length] = head.tobytes()
+    with open(path, 'r+b') as f:
+        f.truncate(loop_frames * FRAME_BYTES)
+
+
+class LoopBuffer:
+    """
+    A loop buffer memory-mapped and handed to libvlc as an endless stream (a media read
+    through callbacks): the loop point is only the read position wrapping around, so the
+    demuxer never reaches an end, nothing is re-opened and there's no gap.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.size = len(self.map)
+        self.position = 0
+        # libvlc calls these from its input thread: keep the ctypes wrappers alive
+        self._callbacks = (vlc.CallbackDecorators.MediaOpenCb(self._open),
+                           vlc.CallbackDecorators.MediaReadCb(self._read),
+                           vlc.CallbackDecorators.MediaSeekCb(self._seek),
+                           vlc.CallbackDecorators.MediaCloseCb(self._close))
+
+    def media(self, vlc_instance):
+        media = vlc_instance.media_new_callbacks(*self._callbacks, None)
+        for option in RAW_AUDIO_OPTIONS:
+            media.add_option(f':{option}')
+        return media
+
+    def _open(self, opaque, datap, sizep):
+        self.position = 0
+        sizep[0] = UNKNOWN_SIZE
+        return 0
+
+    def _read(self, opaque, buf, length):
+        count = min(length, self.size - self.position)
+        ctypes.memmove(buf, self.map[self.position:self.position + count], count)
+        self.position = (self.position + count) % self.size
+        return count
+
+    def _seek(self, opaque, offset):
+        self.position = (offset - offset % FRAME_BYTES) % self.size
+        return 0
+
+    def _close(self, opaque):
+        pass
+
+    def close(self):
+        self.map.close()
+        self.file.close()
 
 
 class SleepSoundsPlayer:
     """
-    A singleton class that picks a single YouTube URL from a list, downloads
-    it (if needed), and loops that audio until 'stop_time'.
+    A singleton class (one per instance of the task) that picks a single YouTube URL
+    from a list, downloads it (if needed), and loops that audio until 'stop_time'.
     """
-    _instance = None
+    _instances = {}
     _lock = threading.Lock()
 
-    def __new__(cls, *args, **kwargs):
+    def __new__(cls, task_id=TASK_ID):
         with cls._lock:
-            if cls._instance is None:
-                cls._instance = super(SleepSoundsPlayer, cls).__new__(cls)
-        return cls._instance
+            if task_id not in cls._instances:
+                cls._instances[task_id] = super(SleepSoundsPlayer, cls).__new__(cls)
+        return cls._instances[task_id]
 
-    def __init__(self):
+    def __init__(self, task_id=TASK_ID):
         # Make sure we only init once in the singleton
         if getattr(self, 'initialized', False):
             return
 
+        self.task_id = task_id
+
         self.logger = logging.getLogger(__name__)
         logging.basicConfig(
             level=logging.INFO,
@@ -48,6 +191,7 @@ class SleepSoundsPlayer:
 
         self.load_config()
         self.is_playing = False
+        self.faded_in = False
         self.initialized = True
 
     def load_config(self):
@@ -55,36 +199,31 @@ class SleepSoundsPlayer:
         Loads config for the bluetooth address & stop_time.
         Loads sources for the YouTube URL list.
         Creates the cache folder if needed.
+        Both files come validated from the config cache (parsed only when they change).
         """
-        try:
-            with open(CONFIG_FILE, 'r') as f:
-                self.config = json.load(f)
-            # e.g. "bluetooth_devices": [{"mac_address": "..."}], "stop_time": "23:30"
-            self.bluetooth_mac = self.config['bluetooth_devices'][0]['mac_address']
-            self.stop_time_str = self.config['stop_time']
+        self.config = load_config(instance_file(CONFIG_FILE, CURRENT_TASK_DIR), SleepSoundsConfig)
+        self.bluetooth_mac = self.config.bluetooth_devices[0].mac_address
+        self.stop_time_str = self.config.stop_time
+        self.youtube_urls = load_config(instance_file(SOURCES_FILE, CURRENT_TASK_DIR), SleepSoundsSources).youtube_urls
 
-            with open(SOURCES_FILE, 'r') as f:
-                sources = json.load(f)
-            self.youtube_urls = sources['youtube_urls']
-
-            if not os.path.isdir(CACHE_DIR):
-                os.makedirs(CACHE_DIR, exist_ok=True)
-
-        except Exception as e:
-            self.logger.error(f"Error loading config/sources: {e}")
-            raise
+        if not os.path.isdir(CACHE_DIR):
+            os.makedirs(CACHE_DIR, exist_ok=True)
 
     def start(self):
         """
         1) Connect to Bluetooth
         2) Pick 1 random track from youtube_urls
         3) Download if needed, then loop until stop_time
+        A generator, like loop_until_stop.
         """
         try:
             if self.is_playing:
                 self.logger.info("Sleep sounds are already playing. Skipping start request.")
                 return
 
+            # Pick up config changes (a stat per file, no parsing if unchanged)
+            self.load_config()
+
             # Connect via Bluetooth
             bt_handler = BluetoothHandler(self.bluetooth_mac)
             if not bt_handler.connect():
@@ -96,6 +235,7 @@ class SleepSoundsPlayer:
             # Pick a single random track from the list
             chosen_url = random.choice(self.youtube_urls)
             self.logger.info(f"Chosen track: {chosen_url}")
+            get_state_store().set_state(self.task_id, 'last_track', {'url': chosen_url, 'played_at': time.time()})
 
             # Download if needed
             audio_path = self.download_audio_if_needed(chosen_url)
@@ -103,53 +243,101 @@ class SleepSoundsPlayer:
                 self.logger.error("Could not download or locate audio file. Exiting.")
                 return False
 
-            # Loop that single file until stop_time
-            self.loop_until_stop(audio_path)
+            # Loop that single file until stop_time, from its loop buffer if it can have one
+            yield from self.loop_until_stop(audio_path, self.prepare_loop_buffer(audio_path))
         except Exception as e:
             self.logger.error(f"Error in start(): {e}")
             return False
 
-    def loop_until_stop(self, audio_path):
+    def loop_until_stop(self, audio_path, loop_path=None):
         """
-        Continuously loops a single audio file (using a MediaList in loop mode) until
-        the stop_time is reached.
+        Continuously loops a single audio file until the stop_time is reached: its loop
+        buffer streamed endlessly if there's one, otherwise the file itself in a MediaList
+        in loop mode.
+        Yields the seconds it waits while playing (see Task.module_waits), so that the
+        other tasks keep running and can take the speaker.
         """
         self.is_playing = True
         stop_dt = self.get_stop_datetime()
         self.logger.info(f"Playing sleep sounds until {stop_dt.strftime('%Y-%m-%d %H:%M')}")
 
-        # Setup VLC with a MediaList containing only this single track
-        vlc_instance = vlc.Instance('--network-caching=3000',
-                                    '--file-caching=3000',
-                                    '--live-caching=3000',
-                                    '--aout=pulse')  # or '--aout=alsa', etc.
-
-        media_list = vlc_instance.media_list_new([audio_path])
-        list_player = vlc_instance.media_list_player_new()
-        list_player.set_media_list(media_list)
-
-        # Set loop mode
-        list_player.set_playback_mode(vlc.PlaybackMode.loop)
-
-        # We can set volume on the underlying media player object
-        media_player = list_player.get_media_player()
-        media_player.audio_set_volume(50)
-
-        # Start playing in loop
-        list_player.play()
+        # The libvlc engine is shared with the other tasks and stays warm, only the players are per run
+        vlc_instance = get_vlc_instance()
+        loop_buffer = None
+        if loop_path and hasattr(vlc_instance, 'media_new_callbacks'):
+            loop_buffer = LoopBuffer(loop_path)
+            media = loop_buffer.media(vlc_instance)
+            list_player = media_player = vlc_instance.media_player_new()
+            media_player.set_media(media)
+            audio_path = loop_path
+        else:
+            # A MediaList containing only this single track, in loop mode (re-opened at each pass)
+            if loop_path:
+                media = vlc_instance.media_new(loop_path, *(f':{option}' for option in RAW_AUDIO_OPTIONS))
+                audio_path = loop_path
+            else:
+                media = vlc_instance.media_new(audio_path)
+            media_list = vlc_instance.media_list_new()
+            media_list.add_media(media)
+            list_player = vlc_instance.media_list_player_new()
+            list_player.set_media_list(media_list)
+            list_player.set_playback_mode(vlc.PlaybackMode.loop)
+            # We can set volume on the underlying media player object
+            media_player = list_player.get_media_player()
+        # Start silent, the focus callback fades in
+        ramper = get_volume_ramper()
+        ramper.set(media_player, vlc_setter(media_player), 0)
+        self.faded_in = False
+
+        # Start playing in loop, as soon as we own the speaker
+        audio_focus = get_audio_focus()
+        audio_focus.request(self.task_id, AUDIO_FOCUS_PRIORITY,
+                            lambda state: self.on_audio_focus_change(list_player, media_player, state))
         self.logger.info(f"Now looping: {audio_path}")
 
         try:
-            # Poll until it's time to stop
-            while datetime.now() < stop_dt:
-                time.sleep(2)  # Check every couple seconds
+            # Poll until it's time to fade out, so that the sounds end at stop_time
+            fade_out_dt = stop_dt - timedelta(seconds=FADE_OUT)
+            while datetime.now() < fade_out_dt:
+                yield min(STOP_CHECK_INTERVAL, (fade_out_dt - datetime.now()).total_seconds())
+            if audio_focus.owner() == self.task_id:
+                fade = ramper.ramp(media_player, vlc_setter(media_player), 0, FADE_OUT)
+                yield FADE_OUT
+                fade.wait(1)
         finally:
+            audio_focus.release(self.task_id)
+            ramper.forget(media_player)
             list_player.stop()
             list_player.release()
-            vlc_instance.release()
+            if loop_buffer is None:
+                media_list.release()
+            media.release()
+            # After stop(): libvlc doesn't read from the buffer anymore
+            if loop_buffer is not None:
+                loop_buffer.close()
             self.is_playing = False
             self.logger.info("Reached stop time. Stopped playing.")
 
+    def on_audio_focus_change(self, list_player, media_player, state):
+        # Only schedules ramps: focus callbacks must not block
+        ramper = get_volume_ramper()
+        setter = vlc_setter(media_player)
+        if state == GAINED:
+            fade = FOCUS_FADE if self.faded_in else FADE_IN
+            self.faded_in = True
+            list_player.play()
+            ramper.ramp(media_player, setter, VOLUME, fade, curve='exponential')
+        elif state == DUCKED:
+            ramper.ramp(media_player, setter, DUCKED_VOLUME, FOCUS_FADE)
+        elif state == PAUSED:
+            def pause_when_silent(completed):
+                if completed:
+                    list_player.set_pause(1)
+            ramper.ramp(media_player, setter, 0, FOCUS_FADE, on_done=pause_when_silent)
+        else:
+            ramper.cancel(media_player)
+            list_player.stop()
+
     def get_stop_datetime(self):
         """
         Parse stop_time_str (e.g. '23:30') into a datetime for today.
@@ -233,6 +421,43 @@ class SleepSoundsPlayer:
         else:
             return None
 
+    def prepare_loop_buffer(self, audio_path):
+        """
+        Path of the loop buffer of audio_path (see crossfade_loop), decoded by ffmpeg the
+        first time. None without ffmpeg or if the decoding fails: the file is then played as is.
+        """
+        loop_path = os.path.splitext(audio_path)[0] + LOOP_SUFFIX
+        if os.path.isfile(loop_path) and os.path.getsize(loop_path) > 0:
+            return loop_path
+        ffmpeg_path = shutil.which('ffmpeg')
+        if not ffmpeg_path:
+            self.logger.info("ffmpeg not found: looping the downloaded file as is")
+            return None
+
+        self.logger.info(f"Decoding loop buffer to {loop_path}")
+        temp_path = loop_path + '.tmp'
+        cmd = [
+            ffmpeg_path, '-nostdin', '-v', 'error', '-y',
+            '-i', audio_path,
+            '-vn', '-t', str(LOOP_MAX_SECONDS + LOOP_CROSSFADE),
+            '-f', 's16le', '-acodec', 'pcm_s16le', '-ac', str(CHANNELS), '-ar', str(SAMPLE_RATE),
+            temp_path
+        ]
+        try:
+            subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+            if os.path.getsize(temp_path) < LOOP_MIN_SECONDS * SAMPLE_RATE * FRAME_BYTES:
+                raise ValueError("track too short")
+            crossfade_loop(temp_path)
+            # Complete or nothing: a loop buffer in the cache is always a whole one
+            os.replace(temp_path, loop_path)
+        except (OSError, ValueError, subprocess.CalledProcessError) as e:
+            details = getattr(e, 'stderr', None) or e
+            self.logger.error(f"Could not decode the loop buffer: {details}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return None
+        return loop_path
+
     def _sanitize_filename(self, text):
         """
         Removes or replaces characters likely to be invalid on various filesystems.
@@ -241,59 +466,26 @@ class SleepSoundsPlayer:
         return re.sub(r'[^0-9a-zA-Z \-_]+', '', text).strip()
 
 
-def check_if_already_running():
-    """
-    Create a PID file to ensure only one instance runs at a time,
-    same style as your radio task.
-    """
-    if os.path.isfile(PID_FILE):
-        try:
-            with open(PID_FILE, 'r') as f:
-                old_pid = int(f.read().strip())
-            if psutil.pid_exists(old_pid):
-                # Double check it's python
-                try:
-                    process = psutil.Process(old_pid)
-                    if "python" in process.name().lower():
-                        print(f"Another instance is already running (PID: {old_pid})")
-                        sys.exit()
-                except (psutil.NoSuchProcess, psutil.AccessDenied):
-                    pass
-            # If we get here, the PID file is stale
-            os.remove(PID_FILE)
-        except (ValueError, IOError):
-            logging.warning("Invalid/corrupted PID file. Removing it.")
-            os.remove(PID_FILE)
-
-    # Write current PID
-    try:
-        with open(PID_FILE, 'w') as f:
-            f.write(str(os.getpid()))
-    except IOError as e:
-        logging.error(f"Could not write PID file: {e}")
-        sys.exit(1)
-
-def delete_pid_file():
+def main():
     """
-    Remove the PID file at the end, so subsequent runs can proceed.
+    Only one run at a time, even across processes: the lock in the state store
+    replaces the old PID file and is released by the kernel if we die.
     """
-    if os.path.isfile(PID_FILE):
-        os.remove(PID_FILE)
-
-def main():
-    check_if_already_running()
     try:
-        player = SleepSoundsPlayer()
-        player.start()
-    finally:
-        delete_pid_file()
+        task_id = instance_id(TASK_ID)
+        with get_state_store().lock(task_id):
+            player = SleepSoundsPlayer(task_id)
+            yield from player.start()
+    except LockHeld as e:
+        print(f"Another instance is already running: {e}")
 
 def thread_loop():
     """
     If you run this script from your automator as a "task" in a separate thread,
     call thread_loop() (similar to your radio script).
     """
-    main()
+    yield from main()
 
 if __name__ == "__main__":
-    main()
+    for seconds in main():
+        time.sleep(seconds)
@@ -1,8 +1,280 @@
+import os
+import re
+import time
+import random
+import shutil
+import bisect
+import logging
+import calendar
+import subprocess
 import webbrowser
-import sys
+from datetime import datetime, timedelta
+from task.config import ConfigObject, Field, DictOf, load_config, DAYS_OF_WEEK
+from task.instance import instance_file
 
-chrome_command = "C:/Program Files/Google/Chrome/Application/chrome.exe %s"
-url = "http://google.com"
+# Opens the URLs of url_list.json:
+#   - OnStartup entries once, a (jittered) delay after the automator started
+#   - Timed entries at their time, on the months / weeks of the month / days of the week they list
+# The whole file is compiled into one sorted timetable: the task's trigger.json has
+# schedule_source "module", so the orchestrator sleeps until next_run_after() and
+# wakes the task once per distinct minute, whatever the number of entries.
 
+CURRENT_TASK_DIR = os.path.dirname(__file__)
 
-webbrowser.get(chrome_command).open(url)
\ No newline at end of file
+# Browsers that open several URLs in one launch, in order of preference
+BROWSER_COMMANDS = (
+    ['chromium-browser'],
+    ['chromium'],
+    ['google-chrome'],
+    ['firefox'],
+    ['C:/Program Files/Google/Chrome/Application/chrome.exe'],
+)
+
+ALL = 'All'
+MONTHS = tuple(calendar.month_name[1:])
+DURATION_RE = re.compile(r'^(\d+(?:\.\d+)?)\s*([smhd]?)$')
+DURATION_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}
+TIME_RE = re.compile(r'^([01]?\d|2[0-3])[.:]([0-5]\d)$')
+# How far ahead a Timed entry is looked for (a yearly pattern always matches within a year)
+LOOKAHEAD_DAYS = 366
+# Fallback start time where /proc isn't available
+IMPORTED_AT = time.time()
+
+logger = logging.getLogger(__name__)
+
+
+# ---- schema ----
+
+def parse_duration(value):
+    """Seconds of a delay like 90, "45s", "10m", "2h"."""
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = DURATION_RE.match(value.strip())
+    return float(match.group(1)) * DURATION_UNITS[match.group(2)]
+
+
+def check_duration(value):
+    if isinstance(value, str) and not DURATION_RE.match(value.strip()):
+        return f"{value!r} is not a duration like 90, \"45s\", \"10m\" or \"2h\""
+    if isinstance(value, (int, float)) and value < 0:
+        return f"must not be negative, got {value}"
+    return None
+
+
+def check_variance(value):
+    if not 0 <= value <= 1:
+        return f"{value} is not a fraction between 0 and 1"
+    return None
+
+
+def check_time(value):
+    if not TIME_RE.match(value):
+        return f"{value!r} is not a HH.MM time"
+    return None
+
+
+def selector_check(names, first, last):
+    """Check of a selector: "All", a name or number, or a list of them."""
+    def check(value):
+        values = value if isinstance(value, list) else [value]
+        for item in values:
+            if item == ALL or item in names or (isinstance(item, int) and first <= item <= last):
+                continue
+            allowed = [ALL] + list(names) + [f"{first}-{last}"]
+            return f"{item!r} is not one of {', '.join(allowed)}"
+        return None
+    return check
+
+
+class StartupEntry(ConfigObject):
+    FIELDS = {
+        'URL': Field(str),
+        'delay': Field((str, int, float), required=False, default=0, check=check_duration),
+        # The delay varies randomly by up to this fraction, either way
+        'varianceDelay': Field((int, float), required=False, default=0, check=check_variance),
+        'Day': Field((str, list), required=False, default=ALL, check=selector_check(DAYS_OF_WEEK, 1, 7)),
+    }
+    __slots__ = tuple(FIELDS)
+
+
+class TimedEntry(ConfigObject):
+    FIELDS = {
+        'URL': Field(str),
+        'Month': Field((str, int, list), required=False, default=ALL, check=selector_check(MONTHS, 1, 12)),
+        # Week of the month, 1 to 5
+        'Week': Field((str, int, list), required=False, default=ALL, check=selector_check((), 1, 5)),
+        'DayOfWeek': Field((str, list), required=False, default=ALL, check=selector_check(DAYS_OF_WEEK, 1, 7)),
+        'Time': Field(str, check=check_time),
+    }
+    __slots__ = tuple(FIELDS)
+
+
+class UrlList(ConfigObject):
+    FIELDS = {
+        'OnStartup': Field(DictOf(StartupEntry), required=False, default={}),
+        'Timed': Field(DictOf(TimedEntry), required=False, default={}),
+    }
+    __slots__ = tuple(FIELDS)
+
+
+CONFIG_SCHEMAS = {
+    'url_list.json': UrlList,
+}
+
+
+# ---- timetable ----
+
+def selector_set(value, names):
+    """The set of numbers (1-based) a selector stands for, or None for "All"."""
+    values = value if isinstance(value, list) else [value]
+    if ALL in values:
+        return None
+    return frozenset(item if isinstance(item, int) else names.index(item) + 1 for item in values)
+
+
+class TimedSlot:
+    """All the Timed entries sharing a time of day, with their date filters precompiled."""
+    __slots__ = ('minute', 'entries')
+
+    def __init__(self, minute):
+        self.minute = minute
+        self.entries = []   # (name, url, months, weeks, days): None stands for any
+
+    def urls_on(self, day):
+        week = (day.day - 1) // 7 + 1
+        return [(name, url) for name, url, months, weeks, days in self.entries
+                if (months is None or day.month in months)
+                and (weeks is None or week in weeks)
+                and (days is None or day.isoweekday() in days)]
+
+
+class Timetable:
+    """
+    url_list.json compiled once: Timed entries grouped into slots sorted by time of day,
+    OnStartup entries resolved to absolute times. Looking up the next occurrence or the
+    URLs due at a minute costs a bisect plus the entries of the matching slots.
+    """
+
+    def __init__(self, url_list, started_at):
+        slots = {}
+        for name, entry in url_list.Timed.items():
+            hours, minutes = map(int, TIME_RE.match(entry.Time).groups())
+            slot = slots.setdefault(hours * 60 + minutes, TimedSlot(hours * 60 + minutes))
+            slot.entries.append((name, entry.URL, selector_set(entry.Month, MONTHS),
+                                 selector_set(entry.Week, ()), selector_set(entry.DayOfWeek, DAYS_OF_WEEK)))
+        self.slots = [slots[minute] for minute in sorted(slots)]
+        self.slot_minutes = [slot.minute for slot in self.slots]
+
+        # Startup delays are drawn once per automator start (seeded by it), so a task
+        # restarted after a crash gets the same times and doesn't open them again
+        startup = {}
+        start_day = datetime.fromtimestamp(started_at)
+        for name, entry in url_list.OnStartup.items():
+            days = selector_set(entry.Day, DAYS_OF_WEEK)
+            if days is not None and start_day.isoweekday() not in days:
+                continue
+            delay = parse_duration(entry.delay)
+            jitter = random.Random(f"{started_at}-{name}").uniform(-entry.varianceDelay, entry.varianceDelay)
+            at = truncate_to_minute(datetime.fromtimestamp(started_at + delay * (1 + jitter)))
+            startup.setdefault(at, []).append((name, entry.URL))
+        self.startup_times = sorted(startup)
+        self.startup = startup
+
+    def next_after(self, after):
+        """First minute strictly after `after` with something to open, or None."""
+        candidates = []
+        i = bisect.bisect_right(self.startup_times, after)
+        if i < len(self.startup_times):
+            candidates.append(self.startup_times[i])
+
+        day = after.date()
+        minute_after = after.hour * 60 + after.minute
+        for offset in range(LOOKAHEAD_DAYS + 1):
+            current = day + timedelta(days=offset)
+            first = bisect.bisect_right(self.slot_minutes, minute_after) if offset == 0 else 0
+            found = next((slot for slot in self.slots[first:] if slot.urls_on(current)), None)
+            if found is not None:
+                candidates.append(datetime.combine(current, datetime.min.time()) + timedelta(minutes=found.minute))
+                break
+            # The startup entries are nearer anyway
+            if candidates and datetime.combine(current, datetime.max.time()) >= candidates[0]:
+                break
+        return min(candidates) if candidates else None
+
+    def due_at(self, moment):
+        """(name, url) of everything scheduled at the minute of `moment`."""
+        moment = truncate_to_minute(moment)
+        due = list(self.startup.get(moment, []))
+        minute = moment.hour * 60 + moment.minute
+        i = bisect.bisect_left(self.slot_minutes, minute)
+        if i < len(self.slots) and self.slot_minutes[i] == minute:
+            due.extend(self.slots[i].urls_on(moment.date()))
+        return due
+
+
+def truncate_to_minute(moment):
+    return moment.replace(second=0, microsecond=0)
+
+
+def automator_started_at():
+    """Start time of this process: the startup entries count from there, even after a task restart."""
+    try:
+        with open('/proc/self/stat', 'r') as f:
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/stat', 'r') as f:
+            boot_time = next(int(line.split()[1]) for line in f if line.startswith('btime'))
+        return boot_time + start_ticks // os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError, StopIteration):
+        return int(IMPORTED_AT)
+
+
+# url_list.json path (one per instance of the task) -> (config it was compiled from, Timetable)
+_timetables = {}
+
+
+def get_timetable():
+    """The compiled timetable, recompiled only when url_list.json changes (the config cache tells)."""
+    path = instance_file('url_list.json', CURRENT_TASK_DIR)
+    url_list = load_config(path, UrlList)
+    compiled_from, timetable = _timetables.get(path, (None, None))
+    if url_list is not compiled_from:
+        timetable = Timetable(url_list, automator_started_at())
+        _timetables[path] = (url_list, timetable)
+        logger.info(f"Timetable compiled: {len(timetable.slots)} daily slot(s), "
+                    f"{len(timetable.startup_times)} startup time(s)")
+    return timetable
+
+
+# ---- browser ----
+
+def open_urls(urls):
+    """Open all the URLs with a single browser launch when possible."""
+    for command in BROWSER_COMMANDS:
+        if shutil.which(command[0]) or os.path.isfile(command[0]):
+            subprocess.Popen(command + list(urls), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            return
+    # Unknown browser: let webbrowser open them, as tabs of the same window
+    browser = webbrowser.get()
+    browser.open_new(urls[0])
+    for url in urls[1:]:
+        browser.open_new_tab(url)
+
+
+# ---- task entry points ----
+
+def next_run_after(after):
+    """Called by the orchestrator (schedule_source "module"): the next minute something is due."""
+    return get_timetable().next_after(after)
+
+
+def thread_loop(scheduled_time=None):
+    due = get_timetable().due_at(scheduled_time or datetime.now())
+    if not due:
+        return
+    # Entries of the same minute share one browser launch; the same URL is opened once
+    urls = list(dict.fromkeys(url for _, url in due))
+    logger.info(f"Opening {len(urls)} URL(s) for {', '.join(name for name, _ in due)}")
+    open_urls(urls)
+
+
+# Remember to not put any top-level executable code (that is, in this scope)
@@ -1,17 +1,16 @@
-from pywebostv.discovery import discover
-from pywebostv.connection import WebOSClient
-from pywebostv.controls import InputControl, MediaControl, SystemControl
+from task.webos_tv import get_tv_session
+from task.tv_discovery import resolve_tv_host
 
 import os
 import json
 import time
 
 FILE_STORE_NAME = "connection_settings.store"
+TV_CONFIG_FILE = os.path.join(os.path.dirname(__file__), '..', 'lg_wakeup_alarm', 'config.json')
 
-# The first time the software is run, we don't have connection infos, so we need to retrieve them.
-# Just check if the file connection_store is already present in the root folder of the python script;
-# If positive, load connection infos from there, otherwise declare store as an emtpy dictionary,
-# it will be populated at first successful connection attempt and later will be saved to disk.
+# The client key is kept by the session in the automator state store after the first
+# registration. A key saved by older versions of this script in connection_settings.store
+# is still used if the state store doesn't know the TV yet.
 
 if os.path.exists(FILE_STORE_NAME) and (os.path.getsize(FILE_STORE_NAME)!=0):
     with open(FILE_STORE_NAME, "r") as file:
@@ -19,34 +18,26 @@ if os.path.exists(FILE_STORE_NAME) and (os.path.getsize(FILE_STORE_NAME)!=0):
 else:
     store = {}
 
-# Scans the current network to discover TV. Avoid [0] in real code. If you already know the IP,
-# you could skip the slow scan and # instead simply say:
-#    client = WebOSClient("<IP Address of TV>")
-# or for newer models:
-#    client = WebOSClient("<IP Address of TV>", secure=True)
-client = WebOSClient.discover(secure=True)[0] # Use discover(secure=True) for newer models.
-client.connect()
-for status in client.register(store):
-    if status == WebOSClient.PROMPTED:
-        print("Please accept the connect on the TV!")
-    elif status == WebOSClient.REGISTERED:
-        print("Registration successful!")
+# Find the TV by its MAC: the kernel neighbor table or the address cached from the last
+# time answer in milliseconds, the slow network scan only runs if the TV was never seen.
+# If you already know the IP, you could simply say:
+#    session = get_tv_session("<IP Address of TV>")
+with open(TV_CONFIG_FILE, "r") as file:
+    tv_config = json.load(file)
+host = resolve_tv_host(tv_config['lgtv_mac_address'])
+if host is None:
+    raise SystemExit("TV not found on the network")
 
-# Keep the 'store' object because it contains now the access token
-# and use it next time you want to register on the TV.
-print(store)   # {'client_key': 'ACCESS_TOKEN_FROM_TV'}
+# The session registers on first use (the TV prompts only the first time), then keeps the
+# websocket open: the following commands skip the handshake and the registration
+session = get_tv_session(host, secure=True, client_key=store.get('client_key'))
 
-# Save the configuration of the connection
-with open(FILE_STORE_NAME, "w") as file:
-    json.dump(store, file)
+system = session.system
 
-
-system = SystemControl(client)
-
-media = MediaControl(client)
+media = session.media
 media.set_volume(5)    # The argument is an integer from 1 to 100. Doesn't return anything.
 time.sleep(10)
-media.mute(status)         # status=True mutes the TV. status=Fale unmutes it.
+media.mute(True)       # True mutes the TV, False unmutes it.
 time.sleep(18)
 
 
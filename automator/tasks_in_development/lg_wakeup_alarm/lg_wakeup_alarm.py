@@ -1,9 +1,18 @@
 import json
+import math
 import random
 import time
 from wakeonlan import send_magic_packet
-from pywebostv.connection import WebOSClient
-from pywebostv.controls import MediaControl, ApplicationControl, SystemControl
+from task.webos_tv import get_tv_session, TVUnavailable
+from task.wake_on_lan import wake_until_ready, WAKE_DEADLINE
+from task.tv_discovery import resolve_tv_host, get_tv_directory
+from orchestrator.volume_ramp import get_volume_ramper, webos_setter, WEBOS_STEP_INTERVAL
+
+# The volume used to go up by volume_steps every VOLUME_STEP_SECONDS: the ramp keeps
+# that overall duration, but rises smoothly
+VOLUME_STEP_SECONDS = 5
+# Seconds between two searches of a TV woken without knowing its address
+FIND_INTERVAL = 2
 
 class LGWakeupAlarm():
     def __init__(self):
@@ -12,34 +21,65 @@ class LGWakeupAlarm():
         with open('config.json', 'r') as file:
             config = json.load(file)
 
-        self.LGTV_IP = config['lgtv_ip']
         self.LGTV_MAC_ADDRESS = config['lgtv_mac_address']
+        # Found by MAC when waking it (see wake_tv); the configured IP is only a fallback
+        self.LGTV_IP_HINT = config.get('lgtv_ip')
+        self.LGTV_IP = None
         self.CHANNEL_LIST = config['channel_list']
         self.BLUETOOTH_ADDRESS = config['bluetooth_address']
         self.VOLUME_STEPS = config['volume_steps']
         self.MAX_VOL = config['max_vol']
         self.TIME_ON = config['time_on']
 
-        self.client = self.connect_to_tv()
-        self.media_control = MediaControl(self.client)
-        self.app_control = ApplicationControl(self.client)
-        self.system_control = SystemControl(self.client)
+        # Set by wake_tv, once the TV can be found
+        self.session = None
+        self.media_control = self.app_control = self.system_control = None
 
-    # Wake up the TV using Wake-on-LAN
+    # Wake up the TV using Wake-on-LAN, returning as soon as its WebOS port answers
     def wake_tv(self):
-        send_magic_packet(self.LGTV_MAC_ADDRESS)
-        print("Sent Wake-on-LAN packet.")
-
-    # Connect to the TV
+        start = time.monotonic()
+        # Asleep, the TV is in no neighbor table and doesn't answer SSDP: only the address
+        # it had last time (or the configured one) can be had now, so no scan yet
+        host = resolve_tv_host(self.LGTV_MAC_ADDRESS, hint=self.LGTV_IP_HINT, scan=False)
+        if host is None:
+            # Wake it blind, then look for it once it's on the network
+            send_magic_packet(self.LGTV_MAC_ADDRESS)
+            host = self.find_tv(WAKE_DEADLINE)
+        try:
+            wake_until_ready(self.LGTV_MAC_ADDRESS, host)
+        except TVUnavailable:
+            if host == self.LGTV_IP_HINT:
+                raise
+            # The remembered address may be stale (DHCP): woken by now, the TV can be found
+            print(f"TV not answering at {host}, looking for it.")
+            get_tv_directory().forget(self.LGTV_MAC_ADDRESS)
+            host = self.find_tv(WAKE_DEADLINE)
+            wake_until_ready(self.LGTV_MAC_ADDRESS, host)
+        # Awake, it answers ARP: resolve again so the session gets its current address
+        self.LGTV_IP = resolve_tv_host(self.LGTV_MAC_ADDRESS, hint=host, scan=False)
+        print(f"TV awake at {self.LGTV_IP} after {time.monotonic() - start:.1f} seconds.")
+
+        # The controls connect on first use and survive reconnections
+        self.session = self.connect_to_tv()
+        self.media_control = self.session.media
+        self.app_control = self.session.app
+        self.system_control = self.session.system
+
+    # The address of a TV that has just been woken: neighbor table, SSDP announcements, scans
+    def find_tv(self, deadline):
+        end = time.monotonic() + deadline
+        while True:
+            host = resolve_tv_host(self.LGTV_MAC_ADDRESS)
+            if host is not None:
+                return host
+            if time.monotonic() >= end:
+                raise TVUnavailable(f"TV {self.LGTV_MAC_ADDRESS} not found on the network {deadline}s after Wake-on-LAN")
+            time.sleep(FIND_INTERVAL)
+
+    # The shared session of the TV: the client key is stored after the first
+    # registration, and the connection stays open between commands and runs
     def connect_to_tv(self):
-        client = WebOSClient(self.LGTV_IP)  # Replace with your TV's IP address
-        client.connect()
-        for status in client.register({'client-key': 'YOUR_CLIENT_KEY'}):  # Replace with your client key
-            if status == WebOSClient.PROMPTED:
-                print("Please accept the connection on the TV!")
-            elif status == WebOSClient.REGISTERED:
-                print("Registration successful!")
-        return client
+        return get_tv_session(self.LGTV_IP)
 
     # Set TV volume to 0
     def set_volume_zero(self):
@@ -59,14 +99,15 @@ class LGWakeupAlarm():
         self.media_control.set_channel(random_channel)
         print(f"Set TV to random channel: {random_channel}.")
 
-    # Gradually increase the volume
-    def gradually_increase_volume(self, audio_control, max_vol, volume_steps):
-        current_vol = 0
-        while current_vol < max_vol:
-            current_vol = min(current_vol + self.VOLUME_STEPS, self.MAX_VOL)
-            audio_control.set_volume(current_vol)
-            print(f"Increased volume to {current_vol}.")
-            time.sleep(5)
+    # Gradually increase the volume (on the shared ramper: no sleep per step)
+    def gradually_increase_volume(self, max_vol=None, volume_steps=None):
+        max_vol = self.MAX_VOL if max_vol is None else max_vol
+        volume_steps = self.VOLUME_STEPS if volume_steps is None else volume_steps
+        duration = math.ceil(max_vol / volume_steps) * VOLUME_STEP_SECONDS
+        ramp = get_volume_ramper().ramp('lg_tv', webos_setter(self.media_control), max_vol, duration,
+                                        start=0, curve='exponential', step_interval=WEBOS_STEP_INTERVAL)
+        ramp.wait()
+        print(f"Increased volume to {max_vol}.")
 
     # Shut down the TV after the specified time
     def shut_down_tv(self):
@@ -93,12 +134,9 @@ def thread_loop():
 
     wake_alarm = LGWakeupAlarm()
 
-    # Step 1: Wake up the TV
+    # Step 1: Wake up the TV (waits until it accepts connections, up to a deadline)
     wake_alarm.wake_tv()
 
-    # Allow some time for the TV to wake up and connect
-    time.sleep(10)
-
     # Step 3: Set volume to 0
     wake_alarm.set_volume_zero()
 
@@ -0,0 +1,326 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import threading
+import subprocess
+
+# Runs the steps of steps.json (the submodules), each as soon as the steps it comes
+# after are done, independent ones at the same time. A step that succeeded is
+# remembered with a fingerprint of its command and inputs (and of the steps it comes
+# after): a later run skips it until one of them changes or one of its outputs is gone.
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+STEPS_FILE = os.path.join(SCRIPT_DIR, "steps.json")
+STATE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "rasputils", "first_setup")
+STATE_FILE = os.path.join(STATE_DIR, "state.json")
+# Output of the unattended steps (they run together: their output isn't mixed on the terminal)
+LOG_DIR = os.path.join(STATE_DIR, "logs")
+JOBS = 4
+# Lines of the log shown when an unattended step fails
+FAILURE_TAIL = 20
+# Seconds between two refreshes of the sudo credentials while the steps run
+SUDO_REFRESH_INTERVAL = 60
+# Set for the submodules, e.g. so their scripts skip the final pause meant for a manual run
+RUNNER_ENV = "FIRST_SETUP_RUNNER"
+
+DONE, SKIPPED, FAILED, BLOCKED = "done", "skipped", "failed", "blocked"
+
+
+class Step:
+    def __init__(self, name, spec):
+        self.name = name
+        self.description = spec.get("description", "")
+        self.command = spec["command"]
+        self.inputs = spec.get("inputs", [])
+        self.outputs = spec.get("outputs", [])
+        self.after = spec.get("after", [])
+        # Steps sharing a lock never run at the same time (e.g. "dpkg": one apt at a time)
+        self.locks = set(spec.get("locks", []))
+        # Asks questions: runs alone, attached to the terminal
+        self.interactive = spec.get("interactive", False)
+        self.sudo = spec.get("sudo", False)
+        self.enabled = spec.get("enabled", True)
+        self.fingerprint = None
+        self.status = None
+        self.duration = None
+
+    def compute_fingerprint(self, steps):
+        digest = hashlib.sha256(json.dumps(self.command).encode())
+        for path in self.inputs:
+            digest.update(b"\0" + path.encode() + b"\0")
+            full_path = resolve_path(path)
+            if os.path.isfile(full_path):
+                with open(full_path, "rb") as f:
+                    digest.update(f.read())
+        # A step redone means the ones after it are redone too
+        for name in self.after:
+            digest.update(b"\0" + steps[name].fingerprint.encode())
+        self.fingerprint = digest.hexdigest()
+
+    def outputs_exist(self):
+        return all(os.path.exists(resolve_path(path)) for path in self.outputs)
+
+
+def resolve_path(path):
+    return os.path.join(SCRIPT_DIR, os.path.expanduser(path))
+
+
+def load_steps(steps_file):
+    with open(steps_file, "r") as f:
+        steps = {name: Step(name, spec) for name, spec in json.load(f).items()}
+    for step in steps.values():
+        unknown = [name for name in step.after if name not in steps]
+        if unknown:
+            raise ValueError(f"Step {step.name} comes after unknown step(s) {', '.join(unknown)}")
+    # Fingerprints in dependency order (checks for cycles at the same time)
+    for step in topological_order(steps):
+        step.compute_fingerprint(steps)
+    return steps
+
+
+def topological_order(steps):
+    order, visiting, visited = [], set(), set()
+
+    def visit(step):
+        if step.name in visited:
+            return
+        if step.name in visiting:
+            raise ValueError(f"Dependency cycle through step {step.name}")
+        visiting.add(step.name)
+        for name in step.after:
+            visit(steps[name])
+        visiting.discard(step.name)
+        visited.add(step.name)
+        order.append(step)
+
+    for step in steps.values():
+        visit(step)
+    return order
+
+
+def select_steps(steps, names):
+    """The steps to consider: the named ones and everything they come after, or all the enabled ones."""
+    if not names:
+        return {name: step for name, step in steps.items() if step.enabled}
+    selected = {}
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        if name not in steps:
+            raise ValueError(f"Unknown step {name} (see --list)")
+        if name not in selected:
+            selected[name] = steps[name]
+            pending.extend(steps[name].after)
+    return selected
+
+
+def load_state():
+    try:
+        with open(STATE_FILE, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state):
+    os.makedirs(STATE_DIR, exist_ok=True)
+    temp_file = STATE_FILE + ".tmp"
+    with open(temp_file, "w") as f:
+        json.dump(state, f, indent=4)
+    os.replace(temp_file, STATE_FILE)
+
+
+class Runner:
+    def __init__(self, steps, state, jobs=JOBS, force=False, dry_run=False):
+        self.steps = steps
+        self.state = state
+        self.jobs = jobs
+        self.force = force
+        self.dry_run = dry_run
+        self.running = {}   # name -> thread
+        self.held_locks = set()
+        self.condition = threading.Condition()
+
+    def is_up_to_date(self, step):
+        record = self.state.get(step.name)
+        return (not self.force and record is not None and record.get("fingerprint") == step.fingerprint
+                and step.outputs_exist())
+
+    def run(self):
+        for step in self.steps.values():
+            if self.is_up_to_date(step):
+                step.status = SKIPPED
+        todo = [step for step in self.steps.values() if step.status is None]
+        if self.dry_run:
+            for step in todo:
+                print(f"Would run {step.name}")
+            return True
+        if any(step.sudo for step in todo):
+            self.start_sudo_keepalive()
+
+        with self.condition:
+            while True:
+                self.block_failed_dependents()
+                pending = [step for step in self.steps.values() if step.status is None and step.name not in self.running]
+                if not pending and not self.running:
+                    break
+                step = self.next_ready(pending)
+                if step is None:
+                    self.condition.wait()
+                    continue
+                self.start(step)
+        return all(step.status in (DONE, SKIPPED) for step in self.steps.values())
+
+    def next_ready(self, pending):
+        """A step whose dependencies are done and that can start now, or None."""
+        ready = [step for step in pending
+                 if all(self.steps[name].status in (DONE, SKIPPED) for name in step.after if name in self.steps)
+                 and not step.locks & self.held_locks]
+        # The questions come first, so the rest can then run unattended;
+        # then the longest steps (last time), which bound the total time
+        ready.sort(key=lambda step: (not step.interactive, -self.state.get(step.name, {}).get("duration", 0)))
+        for step in ready:
+            if any(self.steps[name].interactive for name in self.running):
+                return None
+            if step.interactive:
+                return step if not self.running else None
+            if len(self.running) < self.jobs:
+                return step
+        return None
+
+    def block_failed_dependents(self):
+        changed = True
+        while changed:
+            changed = False
+            for step in self.steps.values():
+                if step.status is None and step.name not in self.running and \
+                        any(self.steps[name].status in (FAILED, BLOCKED) for name in step.after if name in self.steps):
+                    step.status = BLOCKED
+                    changed = True
+                    print(f"[{step.name}] not run: a step it comes after failed")
+
+    def start(self, step):
+        self.held_locks |= step.locks
+        thread = threading.Thread(target=self.execute, args=(step,), name=step.name, daemon=True)
+        self.running[step.name] = thread
+        thread.start()
+
+    def execute(self, step):
+        print(f"[{step.name}] started{' (interactive)' if step.interactive else ''}: {step.description}")
+        env = dict(os.environ, **{RUNNER_ENV: "1"})
+        start = time.monotonic()
+        log_file = os.path.join(LOG_DIR, f"{step.name}.log")
+        try:
+            if step.interactive:
+                returncode = subprocess.call(step.command, cwd=SCRIPT_DIR, env=env)
+            else:
+                os.makedirs(LOG_DIR, exist_ok=True)
+                with open(log_file, "w") as log:
+                    returncode = subprocess.call(step.command, cwd=SCRIPT_DIR, env=env, stdin=subprocess.DEVNULL,
+                                                 stdout=log, stderr=subprocess.STDOUT)
+        except OSError as e:
+            print(f"[{step.name}] could not start: {e}")
+            returncode = -1
+        step.duration = time.monotonic() - start
+
+        with self.condition:
+            if returncode == 0:
+                step.status = DONE
+                self.state[step.name] = {"fingerprint": step.fingerprint, "duration": round(step.duration, 1),
+                                         "completed_at": time.strftime("%Y-%m-%d %H:%M:%S")}
+                save_state(self.state)
+                print(f"[{step.name}] done in {step.duration:.1f}s")
+            else:
+                step.status = FAILED
+                print(f"[{step.name}] failed (exit code {returncode}) after {step.duration:.1f}s")
+                if not step.interactive:
+                    print_tail(log_file)
+            self.held_locks -= step.locks
+            del self.running[step.name]
+            self.condition.notify_all()
+
+    def start_sudo_keepalive(self):
+        """Ask the password once, upfront, and keep it valid: the steps running together mustn't ask it."""
+        if os.geteuid() == 0 or subprocess.call(["sudo", "-v"]) != 0:
+            return
+
+        def refresh():
+            while True:
+                time.sleep(SUDO_REFRESH_INTERVAL)
+                subprocess.call(["sudo", "-n", "-v"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        threading.Thread(target=refresh, name="sudo-keepalive", daemon=True).start()
+
+
+def print_tail(log_file):
+    try:
+        with open(log_file, "r", errors="replace") as f:
+            lines = f.readlines()[-FAILURE_TAIL:]
+    except OSError:
+        return
+    for line in lines:
+        print(f"    {line.rstrip()}")
+    print(f"    (full output in {log_file})")
+
+
+def print_report(steps, wall_time):
+    print()
+    print(f"{'Step':<28}{'Status':<10}{'Seconds':>10}")
+    for step in steps.values():
+        duration = f"{step.duration:.1f}" if step.duration is not None else "-"
+        print(f"{step.name:<28}{step.status or '-':<10}{duration:>10}")
+    serial_time = sum(step.duration or 0 for step in steps.values())
+    print(f"Total: {wall_time:.1f}s ({serial_time:.1f}s of steps, one after the other)")
+
+
+def print_steps(steps, state):
+    for step in steps.values():
+        record = state.get(step.name)
+        if record is None:
+            status = "never run"
+        elif record.get("fingerprint") != step.fingerprint or not step.outputs_exist():
+            status = "changed since last run"
+        else:
+            status = f"done {record.get('completed_at', '')}"
+        enabled = "" if step.enabled else " [on demand]"
+        print(f"{step.name}{enabled}: {status}")
+        print(f"    {step.description}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Provision this Raspberry Pi: run the steps of steps.json that changed.")
+    parser.add_argument("steps", nargs="*", help="steps to run (with the ones they come after); all enabled ones if omitted")
+    parser.add_argument("-j", "--jobs", type=int, default=JOBS, help="unattended steps running at the same time")
+    parser.add_argument("--force", action="store_true", help="run the steps even if they are up to date")
+    parser.add_argument("--dry-run", action="store_true", help="only print the steps that would run")
+    parser.add_argument("--list", action="store_true", help="list the steps and their status")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    try:
+        all_steps = load_steps(STEPS_FILE)
+        steps = select_steps(all_steps, args.steps)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+    state = load_state()
+
+    if args.list:
+        print_steps(all_steps, state)
+        return
+
+    start = time.monotonic()
+    succeeded = Runner(steps, state, jobs=max(1, args.jobs), force=args.force, dry_run=args.dry_run).run()
+    if not args.dry_run:
+        print_report(steps, time.monotonic() - start)
+    if not succeeded:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
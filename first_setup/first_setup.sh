@@ -1,5 +1,5 @@
 #!/bin/bash
 
-# From here coordinate the execution of all the subscripts
-
-sleep 100
\ No newline at end of file
+# From here coordinate the execution of all the subscripts: first_setup.py runs the steps
+# of steps.json (independent ones in parallel) and skips the ones already done
+cd "$(dirname "$0")" && exec python3 first_setup.py "$@"
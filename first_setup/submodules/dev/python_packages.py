@@ -1,9 +1,37 @@
 import subprocess
 import sys
 import os
+import re
 import json
+import hashlib
+import argparse
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+JSON_FILE = os.path.join(SCRIPT_DIR, "python_packages.json")
+# Batch mode: wheels of everything installed so far (copy it along to provision a Pi offline)
+WHEELHOUSE_DIR = os.path.join(SCRIPT_DIR, "wheelhouse")
+# Batch mode: the resolved set (every package with its dependencies, pinned), written with --lock
+LOCK_FILE = os.path.join(SCRIPT_DIR, "python_packages.lock")
+LOCK_HEADER = "# python_packages.json sha256:"
+# Wheels of the missing packages are built by this many pip processes at once
+BUILD_JOBS = min(4, os.cpu_count() or 1)
+
+# Run by the selected interpreter: installed version of each distribution name, or null
+INSTALLED_VERSIONS_SNIPPET = """
+import json, sys
+from importlib import metadata
+versions = {}
+for name in json.loads(sys.argv[1]):
+    try:
+        versions[name] = metadata.version(name)
+    except metadata.PackageNotFoundError:
+        versions[name] = None
+print(json.dumps(versions))
+"""
+
 def find_python_installations():
     installations = []
 
@@ -43,6 +71,183 @@ def install_packages(python_executable, package_list):
         except subprocess.CalledProcessError as e:
             print(f"Failed to install {package}: {e}")
 
+# ---- batch mode: one resolution, one install, local wheelhouse ----
+
+def normalize_name(name):
+    """PEP 503 name: "Google_API.python-client" and "google-api-python-client" are the same package."""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def parse_requirement(requirement):
+    """(normalized name, specifier or None) of a requirement like "openai>=1.0"."""
+    try:
+        from packaging.requirements import Requirement
+    except ImportError:
+        try:
+            from pip._vendor.packaging.requirements import Requirement
+        except ImportError:
+            Requirement = None
+    if Requirement is not None:
+        parsed = Requirement(requirement)
+        return normalize_name(parsed.name), parsed.specifier
+    match = re.match(r"\s*([A-Za-z0-9][A-Za-z0-9._-]*)\s*(.*)", requirement)
+    return normalize_name(match.group(1)), match.group(2).strip() or None
+
+
+def is_satisfied(specifier, version):
+    if version is None:
+        return False
+    if not specifier:
+        return True
+    if isinstance(specifier, str):
+        # No packaging library to evaluate it: only an exact pin can be checked
+        return specifier == f"=={version}"
+    return specifier.contains(version, prereleases=True)
+
+
+def installed_versions(python_executable, names):
+    """Installed version (or None) of each name, asked to the interpreter itself: no pip involved."""
+    output = subprocess.check_output([python_executable, "-c", INSTALLED_VERSIONS_SNIPPET, json.dumps(list(names))],
+                                     text=True)
+    return json.loads(output)
+
+
+def unsatisfied(python_executable, requirements):
+    """The requirements the selected interpreter doesn't satisfy yet."""
+    parsed = {requirement: parse_requirement(requirement) for requirement in requirements}
+    versions = installed_versions(python_executable, {name for name, _ in parsed.values()})
+    return [requirement for requirement, (name, specifier) in parsed.items()
+            if not is_satisfied(specifier, versions.get(name))]
+
+
+def json_digest(json_file):
+    with open(json_file, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def read_lock(lock_file, digest):
+    """Pinned requirements of the lockfile, or None if there's none or python_packages.json changed since."""
+    if not os.path.isfile(lock_file):
+        return None
+    with open(lock_file, "r") as file:
+        lines = [line.strip() for line in file]
+    if not lines or lines[0] != f"{LOCK_HEADER} {digest}":
+        print(f"{lock_file} doesn't match python_packages.json anymore: resolving again")
+        return None
+    return [line for line in lines if line and not line.startswith("#")]
+
+
+def write_lock(lock_file, digest, pins):
+    temp_file = lock_file + ".tmp"
+    with open(temp_file, "w") as file:
+        file.write(f"{LOCK_HEADER} {digest}\n")
+        file.write(f"# Resolved by python_packages.py --batch for Python {platform_tag()}: do not edit\n")
+        for pin in sorted(pins, key=str.lower):
+            file.write(pin + "\n")
+    os.replace(temp_file, lock_file)
+    print(f"Lockfile written: {lock_file} ({len(pins)} packages)")
+
+
+def platform_tag():
+    return f"{sys.version_info.major}.{sys.version_info.minor} on {sys.platform}"
+
+
+def resolve(python_executable, requirements, wheelhouse, ignore_installed=False):
+    """
+    Resolve the requirements once and return what pip would install, pinned, e.g.
+    ["openai==1.30.1", "httpx==0.27.0", ...]. Against the installed environment that's only
+    the missing packages and the dependencies they still need: an installed package that
+    satisfies them is left as it is. With ignore_installed, the complete set (for the lockfile).
+    """
+    with tempfile.TemporaryDirectory() as temp_dir:
+        report_file = os.path.join(temp_dir, "report.json")
+        command = [python_executable, "-m", "pip", "install", "--dry-run", "--quiet", "--report", report_file,
+                   "--find-links", wheelhouse]
+        if ignore_installed:
+            command.append("--ignore-installed")
+        subprocess.check_call(command + requirements)
+        with open(report_file, "r") as file:
+            report = json.load(file)
+    return [f"{item['metadata']['name']}=={item['metadata']['version']}" for item in report["install"]]
+
+
+def wheelhouse_contents(wheelhouse):
+    """(normalized name, version) of every wheel in the wheelhouse."""
+    contents = set()
+    for filename in os.listdir(wheelhouse):
+        if filename.endswith(".whl"):
+            name, version = filename.split("-")[:2]
+            contents.add((normalize_name(name), version))
+    return contents
+
+
+def split_pin(pin):
+    name, version = pin.split("==", 1)
+    return normalize_name(name.strip()), version.strip()
+
+
+def fill_wheelhouse(python_executable, pins, wheelhouse, offline):
+    """Put a wheel of every pin in the wheelhouse: only the missing ones are downloaded or built."""
+    available = wheelhouse_contents(wheelhouse)
+    missing = [pin for pin in pins if split_pin(pin) not in available]
+    if not missing:
+        return
+    if offline:
+        raise RuntimeError(f"Not in the wheelhouse, and --offline: {', '.join(missing)}")
+
+    # Pinned and --no-deps: nothing left to resolve, so the pins can be split among parallel pip processes
+    print(f"Adding {len(missing)} wheel(s) to {wheelhouse}...")
+    groups = [missing[i::BUILD_JOBS] for i in range(BUILD_JOBS) if missing[i::BUILD_JOBS]]
+    with ThreadPoolExecutor(max_workers=len(groups)) as executor:
+        for result in executor.map(lambda group: subprocess.run(
+                [python_executable, "-m", "pip", "wheel", "--quiet", "--no-deps", "--wheel-dir", wheelhouse,
+                 "--find-links", wheelhouse] + group), groups):
+            result.check_returncode()
+
+
+def install_batch(python_executable, json_file, wheelhouse, use_lock, offline):
+    """
+    Install everything in python_packages.json with a single resolution and a single pip install
+    from the wheelhouse. Nothing runs pip if every package is already satisfied.
+    Returns whether anything was installed.
+    """
+    with open(json_file, "r") as file:
+        requirements = list(json.load(file).keys())
+    os.makedirs(wheelhouse, exist_ok=True)
+    digest = json_digest(json_file)
+
+    pins = read_lock(LOCK_FILE, digest) if use_lock else None
+    if pins is None:
+        missing = unsatisfied(python_executable, requirements)
+        if not missing:
+            print("All the packages are already installed: nothing to do")
+            return False
+        if offline:
+            raise RuntimeError("--offline needs an up to date lockfile (run once online with --lock)")
+        if use_lock:
+            # The lockfile pins the complete set, so that a fresh Pi can be provisioned from it
+            print(f"Resolving {len(requirements)} package(s) and their dependencies...")
+            pins = resolve(python_executable, requirements, wheelhouse, ignore_installed=True)
+            write_lock(LOCK_FILE, digest, pins)
+        else:
+            print(f"Resolving {len(missing)} missing package(s) against the installed ones...")
+            pins = resolve(python_executable, missing, wheelhouse)
+
+    # With a lock, every dependency is checked too: an exact version is expected
+    needed = unsatisfied(python_executable, pins)
+    if not needed:
+        print("All the packages are already installed: nothing to do")
+        return False
+
+    fill_wheelhouse(python_executable, needed, wheelhouse, offline)
+    # The pins were resolved together (or locked): install them as they are, from the wheelhouse only
+    print(f"Installing {len(needed)} package(s) from {wheelhouse}...")
+    subprocess.check_call([python_executable, "-m", "pip", "install", "--no-index", "--no-deps",
+                           "--find-links", wheelhouse] + needed)
+    print(f"Message from autopackages.py script: successfully installed {', '.join(needed)}")
+    return True
+
+
 def print_installed_packages(python_executable):
     try:
         output = subprocess.check_output([python_executable, "-m", "pip", "list", "--format=json"], text=True)
@@ -60,15 +265,32 @@ def print_installed_packages(python_executable):
     except Exception as e:
         print(f"Failed to get list of installed packages: {e}")
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Install the Python packages listed in python_packages.json.")
+    parser.add_argument("--python", help="Python interpreter to install into (asked interactively if omitted)")
+    parser.add_argument("--batch", action="store_true",
+                        help="resolve the whole set once and install it in one go from a local wheelhouse")
+    parser.add_argument("--wheelhouse", default=WHEELHOUSE_DIR, help="wheel cache directory (batch mode)")
+    parser.add_argument("--lock", action="store_true",
+                        help="install what python_packages.lock pins, writing it if missing (batch mode)")
+    parser.add_argument("--offline", action="store_true",
+                        help="use only the lockfile and the wheelhouse, never the network (batch mode)")
+    return parser.parse_args()
+
+
 def main():
-    installations = find_python_installations()
-    if not installations:
-        print("No Python installations found.")
-        sys.exit(1)
-    
-    python_executable = select_python_installation(installations)
-    
-    json_file = "python_packages.json"
+    args = parse_args()
+    if args.python:
+        python_executable = args.python
+    else:
+        installations = find_python_installations()
+        if not installations:
+            print("No Python installations found.")
+            sys.exit(1)
+
+        python_executable = select_python_installation(installations)
+
+    json_file = JSON_FILE
     if not os.path.isfile(json_file):
         print(f"JSON file '{json_file}' not found.")
         sys.exit(1)
@@ -84,8 +306,18 @@ def main():
     if not isinstance(package_list, list):
         print("JSON file should contain a list of packages.")
         sys.exit(1)
-    
-    install_packages(python_executable, package_list)
+
+    if args.batch:
+        try:
+            installed = install_batch(python_executable, json_file, os.path.abspath(args.wheelhouse),
+                                      args.lock or args.offline, args.offline)
+        except (subprocess.CalledProcessError, RuntimeError) as e:
+            print(f"Batch install failed: {e}")
+            sys.exit(1)
+        if not installed:
+            return
+    else:
+        install_packages(python_executable, package_list)
     print_installed_packages(python_executable)
     
 if __name__ == "__main__":
@@ -1,9 +1,22 @@
 import os
+import re
+import sys
 import subprocess
 import shutil
 import json
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 
 JSON_CONFIG_FILENAME = 'python_packages_from_git.json'
+DIST_PACKAGES = "/usr/lib/python3/dist-packages"
+# Shallow, sparse clones kept between runs: a later run only fetches what changed upstream
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "rasputils", "git_repos")
+# Repositories processed at the same time in non-interactive mode
+JOBS = 4
+# Never part of the hash: they appear in an installed tree as soon as it's imported
+IGNORED_NAMES = ("__pycache__", ".git")
+IGNORED_SUFFIXES = (".pyc", ".pyo")
 
 def run_command(command, sudo=False):
     """Run a command with optional sudo."""
@@ -12,68 +25,146 @@ def run_command(command, sudo=False):
     result = subprocess.run(command, shell=True, check=True, text=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     return result.stdout
 
-def install_module(repo_url, subfolder, destination):
-    """Clone a repo, copy a subfolder, and clean up."""
-
-    # Name of the directory of the repo; this is retrieved from the repo_url by getting the name of the last folder
-    repo_dir = repo_url.split('/')[-1].replace('.git', '')
-
-    # Clone the repository (not that repo_url must have the .git extension at the end)
-    print(f"Cloning the repository from {repo_url}...")
-    run_command(f"git clone {repo_url}")
+def git(*args, cwd=None):
+    """Run git without ever prompting (for credentials either)."""
+    env = dict(os.environ, GIT_TERMINAL_PROMPT="0")
+    result = subprocess.run(["git"] + list(args), cwd=cwd, env=env, check=True, text=True,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return result.stdout
 
-    # Change current directory into the repository directory
-    os.chdir(repo_dir)
+def cache_path(repo_url):
+    """Cache folder of a repo: its name plus a digest of the URL, so two forks don't collide."""
+    repo_dir = repo_url.rstrip('/').split('/')[-1].replace('.git', '')
+    digest = hashlib.sha256(repo_url.encode()).hexdigest()[:12]
+    return os.path.join(CACHE_DIR, f"{re.sub(r'[^A-Za-z0-9._-]', '_', repo_dir)}-{digest}")
+
+def update_repo(repo_url, subfolders):
+    """
+    Bring the cached clone of repo_url to the tip of its default branch, with only the
+    given subfolders checked out. The first time it's a shallow clone with no blobs but
+    those of the subfolders; afterwards a shallow fetch. Returns the clone's path.
+    """
+    repo_path = cache_path(repo_url)
+    if not os.path.isdir(os.path.join(repo_path, ".git")):
+        print(f"Cloning {repo_url} (shallow, sparse: {', '.join(subfolders)})...")
+        shutil.rmtree(repo_path, ignore_errors=True)
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        git("clone", "--quiet", "--depth", "1", "--filter=blob:none", "--sparse", "--no-checkout", repo_url, repo_path)
+        git("sparse-checkout", "set", *subfolders, cwd=repo_path)
+        git("checkout", "--quiet", cwd=repo_path)
+    else:
+        print(f"Updating the cached clone of {repo_url}...")
+        git("sparse-checkout", "set", *subfolders, cwd=repo_path)
+        git("fetch", "--quiet", "--depth", "1", "origin", "HEAD", cwd=repo_path)
+        git("reset", "--quiet", "--hard", "FETCH_HEAD", cwd=repo_path)
+    return repo_path
+
+def tree_digest(path):
+    """Digest of a folder's files (relative paths and contents), None if it doesn't exist."""
+    if not os.path.isdir(path):
+        return None
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(name for name in dirs if name not in IGNORED_NAMES)
+        for name in sorted(files):
+            if name.endswith(IGNORED_SUFFIXES):
+                continue
+            file_path = os.path.join(root, name)
+            digest.update(os.path.relpath(file_path, path).encode() + b"\0")
+            with open(file_path, "rb") as f:
+                for chunk in iter(lambda: f.read(65536), b""):
+                    digest.update(chunk)
+            digest.update(b"\0")
+    return digest.hexdigest()
+
+def confirm(question):
+    return input(f"{question} (y/n): ").strip().lower() != 'n'
+
+def install_module(repo_url, subfolder, destination, dist_packages=DIST_PACKAGES, assume_yes=False, repo_path=None):
+    """Copy a subfolder of a repo (from its cached clone) into dist-packages, unless it's there already."""
+    if repo_path is None:
+        repo_path = update_repo(repo_url, [subfolder])
+    source_path = os.path.join(repo_path, subfolder)
+    if not os.path.isdir(source_path):
+        print(f"{subfolder} not found in {repo_url}, skipping it.")
+        return False
 
     # Construct the full destination path. OSS: the "destination" parameter  in json is relative to "/usr/lib/python3/dist-packages"
-    destination_path = os.path.join("/usr/lib/python3/dist-packages", destination)
-
-    # Prompt the user about the operations we're going to take
-    response = input(f"The folder {subfolder} from the repo {repo_url} will be copied into {destination}. Do you want to proceed? (y/n): ").strip().lower()
-    if response == 'n':
-        os.chdir("..")
-        shutil.rmtree(repo_dir)
-        return
-
-    # Check if the module already exitsts in the destination directory; in this case, prompt the user if wants to proceed overwriting
-    module_folder_in_dist_packages = os.path.join(destination_path, subfolder)
-    if os.path.exists(module_folder_in_dist_packages):
-        response = input(f"Directory {module_folder_in_dist_packages} already exists. Do you want to overwrite its content? (y/n): ").strip().lower()
-        if response == 'n':
-            os.chdir("..")
-            shutil.rmtree(repo_dir)
-            return
-
-    # Copy the subfolder to the destination directory
+    destination_path = os.path.join(dist_packages, destination or "")
+    module_folder_in_dist_packages = os.path.join(destination_path, os.path.basename(subfolder.rstrip('/')))
+
+    # Same files already installed: nothing to copy, nothing to ask
+    if tree_digest(source_path) == tree_digest(module_folder_in_dist_packages):
+        print(f"{module_folder_in_dist_packages} is up to date.")
+        return False
+
+    if not assume_yes:
+        # Prompt the user about the operations we're going to take
+        if not confirm(f"The folder {subfolder} from the repo {repo_url} will be copied into {destination_path}. Do you want to proceed?"):
+            return False
+        # The module already exists in the destination directory: prompt the user if wants to proceed overwriting
+        if os.path.exists(module_folder_in_dist_packages) and \
+                not confirm(f"Directory {module_folder_in_dist_packages} already exists. Do you want to overwrite its content?"):
+            return False
+
+    # Replace the installed copy, so files removed upstream don't linger
     print(f"Copying {subfolder} to {destination_path}...")
-    source_path = os.path.abspath(subfolder)
-    copy_command = f"cp -r {source_path} {destination_path}"
-    run_command(copy_command, sudo=True)
-
-    # Go back to the previous directory
-    os.chdir("..")
-
-    # Delete the repository folder
-    print(f"Deleting the repository folder {repo_dir}...")
-    shutil.rmtree(repo_dir)
+    sudo = not os.access(destination_path if os.path.isdir(destination_path) else dist_packages, os.W_OK)
+    run_command(f"mkdir -p '{destination_path}'", sudo=sudo)
+    run_command(f"rm -rf '{module_folder_in_dist_packages}'", sudo=sudo)
+    run_command(f"cp -r '{source_path}' '{destination_path}'", sudo=sudo)
 
     print(f"Module from {repo_url} installed successfully.")
+    return True
+
+def install_repo(repo_url, entries, dist_packages, assume_yes):
+    """All the entries of one repo: a single fetch, then a copy per subfolder."""
+    repo_path = update_repo(repo_url, [entry["subfolder"] for entry in entries])
+    return [install_module(repo_url, entry["subfolder"], entry.get("destination"), dist_packages, assume_yes,
+                           repo_path=repo_path)
+            for entry in entries]
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Install subfolders of git repositories as Python packages.")
+    parser.add_argument("-y", "--yes", action="store_true",
+                        help="don't ask anything, and process the repositories in parallel")
+    parser.add_argument("--dist-packages", default=DIST_PACKAGES, help="where the packages are copied")
+    parser.add_argument("--config", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), JSON_CONFIG_FILENAME))
+    return parser.parse_args()
 
 def main():
+    args = parse_args()
+
     # Load configuration from JSON file
-    with open(JSON_CONFIG_FILENAME, 'r') as f:
+    with open(args.config, 'r') as f:
         config_entries = json.load(f)
 
+    # Entries of the same repo share its clone, so they're handled together
+    repos = {}
     for entry in config_entries:
         git_repo = entry.get("git_repo")
         subfolder = entry.get("subfolder")
-        destination = entry.get("destination")
-        
+
         if not git_repo or not subfolder:
             print("Skipping entry due to missing required fields.")
             continue
 
-        install_module(git_repo, subfolder, destination)
+        repos.setdefault(git_repo, []).append(entry)
+
+    failures = 0
+    # Prompts can't be interleaved: only the non-interactive mode goes parallel
+    with ThreadPoolExecutor(max_workers=JOBS if args.yes else 1) as executor:
+        futures = {repo_url: executor.submit(install_repo, repo_url, entries, args.dist_packages, args.yes)
+                   for repo_url, entries in repos.items()}
+        for repo_url, future in futures.items():
+            try:
+                future.result()
+            except subprocess.CalledProcessError as e:
+                failures += 1
+                print(f"Failed to install from {repo_url}: {(e.stderr or '').strip() or e}")
+
+    if failures:
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
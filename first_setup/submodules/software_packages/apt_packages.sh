@@ -1,10 +1,10 @@
 #!/bin/bash
 
 # Multimedia
-sudo apt install mplayer
+sudo apt -y install mplayer
 
 # Developer tools
-sudo apt install code
+sudo apt -y install code
 sudo apt -y install zsh
 sudo apt -y install neovim
 sudo apt -y install stacer
@@ -12,7 +12,7 @@ sudo apt -y install cockpit
 
 # Networking tools
 # SAMBA: info on https://pimylifeup.com/raspberry-pi-samba/
-sudo apt install samba samba-common-bin
+sudo apt -y install samba samba-common-bin
 
 
 # UI improovements
@@ -21,4 +21,5 @@ sudo apt install samba samba-common-bin
 # sudo apt install cairo-dock-plug-ins
 
 
-sleep 100
\ No newline at end of file
+# Keep the window open when run by hand (not when run by first_setup.py)
+if [ -z "$FIRST_SETUP_RUNNER" ]; then sleep 100; fi
\ No newline at end of file
@@ -1,9 +1,10 @@
 #!/bin/bash
 
 # Snapstore (Canonical package manager)
-sudo apt install snapd
+sudo apt -y install snapd
 sudo snap install snapd
 sudo snap install core
 
 
-sleep 100
+# Keep the window open when run by hand (not when run by first_setup.py)
+if [ -z "$FIRST_SETUP_RUNNER" ]; then sleep 100; fi
@@ -1,15 +1,140 @@
 import json
 import os
+import re
+import sys
+import shutil
+import argparse
+import tempfile
 import subprocess
 
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+JSON_FILE = os.path.join(SCRIPT_DIR, "custom_configtxt.json")
+# Bookworm moved config.txt to /boot/firmware (/boot/config.txt is then only a pointer to it)
+CONFIG_FILE_LOCATIONS = ("/boot/firmware/config.txt", "/boot/config.txt")
+
+SETTING_RE = re.compile(r"^\s*([A-Za-z0-9_]+)\s*=\s*(.*?)\s*$")
+SECTION_RE = re.compile(r"^\s*(\[[^\]]*\])\s*$")
+# Sections whose settings apply to every board ([all], and the lines before any section)
+UNCONDITIONAL = (None, "[all]")
+# Keys that can appear several times, each line adding something: a line is there or it isn't
+MULTI_VALUE_KEYS = ("dtoverlay", "dtparam", "include", "gpio")
+
+
+class Block:
+    """A run of config.txt lines under one section header (None: the lines before the first one)."""
+
+    def __init__(self, section, header_line=None):
+        self.section = section
+        self.header_line = header_line
+        self.lines = []
+
+
+def parse_config(text):
+    blocks = [Block(None)]
+    for line in text.splitlines():
+        match = SECTION_RE.match(line)
+        if match:
+            blocks.append(Block(match.group(1).lower(), line))
+        else:
+            blocks[-1].lines.append(line)
+    return blocks
+
+
+def render_config(blocks):
+    lines = []
+    for block in blocks:
+        if block.header_line is not None:
+            lines.append(block.header_line)
+        lines.extend(block.lines)
+    return "\n".join(lines) + "\n"
+
+
+def parse_setting(line):
+    """(key, value) of a setting line, None for comments and blank lines."""
+    if line.lstrip().startswith("#"):
+        return None
+    match = SETTING_RE.match(line)
+    return (match.group(1).lower(), match.group(2)) if match else None
+
+
+def group_settings(config_lines):
+    """(section, line) of a group's config_lines: a "[pi4]"-like line switches section, [all] otherwise."""
+    section = "[all]"
+    settings = []
+    for line in config_lines:
+        match = SECTION_RE.match(line)
+        if match:
+            section = match.group(1).lower()
+        elif parse_setting(line):
+            settings.append((section, line.strip()))
+    return settings
+
+
+def same_section(block, section):
+    if section in UNCONDITIONAL:
+        return block.section in UNCONDITIONAL
+    return block.section == section
+
+
+def merge_setting(blocks, section, line):
+    """
+    Make line effective in section, editing as little as possible. Returns a description
+    of the change, or None if the configuration already has it.
+    """
+    key, value = parse_setting(line)
+    matching = [block for block in blocks if same_section(block, section)]
+
+    if key in MULTI_VALUE_KEYS:
+        if any(parse_setting(existing) == (key, value) for block in matching for existing in block.lines):
+            return None
+        append_setting(blocks, section, line)
+        return f"added {key}={value} to {section}"
+
+    # The last occurrence is the effective one
+    occurrences = [(block, i) for block in matching for i, existing in enumerate(block.lines)
+                   if (parse_setting(existing) or (None,))[0] == key]
+    if occurrences:
+        block, i = occurrences[-1]
+        old_value = parse_setting(block.lines[i])[1]
+        if old_value == value:
+            return None
+        block.lines[i] = line
+        # Earlier occurrences were overridden anyway (e.g. left by a blind append): drop them
+        for block, i in reversed(occurrences[:-1]):
+            del block.lines[i]
+        return f"changed {key} from {old_value} to {value} in {section}"
+    append_setting(blocks, section, line)
+    return f"added {key}={value} to {section}"
+
+
+def append_setting(blocks, section, line):
+    """Add line at the end of the last block of section, or in a new block of it at the end of the file."""
+    last = blocks[-1]
+    if not same_section(last, section):
+        if last.lines and last.lines[-1].strip():
+            last.lines.append("")
+        last = Block(section, section)
+        blocks.append(last)
+    # Before the blank lines closing the block
+    position = len(last.lines)
+    while position > 0 and not last.lines[position - 1].strip():
+        position -= 1
+    last.lines.insert(position, line)
+
+
 class ConfigManager:
     def __init__(self, config_file, json_file):
         self.config_file = config_file
         self.json_file = json_file
 
     def backup_config(self):
+        if not os.path.isfile(self.config_file):
+            return
         backup_file = self.config_file + ".bak"
-        os.system(f"sudo cp {self.config_file} {backup_file}")
+        if self.writable():
+            shutil.copy2(self.config_file, backup_file)
+        else:
+            subprocess.run(["sudo", "cp", "-p", self.config_file, backup_file], check=True)
         print(f"Backup of config.txt created at {backup_file}")
 
     def load_modifications(self):
@@ -17,28 +142,95 @@ class ConfigManager:
             modifications = json.load(file)
         return modifications
 
-    def apply_modifications(self, group_name):
+    def read_config(self):
+        try:
+            with open(self.config_file, 'r') as file:
+                return file.read()
+        except FileNotFoundError:
+            return ""
+
+    def plan(self, group_names):
+        """The merged config.txt text for these groups, and the list of changes it makes."""
         modifications = self.load_modifications()
+        original = self.read_config()
+        blocks = parse_config(original)
+        changes = []
+        for group_name in group_names:
+            for section, line in group_settings(modifications[group_name]['config_lines']):
+                change = merge_setting(blocks, section, line)
+                if change:
+                    changes.append(change)
+        return (render_config(blocks) if changes else original), changes
 
-        if group_name not in modifications:
-            print(f"No modification group named '{group_name}' found.")
-            return
+    def write_config(self, text):
+        """Replace config.txt in one step: a power cut leaves either the old file or the new one."""
+        directory = os.path.dirname(os.path.abspath(self.config_file))
+        with tempfile.NamedTemporaryFile('w', dir=directory if self.writable() else None,
+                                         prefix=".config.txt.", delete=False) as file:
+            file.write(text)
+            file.flush()
+            os.fsync(file.fileno())
+            temp_file = file.name
+        # Temporary files are private: keep the permissions of the file it replaces
+        mode = os.stat(self.config_file).st_mode & 0o777 if os.path.isfile(self.config_file) else 0o644
+        os.chmod(temp_file, mode)
+
+        if os.path.dirname(temp_file) == directory:
+            os.replace(temp_file, self.config_file)
+        else:
+            # Not writable by us: stage a copy next to it with sudo, then rename it over
+            staged_file = os.path.join(directory, ".config.txt.new")
+            try:
+                subprocess.run(["sudo", "cp", temp_file, staged_file], check=True)
+                subprocess.run(["sudo", "sync", staged_file], check=True)
+                subprocess.run(["sudo", "mv", "-f", staged_file, self.config_file], check=True)
+            finally:
+                os.unlink(temp_file)
 
-        group = modifications[group_name]
-        self.backup_config()
+    def writable(self):
+        return os.access(os.path.dirname(os.path.abspath(self.config_file)), os.W_OK)
 
-        # Append modifications to the config.txt
-        with open(self.config_file, 'a') as file:
-            for line in group['config_lines']:
-                file.write(line + "\n")
-            print(f"Applied modifications from group '{group_name}' to config.txt")
+    def apply_modifications(self, *group_names, dry_run=False):
+        """
+        Merge the config_lines of the groups into config.txt: settings already in effect are
+        left alone, and the file is only written when something changes. Returns True if a
+        reboot is needed for the changes to take effect.
+        """
+        modifications = self.load_modifications()
+        unknown = [group_name for group_name in group_names if group_name not in modifications]
+        for group_name in unknown:
+            print(f"No modification group named '{group_name}' found.")
+        group_names = [group_name for group_name in group_names if group_name not in unknown]
+        if not group_names:
+            return False
+
+        text, changes = self.plan(group_names)
+        for change in changes:
+            print(f"config.txt: {change}")
+        if not changes:
+            print(f"config.txt already has the settings of {', '.join(group_names)}: left untouched")
+        elif not dry_run:
+            self.backup_config()
+            self.write_config(text)
+            print(f"Applied modifications from {', '.join(group_names)} to config.txt")
 
         # Run any additional commands if specified
-        if 'commands' in group:
-            for command in group['commands']:
+        for group_name in group_names:
+            for command in modifications[group_name].get('commands', []):
+                if dry_run:
+                    print(f"Would execute command: {command}")
+                    continue
                 subprocess.run(command, shell=True)
                 print(f"Executed command: {command}")
 
+        # config.txt is only read by the firmware at boot
+        reboot_needed = bool(changes)
+        if dry_run:
+            print("A reboot would be needed." if reboot_needed else "No reboot would be needed.")
+        else:
+            print("Reboot needed for the changes to take effect." if reboot_needed else "No reboot needed.")
+        return reboot_needed
+
     def prompt_user_and_apply(self):
         modifications = self.load_modifications()
         print("Available modification groups:")
@@ -46,5 +238,33 @@ class ConfigManager:
             print(f" - {group_name}")
 
         group_name = input("Enter the name of the modification group to apply: ")
-        self.apply_modifications(group_name)
+        return self.apply_modifications(group_name)
+
+
+def default_config_file():
+    return next((path for path in CONFIG_FILE_LOCATIONS if os.path.isfile(path)), CONFIG_FILE_LOCATIONS[0])
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Merge groups of settings of custom_configtxt.json into config.txt.")
+    parser.add_argument("groups", nargs="*", help="groups to apply (asked interactively if omitted)")
+    parser.add_argument("--config-file", default=default_config_file())
+    parser.add_argument("--dry-run", action="store_true", help="only print what would change")
+    parser.add_argument("--reboot-exit-code", type=int, default=0,
+                        help="exit with this code when a reboot is needed (e.g. 100, for scripts)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    manager = ConfigManager(args.config_file, JSON_FILE)
+    if args.groups:
+        reboot_needed = manager.apply_modifications(*args.groups, dry_run=args.dry_run)
+    else:
+        reboot_needed = manager.prompt_user_and_apply()
+    if reboot_needed:
+        sys.exit(args.reboot_exit_code)
+
 
+if __name__ == "__main__":
+    main()
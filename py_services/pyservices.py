@@ -1,10 +1,14 @@
 import json
 import os
+import argparse
 import subprocess
 import sys
 
-def create_service_file(service_name, script_path, working_directory, user, stdout_path, stderr_path):
-    service_content = f"""[Unit]
+SYSTEMD_DIR = "/etc/systemd/system"
+SERVICES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "services.json")
+
+def render_service_file(service_name, script_path, working_directory, user, stdout_path, stderr_path):
+    return f"""[Unit]
 Description={service_name}
 After=multi-user.target
 
@@ -20,54 +24,128 @@ User={user}
 WantedBy=multi-user.target
 """
 
-    service_file_path = f"/etc/systemd/system/{service_name}.service"
-    
+def render_service(service):
+    return render_service_file(service['service_name'], service['script_path'], service['working_directory'],
+                               service['user'], service.get('standard_output', '/dev/null'),
+                               service.get('standard_error', '/dev/null'))
+
+def service_file_path(service_name):
+    return os.path.join(SYSTEMD_DIR, f"{service_name}.service")
+
+def read_installed(service_name):
     try:
-        # Write the service file
-        with open(service_file_path, 'w') as service_file:
-            service_file.write(service_content)
-        print(f"Service file created at {service_file_path}")
+        with open(service_file_path(service_name), 'r') as service_file:
+            return service_file.read()
+    except FileNotFoundError:
+        return None
 
-        # Reload systemd daemon
-        subprocess.run(["sudo", "systemctl", "daemon-reload"], check=True)
+def write_service_file(service_name, content):
+    """Write the unit through a temporary file, so systemd never reads half of it."""
+    path = service_file_path(service_name)
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w') as service_file:
+        service_file.write(content)
+    os.chmod(temp_path, 0o644)
+    os.replace(temp_path, path)
+    print(f"Service file written at {path}")
+
+def systemctl(*args):
+    subprocess.run(["sudo", "systemctl"] + list(args), check=True)
+
+def unit_states(service_names):
+    """unit -> (UnitFileState, ActiveState) of all the units, with a single systemctl call."""
+    units = [f"{name}.service" for name in service_names]
+    output = subprocess.run(["systemctl", "show", "--property=Id,UnitFileState,ActiveState"] + units,
+                            check=True, text=True, stdout=subprocess.PIPE).stdout
+    states = {}
+    for block in output.strip().split("\n\n"):
+        properties = dict(line.split("=", 1) for line in block.splitlines() if "=" in line)
+        if "Id" in properties:
+            states[properties["Id"]] = (properties.get("UnitFileState", ""), properties.get("ActiveState", ""))
+    return states
+
+def deploy(services, dry_run=False):
+    """
+    Render every unit, write only the ones that differ from what's installed, then reload
+    systemd once and enable / start / restart, each with one systemctl call, only the units
+    that need it. Returns the names of the units whose file changed.
+    """
+    changed = []
+    for service in services:
+        service_name = service['service_name']
+        content = render_service(service)
+        if read_installed(service_name) == content:
+            continue
+        changed.append(service_name)
+        if dry_run:
+            print(f"Would write {service_file_path(service_name)}")
+        else:
+            write_service_file(service_name, content)
+
+    names = [service['service_name'] for service in services]
+    if dry_run:
+        print(f"{len(changed)} of {len(names)} service file(s) would change")
+        return changed
+
+    if changed:
+        systemctl("daemon-reload")
         print("Systemd daemon reloaded")
 
-        # Enable the service to start on boot
-        subprocess.run(["sudo", "systemctl", "enable", service_name], check=True)
-        print(f"Service {service_name} enabled")
+    states = unit_states(names)
+    to_enable, to_start, to_restart = [], [], []
+    for name in names:
+        unit_file_state, active_state = states.get(f"{name}.service", ("", ""))
+        if unit_file_state != "enabled":
+            to_enable.append(name)
+        if active_state not in ("active", "activating", "reloading"):
+            to_start.append(name)
+        elif name in changed:
+            # Running with the old definition
+            to_restart.append(name)
 
-        # Start the service
-        subprocess.run(["sudo", "systemctl", "start", service_name], check=True)
-        print(f"Service {service_name} started")
-    except Exception as e:
-        print(f"Failed to create or enable service {service_name}: {e}")
+    if to_enable:
+        systemctl("enable", *to_enable)
+        print(f"Enabled: {', '.join(to_enable)}")
+    if to_start:
+        systemctl("start", *to_start)
+        print(f"Started: {', '.join(to_start)}")
+    if to_restart:
+        systemctl("restart", *to_restart)
+        print(f"Restarted: {', '.join(to_restart)}")
+    if not (changed or to_enable or to_start or to_restart):
+        print("All the services are up to date and running")
+    return changed
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Install the services of services.json as systemd units.")
+    parser.add_argument("--services-file", default=SERVICES_FILE)
+    parser.add_argument("--dry-run", action="store_true", help="only tell which unit files would change")
+    return parser.parse_args()
 
 def main():
+    args = parse_args()
+
     # Check if the script is running with sudo/root privileges
-    if os.geteuid() != 0:
+    if os.geteuid() != 0 and not args.dry_run:
         print("This script requires sudo/root privileges. Please run the script with 'sudo'.")
         sys.exit(1)
 
     # Load JSON file
     try:
-        with open('services.json', 'r') as json_file:
+        with open(args.services_file, 'r') as json_file:
             data = json.load(json_file)
     except FileNotFoundError:
-        print("The 'services.json' file was not found.")
+        print(f"The '{args.services_file}' file was not found.")
         sys.exit(1)
     except json.JSONDecodeError:
-        print("Error decoding JSON from 'services.json'.")
+        print(f"Error decoding JSON from '{args.services_file}'.")
         sys.exit(1)
 
-    for service in data['services']:
-        service_name = service['service_name']
-        script_path = service['script_path']
-        working_directory = service['working_directory']
-        user = service['user']
-        stdout_path = service.get('standard_output', '/dev/null')
-        stderr_path = service.get('standard_error', '/dev/null')
-        
-        create_service_file(service_name, script_path, working_directory, user, stdout_path, stderr_path)
+    try:
+        deploy(data['services'], dry_run=args.dry_run)
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"Failed to deploy the services: {e}")
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()